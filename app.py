@@ -1,68 +1,131 @@
 import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
 
 import telebot
 
 
 from config import *
-from law_agent import LawAgent
+from law_agent import LawAgent, load_checkpoint
+from utils.job_queue import JobQueue
 
 
 
+telebot.apihelper.API_URL = TELEGRAM_API_URL.rstrip("/") + "/bot{0}/{1}"
+telebot.apihelper.FILE_URL = TELEGRAM_API_URL.rstrip("/") + "/file/bot{0}/{1}"
 bot = telebot.TeleBot(os.environ["BOT_TOKEN"]) # create a bot instance
 
 bot_commands = [
-    "/new"
+    "/new",
+    "/start",
+    "/status"
 ]
 
-la = LawAgent()
-# la.run("Wie schnell darf ich auf der Autobahn fahren?")
-# la.run("Wie lange darf ein sich ein 15 jähriger in der Nacht auf der Straße aufhalten?")
+# replies and stage updates are sent from their own threads, a slow telegram request never blocks an agent
+notifier = ThreadPoolExecutor(max_workers=2, thread_name_prefix="bot-notify")
 
 
 
-@bot.message_handler(commands=bot_commands)
-def send_welcome(message):
+def split_message(text, max_chars=BOT_MESSAGE_MAX_CHARS):
+    # telegram rejects longer messages -> split at paragraphs (or hard if a paragraph is too long)
+    parts, current = [], ""
+    for paragraph in text.split("\n\n"):
+        while len(paragraph) > max_chars:
+            if len(current) > 0: parts.append(current); current = ""
+            parts.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if len(current) > 0 and len(current) + len(paragraph) + 2 > max_chars:
+            parts.append(current); current = ""
+        current = f"{current}\n\n{paragraph}" if len(current) > 0 else paragraph
+    if len(current.strip()) > 0: parts.append(current)
+    return parts
 
-    # la.run("Wie schnell darf ich auf der Autobahn fahren?")
 
+def send(chat_id, text, reply_to_message_id=None):
+    for part in split_message(text):
+        bot.send_message(chat_id, part, reply_to_message_id=reply_to_message_id)
 
-    # assert that command is valid
-    assert message.text in bot_commands, f"Command {message.text} is not valid."
 
+def notify(chat_id, text, reply_to_message_id=None):
+    def report_error(future):
+        if future.exception() is not None: print(f"sending to {chat_id} failed: {future.exception()}")
+    notifier.submit(send, chat_id, text, reply_to_message_id).add_done_callback(report_error)
 
-    # TODO: use reponse to refine question -> alignment between agent and user
 
+def format_answer(result):
+    final_report = result["final_report"]
+    if not isinstance(final_report, dict):
+        return "Leider habe ich keine Antwort auf deine Frage gefunden."
 
-    # TODO: la.run(question)
+    text = str(final_report.get("einfache_antwort", "")).strip()
+    if len(str(final_report.get("komplexe_antwort", "")).strip()) > 0:
+        text += f"\n\nAusführlich:\n{str(final_report['komplexe_antwort']).strip()}"
+    if len(result["gesetze_durchsucht"]) > 0:
+        text += "\n\nDurchsuchte Gesetze:\n" + "\n".join(result["gesetze_durchsucht"])
+    return text
 
 
-    # TODO: Format response/final_report
-    
 
+def answer_question(job):
+    # runs on a worker thread: one agent (and event loop) per question, stage updates go to the chat
+    chat_id, message_id = job["chat_id"], job["message_id"]
+    la = LawAgent(on_progress=lambda stage, text: notify(chat_id, text))
+    try:
+        # a question whose run was cut off (crash, deploy) continues after its last completed stage
+        result = la.run(load_checkpoint(job["question"]) or job["question"])
+    except Exception:
+        notify(chat_id, "Beim Beantworten deiner Frage ist ein Fehler aufgetreten, bitte versuche es noch einmal.", message_id)
+        raise
+    notify(chat_id, format_answer(result), message_id)
 
 
+jobs = JobQueue(answer_question, max_workers=BOT_WORKERS, max_queued=BOT_MAX_QUEUED_JOBS, name="bot")
 
 
-    bot.reply_to(message, "Hello, I'm a telegram bot written in python.")
 
+@bot.message_handler(commands=[c.lstrip("/") for c in bot_commands])
+def send_welcome(message):
 
+    if message.text.startswith("/status"):
+        m = jobs.metrics()
+        bot.reply_to(message, f"{m['running']} Fragen in Bearbeitung, {m['queued']} in der Warteschlange, {m['done']} beantwortet.")
+        return
 
-@bot.message_handler(func=lambda msg: True)
-def echo_all(message):
-    bot.reply_to(message, "I don't understand this message")
+    # TODO: use reponse to refine question -> alignment between agent and user
 
+    bot.reply_to(message, "Hallo! Ich beantworte Rechtsfragen anhand des österreichischen Bundesrechts (RIS). Schreib mir einfach deine Frage.")
 
 
 
+@bot.message_handler(func=lambda msg: True)
+def ask(message):
+    # only queue the question here, the polling thread must never wait for an agent
+    if not message.text:
+        bot.reply_to(message, "Bitte stelle deine Frage als Textnachricht.")
+        return
 
+    try:
+        ahead = jobs.submit({"chat_id": message.chat.id, "message_id": message.message_id, "question": message.text})
+    except queue.Full:
+        bot.reply_to(message, "Ich beantworte gerade zu viele Fragen, bitte versuche es in ein paar Minuten noch einmal.")
+        return
 
+    waiting = f" Vor deiner Frage sind noch {ahead} in der Warteschlange." if ahead > 0 else ""
+    bot.reply_to(message, f"Danke, ich suche die Antwort im RIS. Das dauert ein paar Minuten.{waiting}")
 
 
-if __name__ == "__main__":
 
-    bot.polling() # start listening for messages
 
+if __name__ == "__main__":
 
-    print("...done")
+    # long polling, see webhook_server.py for running several replicas behind a load balancer
+    bot.remove_webhook()
+    jobs.start()
+    try:
+        bot.polling() # start listening for messages
+    finally:
+        jobs.close(wait=False)
+        notifier.shutdown(wait=True)
 
 
+    print("...done")
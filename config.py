@@ -9,4 +9,107 @@ os.environ["BOT_TOKEN"] = TELEGRAM_BOT_TOKEN
 
 
 # Define directories
-CHAIN_DIR = "chains"
\ No newline at end of file
+CHAIN_DIR = "chains"
+ANSWERED_DIR = os.environ.get("LAW_AGENT_ANSWERED_DIR", "answered")
+BENCHMARK_DIR = "benchmarks"
+CHECKPOINT_DIR = os.environ.get("LAW_AGENT_CHECKPOINT_DIR", "checkpoints")     # state of unfinished runs, see load_checkpoint
+
+
+# LLM record/replay: "live" | "record" | "replay"
+LLM_MODE = os.environ.get("LAW_AGENT_LLM_MODE", "live")
+LLM_RECORDING_PATH = os.environ.get("LAW_AGENT_LLM_RECORDING", os.path.join(BENCHMARK_DIR, "recordings", "llm_recording.jsonl"))
+
+
+# Fachbegriffe are explained by concurrent sub-agents
+FACHBEGRIFFE_MAX_WORKERS = int(os.environ.get("LAW_AGENT_FACHBEGRIFFE_WORKERS", 4))
+FACHBEGRIFFE_MAX_DEPTH = 1
+
+
+# Persistent LLM response cache (set LAW_AGENT_LLM_CACHE=0 to bypass)
+LLM_CACHE_ENABLED = os.environ.get("LAW_AGENT_LLM_CACHE", "1") != "0"
+LLM_CACHE_PATH = os.environ.get("LAW_AGENT_LLM_CACHE_PATH", os.path.join("cache", "llm_cache.sqlite"))
+LLM_CACHE_MAX_ENTRIES = 50000
+LLM_CACHE_MAX_BYTES = 512 * 1024 * 1024
+LLM_CACHE_TTL = 30 * 24 * 3600
+
+
+# Shared token bucket per model (requests and tokens per minute)
+RATE_LIMITS = {
+    "gpt-3.5-turbo":        {"requests_per_minute": 3500, "tokens_per_minute": 90000},
+    "gpt-3.5-turbo-16k":    {"requests_per_minute": 3500, "tokens_per_minute": 180000},
+}
+RATE_LIMIT_MAX_RETRIES = 6
+
+
+# Malformed answers and unknown section names are repaired locally first, then asked again at most n times
+LLM_MAX_RETRIES = 2
+
+
+# Answers of near-duplicate questions (MinHash over the word stems of the question, see utils/answer_index.py): from a
+# similarity of ANSWER_REUSE_THRESHOLD the stored report is returned, from ANSWER_SEED_THRESHOLD the run starts
+# with the law that answered the similar question (e.g. the same situation by bike instead of by car)
+ANSWER_REUSE = os.environ.get("LAW_AGENT_ANSWER_REUSE", "1") != "0"
+ANSWER_REUSE_THRESHOLD = 0.9
+ANSWER_SEED_THRESHOLD = 0.5
+ANSWER_INDEX_PERMUTATIONS = 128
+
+
+# Local retrieval over the Bundesrecht index: "off" (walk the category tree), "confirm" (one call
+# to choose from the top k laws) or "skip" (take the best ranked law without asking the llm)
+RETRIEVAL_MODE = os.environ.get("LAW_AGENT_RETRIEVAL_MODE", "confirm")
+RETRIEVAL_TOP_K = 10
+RETRIEVAL_INDEX_PATH = os.path.join("ris", "bundesrecht_retrieval_index.json")
+
+
+# Paragraph level index over the cached gesetz structures
+GESETZ_STRUCTURE_DIR = os.path.join("ris", "bundesrecht")
+GESETZ_STRUCTURE_STREAMING = os.environ.get("LAW_AGENT_STRUCTURE_STREAMING", "1") != "0"     # parse laws while they download
+SECTION_INDEX_DIR = os.path.join("ris", "section_index")
+SECTION_INDEX_TOP_K = 8
+SECTION_INDEX_CONFIDENCE = 1.5     # best section is taken without asking if it scores 1.5x the runner-up
+SECTION_ANALYSIS_MAX_SECTIONS = 3   # chosen sections of a long law that are analysed concurrently
+
+
+# RIS scraping: shared keep-alive pool, politeness limit per host and a process pool for parsing
+RIS_FETCH_WORKERS = 8
+RIS_REQUESTS_PER_SECOND = float(os.environ.get("LAW_AGENT_RIS_RPS", 4.0))
+RIS_MAX_PER_HOST = 4
+RIS_PARSE_WORKERS = os.cpu_count() or 2
+RIS_INDEX_CHECKPOINT_PATH = os.path.join("ris", "bundesrecht_index_checkpoint.sqlite")
+
+
+# Conversation memory: earlier turns of an iteration sent along with every call (tokens per model),
+# beyond that the oldest turns are cut down to a short stub and then dropped
+MEMORY_HISTORY_TOKENS = {"4k": 1024, "16k": 4096}
+MEMORY_STUB_TOKENS = 128
+
+
+# Speculative exploration: fetch and analyse the top k laws of the retrieval shortlist at once, the first
+# one that answers the question wins and the others are cancelled (k <= 1: one law per iteration)
+SPECULATIVE_TOP_K = int(os.environ.get("LAW_AGENT_SPECULATIVE_K", 1))
+SPECULATIVE_TOKEN_BUDGET = int(os.environ.get("LAW_AGENT_SPECULATIVE_TOKENS", 60000))     # prompt tokens of one round
+
+
+# Telegram bot: questions are queued and answered by a bounded pool of workers, one agent per question
+BOT_WORKERS = int(os.environ.get("LAW_AGENT_BOT_WORKERS", 2))
+BOT_MAX_QUEUED_JOBS = int(os.environ.get("LAW_AGENT_BOT_MAX_QUEUED", 20))
+BOT_MESSAGE_MAX_CHARS = 4096     # telegram limit per message
+
+
+# Telegram api (point it to a local fake endpoint for tests) and the webhook server, see webhook_server.py
+TELEGRAM_API_URL = os.environ.get("LAW_AGENT_TELEGRAM_API_URL", "https://api.telegram.org")
+BOT_WEBHOOK_URL = os.environ.get("LAW_AGENT_WEBHOOK_URL", "")          # public https base url telegram posts to
+BOT_WEBHOOK_PATH = "/telegram/webhook"
+BOT_WEBHOOK_SECRET = os.environ.get("LAW_AGENT_WEBHOOK_SECRET", "")
+BOT_WEBHOOK_HOST = os.environ.get("LAW_AGENT_WEBHOOK_HOST", "0.0.0.0")
+BOT_WEBHOOK_PORT = int(os.environ.get("LAW_AGENT_WEBHOOK_PORT", 8080))
+
+
+# Tracing: one span per stage of a run (wall time, llm calls, tokens, cache hits, retries) appended to a jsonl file,
+# summarize with scripts/summarize_traces.py. Prices in USD per 1k tokens (prompt, completion) for the cost estimate
+TRACE_ENABLED = os.environ.get("LAW_AGENT_TRACE", "1") != "0"
+TRACE_PATH = os.environ.get("LAW_AGENT_TRACE_PATH", os.path.join("traces", "trace.jsonl"))
+LLM_PRICES = {
+    "gpt-3.5-turbo":        (0.0015, 0.002),
+    "gpt-3.5-turbo-16k":    (0.003, 0.004),
+}
@@ -1,14 +1,13 @@
 import os
-import time
 import json
 import random
-
-import requests
-from bs4 import BeautifulSoup
+import copy
+import asyncio
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 
 from openai.error import InvalidRequestError
 
-from langchain.llms import OpenAI
 from langchain.chat_models import ChatOpenAI
 from langchain.schema import (
 	SystemMessage,
@@ -17,7 +16,75 @@ from langchain.schema import (
 )
 
 from config import *
-from utils import formatting
+from utils import file_lock, formatting, response_repair, ris_client, ris_parser, tracing
+from utils.chat import achat
+from utils.answer_index import AnswerIndex
+from utils.conversation_memory import LAW_EXCERPT, RETRY, TURN, ConversationMemory
+from utils.registry import AgentRegistry, get_registry
+from utils.retrieval import BundesrechtRetriever
+from utils.section_index import SectionIndex, flatten_section_text, section_label
+from utils.structure_store import GesetzStructureStore
+from utils.token_budget import MAX_CHARS_PER_TOKEN, TokenMeter, count_message_tokens
+
+
+
+# example questions; also the fixed question set of scripts/benchmark_law_agent.py
+BEISPIEL_FRAGEN = [
+    "Welche Voraussetzungen müssen erfüllt sein, damit eine Person in Österreich die Staatsbürgerschaft erlangen kann?",
+    "Welche Behörde ist in Österreich für die Registrierung von Unternehmen zuständig und welche Schritte sind erforderlich, um ein Unternehmen rechtlich anzumelden?",
+    "Wie schnell darf ich auf der Autobahn mit einem Fahrrad fahren?",
+    "Was sind die rechtlichen Bestimmungen für die Kündigung eines Arbeitsvertrags in Österreich und welche Rechte haben Arbeitnehmer und Arbeitgeber in diesem Zusammenhang?",
+    "Welche gesetzlichen Regelungen gelten in Österreich für den Schutz des geistigen Eigentums, insbesondere für Markenrechte und Urheberrechte?",
+    "Wie lange darf ein sich ein 15 jähriger in der Nacht draußen aufhalten?",
+    "Welche steuerrechtlichen Regelungen gelten in Österreich für die Besteuerung von Einkommen aus dem Verkauf von Immobilien und wie hoch ist der Steuersatz?"
+]
+
+
+
+def frage_file_name(rechtsfrage):
+    return rechtsfrage.replace(" ", "_").replace("?", "").replace("!", "").replace(".", "").strip()
+
+
+def checkpoint_path(rechtsfrage):
+    return os.path.join(CHECKPOINT_DIR, f"checkpoint_{frage_file_name(rechtsfrage)}.json")
+
+
+def checkpoint_lock_path(rechtsfrage):
+    return checkpoint_path(rechtsfrage) + ".lock"
+
+
+# only the run that holds the lock of a question writes its checkpoint. The lock is a file lock next to
+# the checkpoint, so it holds for all processes and replicas (bot, webhook server) sharing CHECKPOINT_DIR,
+# and it is released by the os if the run crashes
+def claim_checkpoint(rechtsfrage):
+    # -> lock (pass it to release_checkpoint), None if another run of the question is active
+    # (e.g. two users asked the same question)
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    return file_lock.try_lock(checkpoint_lock_path(rechtsfrage))
+
+
+def release_checkpoint(rechtsfrage, lock):
+    file_lock.release(lock, checkpoint_lock_path(rechtsfrage))
+
+
+def load_checkpoint(rechtsfrage, max_interations=5):
+    # -> state of an unfinished run of the question (resume with LawAgent.run(state)), None if there is none,
+    # its iterations are used up or the question is being answered right now
+    if os.path.exists(checkpoint_lock_path(rechtsfrage)) and file_lock.is_locked(checkpoint_lock_path(rechtsfrage)): return None
+    try:
+        with open(checkpoint_path(rechtsfrage)) as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if state.get("checkpoint", {}).get("iteration", 0) >= max_interations: return None
+    return state
+
+
+def remove_checkpoint(rechtsfrage):
+    try:
+        os.remove(checkpoint_path(rechtsfrage))
+    except FileNotFoundError:
+        pass
 
 
 
@@ -27,218 +94,412 @@ class LawAgent:
     summary: dict
     gesetze_durchsucht: list
 
+    registry: AgentRegistry
     bundesrecht_index: dict
+    retriever: BundesrechtRetriever
+    structure_store: GesetzStructureStore
+    section_index: SectionIndex
+    answer_index: AnswerIndex
     prompts: dict
-    messages: list
+    memory: ConversationMemory
     conversation_history: list
 
     chat: ChatOpenAI
     chat_16k: ChatOpenAI
 
 
-    def __init__(self) -> None:
-        # Load Bundesrecht Index Filled
-        with open(os.path.join("ris", "bundesrecht_index_filled.json"), "r") as f:
-            self.bundesrecht_index = json.load(f)
-
-        # Load Prompts
-        self.prompts = {
-            "system":                       self.init_prompt("01_get_gesetze", "01_system.txt"),
-            "kategorie_waehlen":            self.init_prompt("01_get_gesetze", "02_kategorie_waehlen.txt"),
-            "gesetz_waehlen":               self.init_prompt("01_get_gesetze", "03_gesetz_waehlen.txt"),
-            "zusammenfassung_erstellen":    self.init_prompt("01_get_gesetze", "04_zusammenfassung_erstellen.txt"),
-            "gesetzestext_teil_waehlen":    self.init_prompt("01_get_gesetze", "05_gesetzestext_teil_waehlen.txt"),
-            "gesetzestext_teil_zeigen":     self.init_prompt("01_get_gesetze", "06_gesetzestext_teil_zeigen.txt"),
-            "gesetzestext_gesamt":          self.init_prompt("01_get_gesetze", "07_gesetzestext_gesamt.txt"),
-            "finaler_report":               self.init_prompt("01_get_gesetze", "08_finalen_report_erstellen.txt"),
-
-            "extrahiere_fachbegriffe":      self.init_prompt("02_erklaere_final_report", "01_analysiere_finalen_report.txt"),
-            "fragen_generieren":            self.init_prompt("02_erklaere_final_report", "02_generiere_frage_fuer_fachbegriff.txt"),
-        }
-
-        self.chat = ChatOpenAI(
-            model="gpt-3.5-turbo",
-            temperature=0,
-            max_tokens=2048
-        )
-        self.chat_16k = ChatOpenAI(
-            model="gpt-3.5-turbo-16k",
-            temperature=0,
-            max_tokens=4096
-        )
-
-        self.llm_curie = OpenAI(
-            model="text-curie-001",
-            temperature=0,
-            max_tokens=1024
-        )
+    def __init__(self, seed=None, registry=None, on_progress=None) -> None:
+        # index, prompts and llm clients are loaded once per process and shared by all agents
+        registry = registry if registry is not None else get_registry()
+        self.registry = registry
+
+        self.bundesrecht_index = registry.bundesrecht_index
+        self.retriever = registry.retriever
+        self.retrieval_mode = RETRIEVAL_MODE
+        self.speculative_k = SPECULATIVE_TOP_K
+        self.structure_store = registry.structure_store
+        self.section_index = registry.section_index
+        self.answer_index = registry.answer_index
+        self.answer_reuse = ANSWER_REUSE
+        self.prompts = registry.prompts
+        self.chat = registry.chat
+        self.chat_16k = registry.chat_16k
+        self.llm_curie = registry.llm_curie
+        self.token_budgets = registry.token_budgets
+        self.response_metrics = registry.response_metrics
+        self.tracer = registry.tracer
+
+        # seeds the example categories in define_layer -> identical questions give identical prompts
+        self.seed = seed
+        # on_progress(stage, text) is called whenever the agent reaches a new stage, e.g. to update a chat
+        self.on_progress = on_progress
 
         self.summary = dict()
         self.gesetze_durchsucht = list()
-        self.messages = list()
+        self.memory = ConversationMemory(stub_tokens=MEMORY_STUB_TOKENS)
         self.conversation_history = list()
+        self.previous_history = list()     # conversation of a resumed run before it was saved
+        self.last_run = None                # save_dict of the last run, also of an interrupted one
+        self.owns_checkpoint = False
+        self.checkpoint_lock = None
+        self.token_meter = None
 
 
-    def init_prompt(self, dir, prompt_name):
-        with open(os.path.join(CHAIN_DIR, dir, prompt_name), "r") as f: prompt = f.read()
-        return prompt
-    
+    @property
+    def messages(self):
+        return self.memory.messages
+
+
+    def run(self, question, max_interations=5, max_workers=FACHBEGRIFFE_MAX_WORKERS, fachbegriffe_depth=FACHBEGRIFFE_MAX_DEPTH):
+        # synchronous entry point, runs the async pipeline on its own event loop.
+        # Ctrl-C: asyncio.run cancels arun, which saves the partial run (self.last_run) before the
+        # KeyboardInterrupt goes on to the caller, so a loop over questions stops as well
+        return asyncio.run(
+            self.arun(question, max_interations=max_interations, max_workers=max_workers, fachbegriffe_depth=fachbegriffe_depth)
+        )
+
+
+    @tracing.traced
+    async def arun(self, question, max_interations=5, max_workers=FACHBEGRIFFE_MAX_WORKERS, fachbegriffe_depth=FACHBEGRIFFE_MAX_DEPTH):
+        # main function to answer a question, or to resume a run from a saved state (see load_checkpoint)
 
-    def run(self, question, max_interations=5):
-        # main function to answer a question
+        ## LOOK UP SIMILAR ANSWERED QUESTIONS
+        # a near-duplicate is answered from disk, a similar question starts with the law that answered it
+        if isinstance(question, str) and self.answer_reuse:
+            reused = self.lookup_answer(question)
+            if reused is not None and "checkpoint" not in reused:
+                tracing.annotate(rechtsfrage=question, beantwortet_als=reused["beantwortet_als"])
+                return reused
+            if reused is not None: question = reused
 
         ## INIT MAIN VARIABLES FOR AGENT
+        self.last_run = None
+        stage, iteration, gesetz = None, 0, None
+        analysis = None
+        final_report = None
+        fachbegriffe = None
+        explained_fachbegriffe = dict()
+        self.previous_history = list()
         if isinstance(question, str):
             self.rechtsfrage = question
-            self.add_message(
-                SystemMessage(
-                    content=self.prompts["system"]\
-                        .replace("{rechtsfrage}", self.rechtsfrage)\
-                        .replace("{gesetze_durchsucht}", str(self.gesetze_durchsucht)) \
-                        .replace("{summary}", str(self.summary))
-                )
-            )
             # TODO: Question interpretation and refinement -> alignment between agent and user on interpretation of question
 
 
         
         elif isinstance(question, dict):
-            # TODO: init variables from previous conversation state
-            raise NotImplementedError
+            # init variables from previous conversation state, completed stages are skipped
+            self.rechtsfrage = question["rechtsfrage"]
+            self.gesetze_durchsucht = list(question.get("gesetze_durchsucht") or [])
+            self.summary = dict(question.get("summary") or {})
+            self.previous_history = list(question.get("conversation_history") or [])
+            analysis = question.get("last_analysis")
+            final_report = question.get("final_report")
+            fachbegriffe = question.get("fachbegriffe")
+            if isinstance(fachbegriffe, dict): explained_fachbegriffe = fachbegriffe
+            stage, iteration, gesetz = self.resume_point(question)
+        tracing.annotate(rechtsfrage=self.rechtsfrage, resumed_at=stage)
+
+        self.add_message(
+            SystemMessage(
+                content=self.prompts["system"]\
+                    .replace("{rechtsfrage}", self.rechtsfrage)\
+                    .replace("{gesetze_durchsucht}", str(self.gesetze_durchsucht)) \
+                    .replace("{summary}", str(self.summary))
+            )
+        )
+        if stage == "analyse":
+            # the conversation of the analysis is gone, the decision and the report only need its result
+            self.memory.set_summary(f"Ergebnis der letzten Analyse: {formatting.dict_to_string(analysis)}")
         
+        completed, interrupted = False, False
+        self.checkpoint_lock = claim_checkpoint(self.rechtsfrage)
+        self.owns_checkpoint = self.checkpoint_lock is not None
         try:
-            analysis = None
-            final_report = None
-            fachbegriffe = None
-            explained_fachbegriffe = dict()
-            for i in range(max_interations):
-
-                ## CHOOSE GESETZ
-                # define layers, choose gesetz, erstelle zusammenfassung und reset messages
-                layers = self.define_layers()
-                gesetz = self.choose_gesetz(layers)
-                self.summarize_progress()
-                self.reset_messages(out=True)
-                if "nichts gefunden" in gesetz.lower(): continue
-
-                ## SCRAPE GESETZ
-                gesetz_id = gesetz.split(" - ")[0]
-                gesetz_structure = self.get_gesetz_structure(gesetz_id)
-                gesetz_is_long = len(str(gesetz_structure)) > 8096
-
-                if gesetz_is_long:
-                    ## CHOOSE SEKTION VON GESETZ            
-                    # choose sektion and analyse
-                    geltende_fassung = None
-                    chosen_section = self.choose_section_from_gesetz(gesetz, gesetz_structure)
-                    while geltende_fassung is None:
-
-                        while chosen_section not in gesetz_structure.keys():
-                            self.retry_completion()
-                            print("retrying completion")
-
-                        if isinstance(gesetz_structure[chosen_section], list):
-                            t = gesetz_structure[chosen_section]
-                            while len(t) == 1: t = t[0]
-                            geltende_fassung = "\n".join(t)
-                            
-                        elif isinstance(gesetz_structure[chosen_section], dict):
-                            gesetz_structure = gesetz_structure[chosen_section]
-                            chosen_section = self.choose_section_from_gesetz(gesetz, gesetz_structure)
-                        
-                        # TODO: prevent infinite loop
-
-                    analysis = self.analyze_section_from_gesetz(gesetz, geltende_fassung)
-                    # add gesetz to gesetze_durchsucht
-                    analyzed_section = analysis["analysierte_sektion"]
-                    self.gesetze_durchsucht.append(f"{gesetz} - {analyzed_section}")
-                
+            for i in range(iteration, max_interations):
+
+                if stage in ("analyse", "finaler_report", "fachbegriffe"):
+                    # resumed after the analysis of this iteration
+                    pass
+
+                elif stage == "gesetz":
+                    # resumed with a chosen law: no category walk, the structure comes from the store if it was fetched
+                    analysis = await self.explore_gesetz(gesetz)
+                    self.save_checkpoint("analyse", i, analysis=analysis)
+
                 else:
-                    ## ANALYZE FULL GESETZ
-                    # analyse
-                    analysis = self.analyze_full_gesetz(gesetz, gesetz_structure)
-                    # add gesetz to gesetze_durchsucht
-                    self.gesetze_durchsucht.append(gesetz)
+                    ## EXPLORE TOP K GESETZE
+                    # speculative mode: analyse several laws of the shortlist at once, the first that answers wins
+                    explored = None
+                    if self.speculative_k > 1 and self.retrieval_mode != "off":
+                        explored = await self.explore_speculatively(self.speculative_k)
+
+                    if explored is not None:
+                        analysis = explored
+                    else:
+                        ## CHOOSE GESETZ
+                        # shortlist gesetze locally or define layers, choose gesetz, erstelle zusammenfassung und reset messages
+                        gesetz = None
+                        if self.retrieval_mode != "off":
+                            gesetz = await self.choose_gesetz_from_retrieval()
+                        if gesetz is None:
+                            layers = await self.define_layers()
+                            self.progress("kategorie", f"Kategorie gewählt: {' > '.join(l for l in layers if l is not None)}")
+                            gesetz = await self.choose_gesetz(layers)
+                        if "nichts gefunden" in gesetz.lower():
+                            await self.summarize_progress()
+                            self.reset_messages(out=True)
+                            self.save_checkpoint("weiter", i+1, analysis=analysis)
+                            continue
+                        self.save_checkpoint("gesetz", i, gesetz=gesetz, analysis=analysis)
+
+                        ## SCRAPE GESETZ
+                        # the summary and the RIS fetch are independent -> overlap them
+                        self.progress("gesetz", f"Gesetz gewählt: {gesetz}")
+                        gesetz_id = gesetz.split(" - ")[0]
+                        _, gesetz_structure = await asyncio.gather(
+                            self.summarize_progress(),
+                            self.get_gesetz_structure(gesetz_id)
+                        )
+                        self.reset_messages(out=True)
+
+                        ## ANALYZE GESETZ
+                        analysis = await self.explore_gesetz(gesetz, gesetz_structure)
+                    self.save_checkpoint("analyse", i, analysis=analysis)
 
 
                 ## DECISION
                 naechster_schritt = analysis["naechster_schritt"]
                 if naechster_schritt.lower() != "done":
                     # create summary and start over
-                    self.summarize_progress()
+                    self.progress("weiter", "Die Frage ist noch nicht beantwortet, ich suche in einem weiteren Gesetz.")
+                    await self.summarize_progress()
                     self.reset_messages()
+                    self.save_checkpoint("weiter", i+1, analysis=analysis)
+                    stage = None
                     continue
                 else:
-                    # create summary and final report
-                    self.summarize_progress()
-                    final_report = self.create_final_report()
+                    if stage not in ("finaler_report", "fachbegriffe"):
+                        # create summary and final report
+                        self.progress("finaler_report", "Ich habe die Antwort gefunden und erstelle den Bericht.")
+                        await self.summarize_progress()
+                        final_report = await self.create_final_report()
 
-                    # reset messages
-                    self.reset_messages()
+                        # reset messages
+                        self.reset_messages()
+                        self.save_checkpoint("finaler_report", i, analysis=analysis, final_report=final_report)
 
                     ## ERKLAERE FACHBEGRIFFE
-                    # extract fachbegriffe
-                    fachbegriffe = self.extract_fachbegriffe(final_report)
-
-                    # explain fachbegriffe
-                    if len(fachbegriffe) > 0:
-                        fragen_for_fachbegriffe = self.generate_questions_for_fachbegriffe()
-                        assert isinstance(fragen_for_fachbegriffe, dict)
-
-                        for fachbegriff in fragen_for_fachbegriffe.keys():
-                            
-                            # Create new law agent to answer question
-                            la = LawAgent()
-                            answer = la.run(fragen_for_fachbegriffe[fachbegriff]["frage"])
-
-                            # Add answer to explained_fachbegriffe
-                            explained_fachbegriffe[fachbegriff] = {
-                                "frage": fragen_for_fachbegriffe[fachbegriff]["frage"],
-                                "antwort": answer
-                            }
+                    if stage != "fachbegriffe":
+                        # extract fachbegriffe
+                        fachbegriffe = await self.extract_fachbegriffe(final_report)
+
+                        # explain fachbegriffe
+                        if len(fachbegriffe) > 0 and fachbegriffe_depth > 0:
+                            self.progress("fachbegriffe", f"Ich erkläre noch {len(fachbegriffe)} Fachbegriffe.")
+                            fragen_for_fachbegriffe = await self.generate_questions_for_fachbegriffe()
+                            assert isinstance(fragen_for_fachbegriffe, dict)
+
+                            explained_fachbegriffe = await self.explain_fachbegriffe(
+                                fragen_for_fachbegriffe,
+                                max_workers=max_workers,
+                                fachbegriffe_depth=fachbegriffe_depth-1
+                            )
 
                             # TODO: update final report with answer
                             # TODO: update gesetze_durchsucht with answer 
 
                     break
 
+            # answered or out of iterations, either way there is nothing left to resume
+            completed = True
 
 
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, asyncio.CancelledError):
             # TODO: stop and summarize conversation
-            # TODO: save whole conversation status
-            pass
-        
-
-
+            # Ctrl-C cancels the task of asyncio.run -> the partial run is saved before the cancellation goes on;
+            # the checkpoint of the last completed stage is kept, run(load_checkpoint(frage)) continues from there
+            interrupted = True
+            raise
+        finally:
+            if self.owns_checkpoint:
+                if completed: remove_checkpoint(self.rechtsfrage)
+                release_checkpoint(self.rechtsfrage, self.checkpoint_lock)
+                self.owns_checkpoint, self.checkpoint_lock = False, None
+            if completed or interrupted:
+                self.last_run = self.save_run(analysis, final_report, explained_fachbegriffe if len(explained_fachbegriffe.keys()) > 0 else fachbegriffe)
+
+        return self.last_run
+
+
+    def save_run(self, analysis, final_report, fachbegriffe):
         # TODO: handle if final_report is None
 
         # save whole conversation
-        save_dict = {
-            "rechtsfrage": self.rechtsfrage,
-            "gesetze_durchsucht": self.gesetze_durchsucht,
-            "summary": self.summary,
-            "last_analysis": analysis,
-            "final_report": final_report,
-            "fachbegriffe": explained_fachbegriffe if len(explained_fachbegriffe.keys()) == 0 else fachbegriffe,
-            "conversation_history": [f"{m.type}: {m.content}" for m in self.conversation_history]
-        }
+        save_dict = self.state(
+            analysis=analysis,
+            final_report=final_report,
+            fachbegriffe=fachbegriffe
+        )
         # save conversation history
-        frage_str = self.rechtsfrage.replace(" ", "_").replace("?", "").replace("!", "").replace(".", "").strip()
-        with open(os.path.join("answered", f"conversation_history_{frage_str}.json"), "w") as f:
+        os.makedirs(ANSWERED_DIR, exist_ok=True)
+        answered_path = os.path.join(ANSWERED_DIR, f"conversation_history_{frage_file_name(self.rechtsfrage)}.json")
+        with open(answered_path, "w") as f:
             json.dump(save_dict, f, indent=4, ensure_ascii=False)
+        self.answer_index.add(save_dict, answered_path)
 
         # reset all variables after run
         self.rechtsfrage = None
-        self.messages = list()
+        self.memory.clear()
         self.conversation_history = list()
+        self.previous_history = list()
         self.gesetze_durchsucht = list()
         self.summary = dict()
 
         return save_dict
 
 
-    def extract_fachbegriffe(self, finaler_report):
+    @tracing.traced
+    def lookup_answer(self, rechtsfrage):
+        # -> the stored answer of a near-duplicate question, a state that continues with the law
+        # that answered a similar question (see resume_point) or None
+        match = self.answer_index.match(rechtsfrage, ANSWER_SEED_THRESHOLD)
+        if match is None: return None
+        similarity, entry = match
+        tracing.annotate(similarity=round(similarity, 2), aehnliche_frage=entry["rechtsfrage"])
+
+        if similarity >= ANSWER_REUSE_THRESHOLD and entry["same_qualifiers"]:
+            answer = self.answer_index.load_answer(entry)
+            if answer is not None:
+                self.progress("antwort", f"Eine sehr ähnliche Frage wurde schon beantwortet: {entry['rechtsfrage']}")
+                return {**answer, "rechtsfrage": rechtsfrage, "beantwortet_als": entry["rechtsfrage"]}
+
+        if entry["gesetz"] is None: return None
+        tracing.annotate(startgesetz=entry["gesetz"])
+        return {"rechtsfrage": rechtsfrage, "checkpoint": {"stage": "gesetz", "iteration": 0, "gesetz": entry["gesetz"]}}
+
+
+    def resume_point(self, state):
+        # -> (stage, iteration, gesetz) a saved state continues from; a saved answer without
+        # checkpoint continues after its last complete stage
+        checkpoint = state.get("checkpoint")
+        if checkpoint is not None:
+            return checkpoint["stage"], checkpoint.get("iteration", 0), checkpoint.get("gesetz")
+        if state.get("final_report") is not None:
+            return ("fachbegriffe" if state.get("fachbegriffe") is not None else "finaler_report"), 0, None
+        if state.get("last_analysis") is not None:
+            return "analyse", 0, None
+        return None, 0, None
+
+
+    def state(self, analysis=None, final_report=None, fachbegriffe=None):
+        # the save_dict: everything a run needs to be resumed
+        return {
+            "rechtsfrage": self.rechtsfrage,
+            "gesetze_durchsucht": self.gesetze_durchsucht,
+            "summary": self.summary,
+            "last_analysis": analysis,
+            "final_report": final_report,
+            "fachbegriffe": fachbegriffe,
+            "conversation_history": self.previous_history + [f"{m.type}: {m.content}" for m in self.conversation_history]
+        }
+
+
+    def save_checkpoint(self, stage, iteration, gesetz=None, **state):
+        # written after every stage, a crashed run then only repeats the stage that was in flight
+        if not self.owns_checkpoint: return
+        checkpoint = {**self.state(**state), "checkpoint": {"stage": stage, "iteration": iteration, "gesetz": gesetz}}
+        path = checkpoint_path(self.rechtsfrage)
+        tmp_path = path + f".{os.getpid()}-{id(self)}.tmp"
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoint, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+    @tracing.traced
+    async def explore_gesetz(self, gesetz, gesetz_structure=None):
+        # analyse one law (fetched if no structure is given) and add it to gesetze_durchsucht -> analysis
+        tracing.annotate(gesetz=gesetz)
+        gesetz_id = gesetz.split(" - ")[0]
+        if gesetz_structure is None:
+            gesetz_structure = await self.get_gesetz_structure(gesetz_id)
+        self.progress("analyse", f"Gesetz geladen, ich analysiere {gesetz}.")
+
+        # analyse the whole law if it fits into the context window, otherwise choose a section
+        gesetz_is_long = not self.full_gesetz_fits(gesetz, gesetz_structure)
+
+        if gesetz_is_long:
+            ## CHOOSE SEKTIONEN VON GESETZ
+            # rank sektionen locally, walk down the structure only if the index has nothing
+            section_paths = await self.choose_section_from_index(gesetz, gesetz_id, gesetz_structure)
+            walk = len(section_paths) == 0
+            if walk:
+                chosen_sections = await self.choose_section_from_gesetz(gesetz, gesetz_structure)
+                chosen_sections = await self.match_sections(chosen_sections, list(gesetz_structure.keys()))
+                section_paths = [(s,) for s in chosen_sections]
+
+            ## ANALYZE SEKTIONEN
+            # every chosen sektion is analysed concurrently, the analyses are merged into one decision
+            analysis = await self.analyze_sections(gesetz, gesetz_structure, section_paths, walk=walk)
+            # add gesetz to gesetze_durchsucht
+            analyzed_section = analysis["analysierte_sektion"]
+            self.gesetze_durchsucht.append(f"{gesetz} - {analyzed_section}")
+
+        else:
+            ## ANALYZE FULL GESETZ
+            # analyse
+            analysis = await self.analyze_full_gesetz(gesetz, gesetz_structure)
+            # add gesetz to gesetze_durchsucht
+            self.gesetze_durchsucht.append(gesetz)
+
+        return analysis
+
+
+    @tracing.traced
+    async def explore_speculatively(self, k):
+        # fetch and analyse the top k laws of the shortlist concurrently, each on a fork of the agent;
+        # the first analysis that is done wins and the other candidates are cancelled.
+        # All candidates of the round share one prompt token budget. None if there is nothing to explore.
+        candidates = self.retriever.search(self.progress_query(), k=k, exclude=set(g.split(" - ")[0] for g in self.gesetze_durchsucht))
+        if len(candidates) == 0: return None
+        gesetze = [c["gesetzesnummer"] + " - " + c["kurztitel"].replace(" - ", "; ") for c in candidates]
+        self.progress("gesetze", f"Ich durchsuche {len(gesetze)} Gesetze gleichzeitig: " + ", ".join(gesetze))
+
+        token_meter = TokenMeter(SPECULATIVE_TOKEN_BUDGET)
+        forks = [self.fork() for _ in gesetze]
+        for fork in forks: fork.token_meter = token_meter
+        tasks = {asyncio.create_task(fork.explore_gesetz(gesetz)): fork for fork, gesetz in zip(forks, gesetze)}
+
+        finished, failed, winner = [], [], None
+        pending = set(tasks)
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        analysis = task.result()
+                    except Exception as e:
+                        failed.append(f"{type(e).__name__}: {e}")
+                        continue
+                    finished.append((tasks[task], analysis))
+                    if str(analysis.get("naechster_schritt", "")).lower() == "done" and winner is None:
+                        winner = analysis
+        finally:
+            for task in pending: task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        # only finished candidates are remembered, the history keeps what was sent by all of them
+        self.memory.join([fork.memory for fork, _ in finished])
+        for fork in forks: self.conversation_history.extend(fork.conversation_history)
+        tracing.annotate(kandidaten=len(gesetze), fertig=len(finished), fehler=failed or None, token_budget_used=token_meter.used)
+
+        if winner is not None: return winner
+        if len(finished) == 0: return None
+        return self.merge_analyses([analysis for _, analysis in finished])
+
+
+    @tracing.traced
+    async def extract_fachbegriffe(self, finaler_report):
 
         # only keep the einfache_antwort
         assert "einfache_antwort" in finaler_report.keys()
@@ -261,13 +522,45 @@ class LawAgent:
             )
         )
 
-        fachbegriffe = self.get_chat_completion(current_human_message)
+        fachbegriffe = await self.aget_chat_completion(current_human_message)
         assert "extrahierte_fachbegriffe" in fachbegriffe.keys()
         assert isinstance(fachbegriffe["extrahierte_fachbegriffe"], list)
         return fachbegriffe["extrahierte_fachbegriffe"]
 
 
-    def generate_questions_for_fachbegriffe(self):
+    @tracing.traced
+    async def explain_fachbegriffe(self, fragen_for_fachbegriffe, max_workers=FACHBEGRIFFE_MAX_WORKERS, fachbegriffe_depth=0):
+        # answer every fachbegriff question with its own law agent, at most max_workers at a time
+        semaphore = asyncio.Semaphore(max(1, max_workers))
+
+        async def explain(frage, seed):
+            async with semaphore:
+                la = LawAgent(seed=seed, registry=self.registry)
+                # a sub-agent of an interrupted run continues from its own checkpoint
+                return await la.arun(load_checkpoint(frage) or frage, max_workers=max_workers, fachbegriffe_depth=fachbegriffe_depth)
+
+        fachbegriffe = list(fragen_for_fachbegriffe.keys())
+        fragen = [fragen_for_fachbegriffe[fachbegriff]["frage"] for fachbegriff in fachbegriffe]
+        answers = await asyncio.gather(
+            *[explain(frage, self.seed) for frage in fragen],
+            return_exceptions=True
+        )
+
+        # merge results in the order the fachbegriffe were generated
+        explained_fachbegriffe = dict()
+        for fachbegriff, frage, answer in zip(fachbegriffe, fragen, answers):
+            if isinstance(answer, Exception):
+                explained_fachbegriffe[fachbegriff] = {"frage": frage, "antwort": None, "fehler": f"{type(answer).__name__}: {answer}"}
+            elif isinstance(answer, BaseException):
+                raise answer
+            else:
+                explained_fachbegriffe[fachbegriff] = {"frage": frage, "antwort": answer}
+
+        return explained_fachbegriffe
+
+
+    @tracing.traced
+    async def generate_questions_for_fachbegriffe(self):
         
         output_format = {
             "fragen": [
@@ -284,7 +577,7 @@ class LawAgent:
             )
         )
 
-        questions = self.get_chat_completion(current_human_message)
+        questions = await self.aget_chat_completion(current_human_message)
         assert "fragen" in questions.keys()
         assert isinstance(questions["fragen"], list)
         return {
@@ -297,7 +590,7 @@ class LawAgent:
 
     def lookup_bundesrecht(self, layers):
         if len(layers) == 0:
-            return self.bundesrecht_index.keys()
+            return list(self.bundesrecht_index.keys())
         elif len(layers) == 1:
             l1 = layers[0]
             return [ k for k in self.bundesrecht_index[l1].keys() if not k.endswith(" FREI") ]
@@ -326,19 +619,20 @@ class LawAgent:
         
 
 
-    def define_layers(self):
+    @tracing.traced
+    async def define_layers(self):
         
         # Define initial variables
         layers = list()
 
         ## Set layers
-        layers = self.define_layer(layers, f"Zu beantwortende Rechtsfrage: {self.rechtsfrage}")  # first layer
+        layers = await self.define_layer(layers, f"Zu beantwortende Rechtsfrage: {self.rechtsfrage}")  # first layer
         assert len(layers) == 1
         assert layers[0] in self.bundesrecht_index.keys()
-        layers = self.define_layer(layers, f"Du hast {layers[0]} gewaehlt.")                      # second layer
+        layers = await self.define_layer(layers, f"Du hast {layers[0]} gewaehlt.")                      # second layer
         assert len(layers) == 2
         assert layers[1] in self.bundesrecht_index[layers[0]].keys()
-        layers = self.define_layer(layers, f"Du hast {layers[1]} gewaehlt.")                      # third layer
+        layers = await self.define_layer(layers, f"Du hast {layers[1]} gewaehlt.")                      # third layer
         assert 2 <= len(layers) <= 3
 
         if layers[-1] is not None:
@@ -348,7 +642,7 @@ class LawAgent:
         return layers
 
 
-    def define_layer(self, layers, context):
+    async def define_layer(self, layers, context):
 
         next_layer = self.lookup_bundesrecht(layers)
         if next_layer is None: return layers + [None]
@@ -356,9 +650,9 @@ class LawAgent:
         assert len(next_layer) > 0
 
         # get 2 random choices if possible
-        if len(next_layer) < 2: rand = next_layer[1]
+        if len(next_layer) < 2: rand = next_layer[0]
         else:
-            random_choices = random.sample(next_layer, 2)
+            random_choices = random.Random(f"{self.seed}:{next_layer}").sample(next_layer, 2)
             rand = f"{random_choices[0]}, {random_choices[1]}, ..."
         
         output_format = {"kategorie": f"gewaehlte Kategorie inklusive voranstehende Zahl. z.B. {rand}"}
@@ -371,7 +665,7 @@ class LawAgent:
                 output_format=formatting.dict_to_string(output_format)
             )
         )
-        response = self.get_chat_completion(current_human_message)
+        response = await self.aget_chat_completion(current_human_message)
 
         # Define chosen layers and return
         chosen_category = response["kategorie"]
@@ -380,7 +674,8 @@ class LawAgent:
         return layers
 
 
-    def summarize_progress(self):
+    @tracing.traced
+    async def summarize_progress(self):
         output_format = {
             "zusammenfassung": "eine kurze, aber detailierte zusammenfassung ueber deinen bisherigen Fortschritt",
             "frage_beantwortet": "hast du die frage schon beantwortet? waehle aus folgender liste: 'ja' | 'noch nicht' ",
@@ -392,21 +687,64 @@ class LawAgent:
             )
         )
 
-        summary = self.get_chat_completion(current_human_message)
+        summary = await self.aget_chat_completion(current_human_message)
         self.summary = summary
+        # the summary outlives reset_messages and is all that later iterations remember
+        self.memory.set_summary(f"Zusammenfassung des bisherigen Fortschritts: {summary.get('zusammenfassung', '')}")
 
     
-    def choose_gesetz(self, layers):
+    @tracing.traced
+    async def choose_gesetz(self, layers):
         # Choose gesetz to look through
 
-        # zusammenfassung = self.summary["zusammenfassung"]
-        context = f"Zu beantwortende Rechtsfrage: {self.rechtsfrage}"  #\n\nZusammenfassung des bisherigen Fortschritts: {zusammenfassung}"
-
         gesetze = [
             g["gesetzesnummer"] + " - " + g["kurztitel"].replace(" - ", "; ")
             for g in self.bundesrecht_gesetze_for_category(layers)
             if len(str(g["gesetzesnummer"]).strip()) > 0
         ]
+        return await self.choose_gesetz_from_list(gesetze)
+
+
+    def progress_query(self):
+        # retrieval query: the question and, once there is one, the summary of the progress so far
+        query = self.rechtsfrage
+        if "zusammenfassung" in self.summary.keys():
+            query += "\n" + self.summary["zusammenfassung"]
+        return query
+
+
+    @tracing.traced
+    async def choose_gesetz_from_retrieval(self):
+        # Shortlist gesetze with the local retrieval index instead of walking the category tree
+
+        gesetze_durchsucht_ids = set(g.split(" - ")[0] for g in self.gesetze_durchsucht)
+        candidates = self.retriever.search(self.progress_query(), k=RETRIEVAL_TOP_K, exclude=gesetze_durchsucht_ids)
+        if len(candidates) == 0: return None     # fall back to the category tree
+
+        if self.retrieval_mode == "skip":
+            best = candidates[0]
+            return best["gesetzesnummer"] + " - " + best["kurztitel"].replace(" - ", "; ")
+
+        # confirm the shortlist with a single call, the category path gives the llm some context
+        gesetze = [
+            c["gesetzesnummer"] + " - " + c["kurztitel"].replace(" - ", "; ") + f" ({' > '.join(l for l in c['layers'] if l is not None)})"
+            for c in candidates
+        ]
+        gesetz = await self.choose_gesetz_from_list(gesetze)
+
+        # drop the category path again if the llm copied it into the titel
+        kurztitel = {c["gesetzesnummer"]: c["kurztitel"].replace(" - ", "; ") for c in candidates}
+        gesetzesnummer = gesetz.split(" - ")[0].strip()
+        if gesetzesnummer in kurztitel.keys():
+            return f"{gesetzesnummer} - {kurztitel[gesetzesnummer]}"
+        return gesetz
+
+
+    async def choose_gesetz_from_list(self, gesetze):
+
+        # zusammenfassung = self.summary["zusammenfassung"]
+        context = f"Zu beantwortende Rechtsfrage: {self.rechtsfrage}"  #\n\nZusammenfassung des bisherigen Fortschritts: {zusammenfassung}"
+
         output_format = {"nummer": "die davorstehende nummer des gesetzes oder 'nichts gefunden'", "titel": "der titel des gewählten gesetzes oder 'nichts gefunden'"}
         current_human_message = HumanMessage(
             content=self.prompts["gesetz_waehlen"].format(
@@ -416,7 +754,7 @@ class LawAgent:
                 output_format=formatting.dict_to_string(output_format)
             )
         )
-        response = self.get_chat_completion(current_human_message)
+        response = await self.aget_chat_completion(current_human_message)
         if "nichts gefunden" in response["nummer"].lower() or "nichts gefunden" in response["titel"].lower():
             return "nichts gefunden"
         else:
@@ -426,8 +764,63 @@ class LawAgent:
 
 
 
-    def choose_section_from_gesetz(self, gesetz, gesetz_structure):
-        context = f"Zu beantwortende Rechtsfrage: {self.rechtsfrage}\n\nZusammenfassung des bisherigen Fortschritts: {self.summary['zusammenfassung']}"
+    @tracing.traced
+    async def choose_section_from_gesetz(self, gesetz, gesetz_structure):
+        # all sections the llm chose, in its order (see match_sections)
+        return await self.choose_sections_from_list(gesetz, [s for s in gesetz_structure.keys()])
+
+
+    def matched_sections(self, chosen_sections, sections):
+        # chosen names -> existing section names, exact or close matches (see response_repair.match_section)
+        matched, exact = dict(), False
+        for name in chosen_sections if isinstance(chosen_sections, list) else []:
+            match = response_repair.match_section(name, sections)
+            if match is None: continue
+            matched[match[0]] = None
+            exact = exact or match[1]
+            self.response_metrics.add("sections_exact" if match[1] else "sections_fuzzy")
+        if len(matched) > 0 and not exact: self.response_metrics.add("sections_rescued")
+        return list(matched)
+
+
+    async def match_sections(self, chosen_sections, sections):
+        # matched_sections, the llm is only asked again if nothing matches and at most LLM_MAX_RETRIES times
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            matched = self.matched_sections(chosen_sections, sections)
+            if len(matched) > 0: return matched
+
+            self.response_metrics.add("sections_failed")
+            if attempt == LLM_MAX_RETRIES: break
+            try:
+                response = await self.retry_completion(retries=0)
+            except ValueError:
+                response = None     # the retry could not be parsed either -> a failed attempt, not the end of the run
+            chosen_sections = response.get("gewaehlte_sektionen", []) if isinstance(response, dict) else []
+
+        self.response_metrics.add("retries_exhausted")
+        return []
+
+
+    @tracing.traced
+    async def choose_section_from_index(self, gesetz, gesetz_id, gesetz_structure):
+        # rank all sections of the gesetz locally; a clear winner is taken without asking,
+        # otherwise the llm chooses once from the short list -> list of section paths
+
+        ranked = await asyncio.to_thread(
+            self.section_index.rank, gesetz_id, self.progress_query(), k=SECTION_INDEX_TOP_K, gesetz_structure=gesetz_structure
+        )
+        if len(ranked) == 0: return []
+        if len(ranked) == 1 or ranked[0][1] >= SECTION_INDEX_CONFIDENCE * ranked[1][1]:
+            return [ranked[0][0]]
+
+        sections = {section_label(path): path for path, _ in ranked}
+        chosen_sections = await self.choose_sections_from_list(gesetz, list(sections.keys()))
+        chosen_paths = [sections[s] for s in self.matched_sections(chosen_sections, list(sections.keys()))]
+        return chosen_paths if len(chosen_paths) > 0 else [ranked[0][0]]
+
+
+    async def choose_sections_from_list(self, gesetz, sections):
+        context = f"Zu beantwortende Rechtsfrage: {self.rechtsfrage}\n\nZusammenfassung des bisherigen Fortschritts: {self.summary.get('zusammenfassung', '')}"
         output_format = {
             "gewaehlte_sektionen": ["sektion (ganze zeile zitiert!!)", "..." ]
         }
@@ -435,24 +828,20 @@ class LawAgent:
             content=self.prompts["gesetzestext_teil_waehlen"].format(
                 context=context,
                 gesetz=gesetz,
-                struktur="\n".join([s for s in gesetz_structure.keys()]),
+                struktur="\n".join(sections),
                 output_format=formatting.dict_to_string(output_format)
             ) + "\n\nAchte darauf, dass du immer die gesamte Zeile zitierst und nicht nur die Nummer der Sektion!"
         )
-        response = self.get_chat_completion(choose_section_message, model="16k")
-        chosen_sections = response["gewaehlte_sektionen"]
+        response = await self.aget_chat_completion(choose_section_message, model="16k")
+        return response["gewaehlte_sektionen"]
 
-        # chosen_sections = [s["paragraph"] + " - " + s["name"] for s in chosen_sections]
 
-        return chosen_sections[0]  # TODO: return all chosen sections
-    
 
 
-
-    def analyze_full_gesetz(self, gesetz, gesetz_structure):
+    def full_gesetz_message(self, gesetz, gesetz_structure):
         geltende_fassung = str()
         for k, v in gesetz_structure.items():
-            content = " ".join(v)
+            content = flatten_section_text(v)
             geltende_fassung += f"{k}\n"
             geltende_fassung += f"{content}\n\n"
         geltende_fassung = geltende_fassung.strip()
@@ -463,23 +852,16 @@ class LawAgent:
             "loesungsansatz": "wie koennte die frage beantwortet werden?",
             "naechster_schritt": "was sollte als naechstes getan werden? waehle aus folgender liste: 'neues gesetz waehlen' | 'done' "
         }
-        show_chosen_section_message = HumanMessage(
+        return HumanMessage(
             content=self.prompts["gesetzestext_gesamt"].format(
-                gesetz=gesetz,
+                gesetz_id=gesetz.split(" - ")[0],
                 geltende_fassung=geltende_fassung,
                 output_format=formatting.dict_to_string(output_format)
             )
         )
 
-        # get chat completion and return analysis of gesetz
-        analysis = self.get_chat_completion(show_chosen_section_message, model="16k")
-        return analysis
-
-    
-
-
-    def analyze_section_from_gesetz(self, gesetz, geltende_fassung):
 
+    def section_message(self, gesetz, geltende_fassung):
         output_format = {
             "vermutung": "stelle eine Vermutungen an ob der gebene Teil ausreichend ist um die Frage zu beantworten? waehle aus folgender liste: 'ja' | 'nein'",
             "begruendung": "eine kurze begruendung warum",
@@ -487,7 +869,7 @@ class LawAgent:
             "loesungsansatz": "wie koennte die frage beantwortet werden?",
             "naechster_schritt": "was sollte als naechstes getan werden? waehle aus folgender liste: 'neues gesetz waehlen' | 'done' "
         }
-        show_chosen_section_message = HumanMessage(
+        return HumanMessage(
             content=self.prompts["gesetzestext_teil_zeigen"].format(
                 gesetz=gesetz,
                 geltende_fassung=geltende_fassung,
@@ -495,13 +877,104 @@ class LawAgent:
             )
         )
 
+
+    def full_gesetz_fits(self, gesetz, gesetz_structure):
+        # real token count of the conversation plus the whole law against the 16k window
+        budget = self.token_budgets["16k"]
+        self.compact_memory("16k")
+        if gesetz_structure.size > MAX_CHARS_PER_TOKEN * budget.limit: return False
+        message = self.prompt_message(self.full_gesetz_message(gesetz, gesetz_structure))
+        return budget.fits(self.messages + [message])
+
+
+    def pack_section(self, gesetz, section_content):
+        # as many whole sub-sections of the chosen section as fit next to the conversation
+        budget = self.token_budgets["16k"]
+        self.compact_memory("16k")
+        remaining = budget.remaining(self.messages + [self.prompt_message(self.section_message(gesetz, ""))])
+        return budget.pack(section_content, remaining)
+
+
+    @tracing.traced
+    async def analyze_full_gesetz(self, gesetz, gesetz_structure):
+        show_chosen_section_message = self.full_gesetz_message(gesetz, gesetz_structure)
+
+        # get chat completion and return analysis of gesetz
+        analysis = await self.aget_chat_completion(show_chosen_section_message, model="16k", kind=LAW_EXCERPT)
+        # the whole law was analysed -> its title labels the analysis (e.g. in merge_analyses)
+        analysis.setdefault("analysierte_sektion", gesetz.split(" - ", 1)[-1])
+        return analysis
+
+    
+
+
+    @tracing.traced
+    async def analyze_section_from_gesetz(self, gesetz, geltende_fassung):
+        show_chosen_section_message = self.section_message(gesetz, geltende_fassung)
+
         # get chat completion and return analysis of gesetz
-        analysis = self.get_chat_completion(show_chosen_section_message, model="16k")
+        analysis = await self.aget_chat_completion(show_chosen_section_message, model="16k", kind=LAW_EXCERPT)
         return analysis
+
+
+    @tracing.traced
+    async def analyze_section_path(self, gesetz, gesetz_structure, section_path, walk=False):
+        # packs and analyses one section; with walk the llm first walks down to a list of paragraphs
+        section_content = gesetz_structure
+        for key in section_path: section_content = section_content[key]
+
+        while walk and isinstance(section_content, Mapping):
+            chosen_sections = await self.choose_section_from_gesetz(gesetz, section_content)
+            chosen_sections = await self.match_sections(chosen_sections, list(section_content.keys()))
+            if len(chosen_sections) == 0: break     # nothing usable -> as much of this level as fits
+            section_content = section_content[chosen_sections[0]]
+
+        geltende_fassung = self.pack_section(gesetz, section_content)
+        return await self.analyze_section_from_gesetz(gesetz, geltende_fassung)
+
+
+    @tracing.traced
+    async def analyze_sections(self, gesetz, gesetz_structure, section_paths, walk=False):
+        # the sections run concurrently, each on a fork of the working memory, so that no analysis
+        # sees the law text of another; their turns are joined in order afterwards
+        section_paths = section_paths[:SECTION_ANALYSIS_MAX_SECTIONS]
+        forks = [self.fork() for _ in section_paths]
+        analyses = await asyncio.gather(*(
+            fork.analyze_section_path(gesetz, gesetz_structure, path, walk=walk)
+            for fork, path in zip(forks, section_paths)
+        ))
+        self.join(forks)
+        return self.merge_analyses(analyses)
+
+
+    def merge_analyses(self, analyses):
+        # one decision from the analyses of several sections: done as soon as one section answers the question
+        if len(analyses) == 1: return analyses[0]
+        if len(analyses) == 0:
+            return {
+                "vermutung": "nein",
+                "begruendung": "keine der gewaehlten sektionen existiert in diesem gesetz",
+                "analysierte_sektion": "",
+                "loesungsansatz": "",
+                "naechster_schritt": "neues gesetz waehlen"
+            }
+
+        def field(analysis, key):
+            return str(analysis.get(key, "")).strip()
+
+        return {
+            "vermutung": "ja" if any(field(a, "vermutung").lower() == "ja" for a in analyses) else "nein",
+            "begruendung": "\n".join(f"{field(a, 'analysierte_sektion')}: {field(a, 'begruendung')}" for a in analyses),
+            "analysierte_sektion": "; ".join(field(a, "analysierte_sektion") for a in analyses),
+            "loesungsansatz": "\n".join(f"{field(a, 'analysierte_sektion')}: {field(a, 'loesungsansatz')}" for a in analyses),
+            "naechster_schritt": "done" if any(field(a, "naechster_schritt").lower() == "done" for a in analyses) else "neues gesetz waehlen",
+            "sektionen": analyses
+        }
         
 
     
-    def create_final_report(self):
+    @tracing.traced
+    async def create_final_report(self):
         output_format = {
             "zusammenfassung": "fasse noch einmal zusammen wie du beim beantworten der Frage vorgegangen bist",
             "komplexe_antwort": "gib eine möglichst genaue und komplexe antwort und erklaerung; zusätzliche informationen sind gerne gesehen; gerichtet an einen juristischen Experten",
@@ -516,54 +989,91 @@ class LawAgent:
         )
 
         # get chat completion and return the final report
-        final_report = self.get_chat_completion(current_human_message, model="16k")
+        final_report = await self.aget_chat_completion(current_human_message, model="16k")
         return final_report
     
 
-    def retry_completion(self):
-        
+    def retry_message(self):
         # specify human message so the law agent tries again
-        current_human_message = HumanMessage(
+        return HumanMessage(
             content=\
                 "Thanks a lot! But your output does not follow the specified format. "\
                 "Please try again. Do not explain yourself and do not give excuses. "\
                 "Make sure that your answer matches the previously specified output format exactly!"
         )
 
+
+    async def retry_completion(self, retries=0):
         # get chat completion and return the response
-        response = self.get_chat_completion(current_human_message, model="16k")
+        self.response_metrics.add("retries")
+        tracing.record(retries=1)
+        response = await self.aget_chat_completion(self.retry_message(), model="16k", kind=RETRY, retries=retries)
         return response
 
 
     
-    def get_chat_completion(self, human_message, model="4k"):
+    async def aget_chat_completion(self, human_message, model="4k", kind=TURN, retries=LLM_MAX_RETRIES):
         assert model in ["4k", "16k"]
+        self.add_human_message(human_message, kind)
+        self.compact_memory(model)
+        if self.token_meter is not None:
+            self.token_meter.spend(count_message_tokens(self.messages, self.token_budgets[model].model))
+
+        # get chat completion
+        tracing.record(llm_calls=1)
+        try:
+            if model == "4k": response = await achat(self.chat, self.messages)
+            if model == "16k": response = await achat(self.chat_16k, self.messages)
+        except InvalidRequestError:
+            response = await achat(self.chat_16k, self.messages)
+
+        try:
+            return self.parse_response(response)
+        except ValueError:
+            # could not be repaired -> ask again, at most retries times
+            if retries <= 0:
+                self.response_metrics.add("retries_exhausted")
+                raise
+            return await self.retry_completion(retries=retries-1)
+
 
+    def prompt_message(self, human_message):
         # clean human message
-        human_message = HumanMessage(
+        return HumanMessage(
             content=formatting.clean_text_for_prompt(human_message.content)  + f"\n\nDeine JSON-Antwort:"
         )
 
+
+    def add_human_message(self, human_message, kind=TURN):
         # append human message to conversation history and agent memory
-        self.add_message(human_message)
-        
-        # get chat completion
-        try:
-            if model == "4k": response = self.chat(self.messages)
-            if model == "16k": response = self.chat_16k(self.messages)
-        except KeyboardInterrupt:
-            raise KeyboardInterrupt
-        except InvalidRequestError:
-            response = self.chat_16k(self.messages)
+        self.add_message(self.prompt_message(human_message), kind)
+
+
+    def compact_memory(self, model):
+        # keep the prompt of the next call within the history budget of the model
+        self.memory.compact(self.token_budgets[model], MEMORY_HISTORY_TOKENS[model])
 
+
+    def parse_response(self, response):
         # append response message to conversation history and agent memory
         self.add_message(response)
 
         # do checks and return 
-        time.sleep(1)
         assert isinstance(response, AIMessage)
-        return json.loads(response.content)
-        # TODO: handle this better! -> i.e. return a message that the agent did not understand the human message
+        self.response_metrics.add("responses")
+        try:
+            return json.loads(response.content)
+        except json.JSONDecodeError:
+            pass
+
+        # common defects (code fences, trailing commas, single quotes, cut off answers) are fixed locally
+        try:
+            parsed = response_repair.repair_json(response.content)
+        except ValueError:
+            self.response_metrics.add("json_failed")
+            raise
+        self.response_metrics.add("json_repaired")
+        return parsed
 
 
     def reset_messages(self, out=False):
@@ -576,165 +1086,82 @@ class LawAgent:
                 if isinstance(m, AIMessage):        u = "AI"
                 print(u, m.content)
 
-        self.messages = self.messages[:1]
+        self.memory.reset()
 
 
-    def add_message(self, message):
-        self.messages.append(message)
+    def progress(self, stage, text):
+        # a failing callback must not stop the run
+        if self.on_progress is None: return
+        try:
+            self.on_progress(stage, text)
+        except Exception as e:
+            tracing.annotate(progress_error=f"{type(e).__name__}: {e}")
+
+
+    def fork(self):
+        # shallow copy that shares everything but the working memory and the conversation history
+        fork = copy.copy(self)
+        fork.memory = self.memory.fork()
+        fork.conversation_history = list()
+        return fork
+
+
+    def join(self, forks):
+        self.memory.join([f.memory for f in forks])
+        for fork in forks:
+            self.conversation_history.extend(fork.conversation_history)
+
+
+    def add_message(self, message, kind=TURN):
+        # the memory is compacted before every call, the conversation history is kept complete
+        self.memory.add(message, kind)
         self.conversation_history.append(message)
     
 
-    def get_gesetz_structure(self, gesetz_id):
+    @tracing.traced
+    async def get_gesetz_structure(self, gesetz_id):
 
         # Get Geltende Fassung von Gesetz
-        gesetz_structure_path = os.path.join("ris", "bundesrecht", f"gesetz_structure_{gesetz_id}.json")
-        if not os.path.exists(gesetz_structure_path):
-            url = f"https://www.ris.bka.gv.at/GeltendeFassung.wxe?Abfrage=Bundesnormen&Gesetzesnummer={gesetz_id}"
-            html = requests.get(url).text
-            soup = BeautifulSoup(html, "html.parser")
-            
-            pagebase = soup.find("div", {"id": "pagebase"})
-            content = pagebase.find("div", {"id": "content"})
-            document_contents = content.find_all("div", {"class": "documentContent"})
-            
-            gesetz_structure = {}
-            curr_ueberschr_g1 = None
-            curr_ueberschr_para = None
-            curr_gld_symbol = None
-            for doc_content in document_contents:
-                
-                # old version
-                # text_nodes = doc_content.find_all(string=True)
-                # text_nodes = [tn.strip() for tn in text_nodes if len(tn.strip()) > 0]
-                # text_nodes = [tn for tn in text_nodes if tn.lower() != "text"]
-                # text_nodes = [tn for tn in text_nodes if not tn.startswith("Art. ")]
-                # text_nodes = [formatting.clean_text_for_prompt(tn) for tn in text_nodes]
-                # section_name, section_content = " - ".join(text_nodes[:2]), text_nodes[2:]
-                # section_content = [c for c in section_content if not c.startswith("§")]
-                # section_content = [c for c in section_content if not c.startswith("Paragraph ")]
-                # section_content = [formatting.clean_text_for_prompt(c) for c in section_content]
-                # gesetz_structure[section_name.replace(" ", "")] = text_nodes[2:]
-
-                # new version
-                # gesetz_structure = {
-                #   "ueberschr_g1": {
-                #       "ueberschr_para": {
-                #           "gld_symbol": [ (title), absatz_text, absatz_text, ... ]
-                #        },
-                #       "gld_symbol": [ (title), absatz_text, absatz_text, ... ]
-                #   }
-                # }
-
-                # <h4 class="UeberschrG1 AlignCenter">
-                ueberschr_g1 = doc_content.find_all("h4", {"class": "UeberschrG1"})
-                if len(ueberschr_g1) > 0:
-                    assert len(ueberschr_g1) == 1
-                    curr_ueberschr_g1 = ueberschr_g1[0].text.strip()
-                    if curr_ueberschr_g1 not in gesetz_structure.keys(): 
-                        gesetz_structure[curr_ueberschr_g1] = {}
-                    
-                    curr_ueberschr_para = None
-                    curr_gld_symbol = None
-
-
-                # <h4 class="UeberschrPara AlignCenter">Abstammung</h4>
-                ueberschr_para = doc_content.find_all("h4", {"class": "UeberschrPara"})
-                if len(ueberschr_para) > 0:
-                    assert len(ueberschr_para) == 1
-                    curr_ueberschr_para = formatting.key_formatting_for_dict(ueberschr_para[0].text.strip())
-                    if curr_ueberschr_para not in gesetz_structure[str(curr_ueberschr_g1)].keys():
-                        gesetz_structure[curr_ueberschr_g1][curr_ueberschr_para] = {}
-
-                    curr_gld_symbol = None
-
-                # # <div class="ParagraphMitAbsatzzahl">
-                # para_mit_abs = doc_content.find_all("div", {"class": "ParagraphMitAbsatzzahl"})
-                # if len(para_mit_abs) > 0:
-                #     assert len(para_mit_abs) == 1
-                #     curr_para_mit_abs = para_mit_abs[0]
-
-                    
-                # <div class="MarginTop4 AlignJustify">
-                gld_symbol = doc_content.find_all("div", {"class": "MarginTop4"})
-                if len(gld_symbol) > 0:
-                    # <span class="sr-only">Paragraph 8,</span>
-                    text = gld_symbol[0].find_all("span", {"class": "sr-only"})
-                    assert len(text) > 0
-                    curr_gld_symbol = formatting.key_formatting_for_dict(text[0].text)
+        if not self.structure_store.exists(gesetz_id):
+            if GESETZ_STRUCTURE_STREAMING:
+                # sections go to the store as soon as they are downloaded and parsed
+                await self.stream_gesetz_structure(gesetz_id)
+            else:
+                html = await ris_client.fetch_geltende_fassung(gesetz_id)
 
-                else:
-                    # <h5 class="GldSymbol AlignJustify">
-                    gld_symbol = doc_content.find_all("h5", {"class": "GldSymbol"})
-                    if len(gld_symbol) > 0:
-                        curr_gld_symbol = formatting.key_formatting_for_dict(gld_symbol[0].find_all("span", {"class": "sr-only"})[0].text)
-                    
-                    
-
-                wai_absatz_list = doc_content.find_all("ol", {"class": "wai-absatz-list"})
-                wai_list = doc_content.find_all("ol", {"class": "wai-list"})
-                top = doc_content.find_all("div", {"class": "MarginTop4"})
-                if len(wai_absatz_list) > 0:
-                    law_text = []
-                    for wal in wai_absatz_list:
-                        lis = wai_absatz_list[0].find_all("li")
-                        
-                        for li in lis:
-                            absatz_zahl = li.find_all("span", {"class": "sr-only"})[0].text
-                            law_text.append(li.text)
-                
-                elif len(wai_list) > 0:
-                    law_text = []
-                    for wl in wai_list:
-                        lis = wl.find_all("li")
-                        # try to find title for list
-                        # <div class="MarginTop4 AlignJustify">
-                        if len(top) > 0:
-                            law_text.append([top[0].text] + [ li.text for li in lis])
-                        else:
-                            law_text.append([ li.text for li in lis])
-
-                # elif len(top) > 0:
-                #     law_text = top[0].text.strip()
-                #     law_text = [law_text]
-                else:
-                    law_text = [doc_content.text.strip()]
-
-                # TODO: add to gesetz_structure
-                # ...
-                if curr_ueberschr_g1 is not None:
-                    if curr_ueberschr_para is not None:
-                        if isinstance(gesetz_structure[curr_ueberschr_g1][curr_ueberschr_para], dict):
-                            if curr_gld_symbol not in gesetz_structure[curr_ueberschr_g1][curr_ueberschr_para].keys():
-                                gesetz_structure[curr_ueberschr_g1][curr_ueberschr_para][curr_gld_symbol] = [law_text]
-                            else:
-                                gesetz_structure[curr_ueberschr_g1][curr_ueberschr_para][curr_gld_symbol].append(law_text)
-                        else:
-                            if curr_gld_symbol not in gesetz_structure[curr_ueberschr_g1].keys():
-                                gesetz_structure[curr_ueberschr_g1][curr_gld_symbol] = [law_text]
-                            else:
-                                gesetz_structure[curr_ueberschr_g1][curr_gld_symbol].append(law_text)
-                    else:
-                        if curr_gld_symbol not in gesetz_structure[curr_ueberschr_g1].keys():
-                            gesetz_structure[curr_ueberschr_g1][curr_gld_symbol] = [law_text]
-                        else:
-                            gesetz_structure[curr_ueberschr_g1][curr_gld_symbol].append(law_text)
-                else:
-                    continue
+                # parsing is cpu bound -> keep it off the event loop
+                gesetz_structure = await asyncio.to_thread(ris_parser.parse_gesetz_structure, html)
 
+                # # create cleaner gesetz structure
+                # gesetz_structure = self.structure_gesetz_helper(gesetz_structure)
 
-            # # create cleaner gesetz structure
-            # gesetz_structure = self.structure_gesetz_helper(gesetz_structure)
+                # store compactly
+                await asyncio.to_thread(self.structure_store.write, gesetz_id, gesetz_structure)
 
-            # save as json
-            with open(gesetz_structure_path, "w") as f:
-                json.dump(gesetz_structure, f, indent=4, ensure_ascii=False)
+            # sections are only decompressed when they are accessed
+            gesetz_structure = await asyncio.to_thread(self.structure_store.open, gesetz_id)
+            await asyncio.to_thread(self.section_index.update, gesetz_id, gesetz_structure)
+            return gesetz_structure
 
-        else:
-            with open(gesetz_structure_path, "r") as f:
-                gesetz_structure = json.load(f, strict=False)
+        return await asyncio.to_thread(self.structure_store.open, gesetz_id)
+
+
+    async def stream_gesetz_structure(self, gesetz_id):
+        # lxml parsers must stay on one thread -> parse in a dedicated worker, off the event loop
+        loop = asyncio.get_running_loop()
+        writer = self.structure_store.writer(gesetz_id)
+        try:
+            # leaving the executor waits for a running feed, also when the download is cancelled
+            with ThreadPoolExecutor(max_workers=1) as parse_thread:
+                parser = await loop.run_in_executor(parse_thread, ris_parser.StreamingGesetzParser, writer.add_section, writer.add_heading)
+                async for chunk in ris_client.stream_geltende_fassung(gesetz_id):
+                    await loop.run_in_executor(parse_thread, parser.feed, chunk)
+                await loop.run_in_executor(parse_thread, parser.close)
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close()
 
-        return gesetz_structure
-    
 
 
     def structure_gesetz_helper(self, gesetz_structure):
@@ -791,20 +1218,8 @@ class LawAgent:
 if __name__ == "__main__":
     
     la = LawAgent()
-    fragen = [
-        "Welche Voraussetzungen müssen erfüllt sein, damit eine Person in Österreich die Staatsbürgerschaft erlangen kann?",
-        # "Welche Behörde ist in Österreich für die Registrierung von Unternehmen zuständig und welche Schritte sind erforderlich, um ein Unternehmen rechtlich anzumelden?",
-        # "Wie schnell darf ich auf der Autobahn mit einem Fahrrad fahren?",
-        # "Was sind die rechtlichen Bestimmungen für die Kündigung eines Arbeitsvertrags in Österreich und welche Rechte haben Arbeitnehmer und Arbeitgeber in diesem Zusammenhang?",
-        # "Welche gesetzlichen Regelungen gelten in Österreich für den Schutz des geistigen Eigentums, insbesondere für Markenrechte und Urheberrechte?",
-        # "Wie lange darf ein sich ein 15 jähriger in der Nacht draußen aufhalten?",
-        # "Welche steuerrechtlichen Regelungen gelten in Österreich für die Besteuerung von Einkommen aus dem Verkauf von Immobilien und wie hoch ist der Steuersatz?"
-    ]
-    for frage in fragen:
+    for frage in BEISPIEL_FRAGEN[:1]:
         la.run(frage)
 
 
     print("...done")
-
-
-
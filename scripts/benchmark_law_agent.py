@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import time
+import glob
+import inspect
+import threading
+import contextvars
+import argparse
+import datetime as dt
+
+# run from the repository root: python -m scripts.benchmark_law_agent --mode replay
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+
+STAGES = [
+    "choose_gesetz_from_retrieval",
+    "define_layers",
+    "choose_gesetz",
+    "summarize_progress",
+    "get_gesetz_structure",
+    "choose_section_from_index",
+    "choose_section_from_gesetz",
+    "analyze_full_gesetz",
+    "analyze_section_from_gesetz",
+    "analyze_sections",
+    "create_final_report",
+    "extract_fachbegriffe",
+    "generate_questions_for_fachbegriffe",
+]
+
+
+
+def load_fragen(beispiel_fragen, answered_dir="answered"):
+    # fixed question set: example questions of law_agent.py + all previously answered questions
+    fragen = list(beispiel_fragen)
+    for path in sorted(glob.glob(os.path.join(answered_dir, "*.json"))):
+        with open(path, "r") as f:
+            rechtsfrage = json.load(f).get("rechtsfrage")
+        if rechtsfrage and rechtsfrage not in fragen:
+            fragen.append(rechtsfrage)
+    return fragen
+
+
+
+class StageStats:
+
+    def __init__(self) -> None:
+        # fachbegriff sub-agents run concurrently; stage times are summed over all agents
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.stages = {stage: {"calls": 0, "wall_time": 0.0} for stage in STAGES}
+        self.llm = {"calls": 0, "api_calls": 0, "wall_time": 0.0, "prompt_chars": 0, "response_chars": 0}
+
+    def as_dict(self):
+        return {
+            "stages": {k: v for k, v in self.stages.items() if v["calls"] > 0},
+            "llm": dict(self.llm)
+        }
+
+
+
+def instrument(agent_class, stats):
+    # patch the class (not the instance) so fachbegriff sub-agents are measured as well
+    module = inspect.getmodule(agent_class)
+    in_completion = contextvars.ContextVar("in_completion", default=False)
+
+    def add_stage(stage, s):
+        with stats.lock:
+            stats.stages[stage]["calls"] += 1
+            stats.stages[stage]["wall_time"] += time.perf_counter() - s
+
+    def add_completion(s):
+        # one completion including its retries (aget_chat_completion calls itself to retry)
+        with stats.lock:
+            stats.llm["calls"] += 1
+            stats.llm["wall_time"] += time.perf_counter() - s
+
+    def completion(method):
+        async def wrapper(self, *args, **kwargs):
+            if in_completion.get(): return await method(self, *args, **kwargs)
+            token = in_completion.set(True)
+            s = time.perf_counter()
+            try: return await method(self, *args, **kwargs)
+            finally:
+                in_completion.reset(token)
+                add_completion(s)
+        return wrapper
+
+    def measured(achat):
+        # every api request with the messages it actually sends (after compaction)
+        async def wrapper(chat, messages):
+            with stats.lock:
+                stats.llm["api_calls"] += 1
+                stats.llm["prompt_chars"] += sum(len(m.content) for m in messages)
+            response = await achat(chat, messages)
+            with stats.lock:
+                stats.llm["response_chars"] += len(response.content)
+            return response
+        return wrapper
+
+    def timed(method, on_done, key):
+        if inspect.iscoroutinefunction(method):
+            async def async_wrapper(self, *args, **kwargs):
+                s = time.perf_counter()
+                try: return await method(self, *args, **kwargs)
+                finally: on_done(key, s)
+            return async_wrapper
+
+        def wrapper(self, *args, **kwargs):
+            s = time.perf_counter()
+            try: return method(self, *args, **kwargs)
+            finally: on_done(key, s)
+        return wrapper
+
+    for stage in STAGES:
+        setattr(agent_class, stage, timed(getattr(agent_class, stage), add_stage, stage))
+    agent_class.aget_chat_completion = completion(agent_class.aget_chat_completion)
+    module.achat = measured(module.achat)
+
+
+
+def print_report(results):
+    for result in results:
+        print(f"\n{result['rechtsfrage']}")
+        print(f"  total: {result['wall_time']:.2f}s  status: {result['status']}")
+        for stage, v in result["stages"].items():
+            print(f"  {stage:<38} {v['calls']:>4}x {v['wall_time']:>9.3f}s")
+        llm = result["llm"]
+        print(
+            f"  {'llm calls':<38} {llm['calls']:>4}x {llm['wall_time']:>9.3f}s  {llm['api_calls']} requests,"
+            f" prompt {llm['prompt_chars']} chars, response {llm['response_chars']} chars"
+        )
+
+    total = sum(r["wall_time"] for r in results)
+    calls = sum(r["llm"]["calls"] for r in results)
+    print(f"\n{len(results)} questions, {total:.2f}s total, {calls} llm calls")
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end latency benchmark for LawAgent.run")
+    parser.add_argument("--mode", choices=["live", "record", "replay"], default="replay")
+    parser.add_argument("--recording", default=os.path.join("benchmarks", "recordings", "llm_recording.jsonl"))
+    parser.add_argument("--questions", type=int, default=None, help="only run the first n questions")
+    parser.add_argument("--max-iterations", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="fachbegriff sub-agent workers")
+    parser.add_argument("--no-cache", action="store_true", help="bypass the persistent llm response cache")
+    parser.add_argument("--reuse-answers", action="store_true", help="answer near-duplicate questions from earlier answers")
+    args = parser.parse_args()
+
+    # configure the agent before it is imported (config is read at import time)
+    run_name = dt.datetime.now().strftime("%Y%m%d_%H%M%S")
+    results_dir = os.path.join("benchmarks", "results")
+    os.environ["LAW_AGENT_LLM_MODE"] = args.mode
+    os.environ["LAW_AGENT_LLM_RECORDING"] = args.recording
+    os.environ["LAW_AGENT_ANSWERED_DIR"] = os.path.join(results_dir, f"answered_{run_name}")
+    if args.workers is not None: os.environ["LAW_AGENT_FACHBEGRIFFE_WORKERS"] = str(args.workers)
+    if args.no_cache: os.environ["LAW_AGENT_LLM_CACHE"] = "0"
+    if not args.reuse_answers: os.environ["LAW_AGENT_ANSWER_REUSE"] = "0"
+
+    import law_agent
+
+    stats = StageStats()
+    instrument(law_agent.LawAgent, stats)
+
+    fragen = load_fragen(law_agent.BEISPIEL_FRAGEN)
+    if args.questions is not None: fragen = fragen[:args.questions]
+
+    results = []
+    for frage in fragen:
+        stats.reset()
+
+        s = time.perf_counter()
+        try:
+            # define_layer samples example categories -> seed for reproducible prompts
+            la = law_agent.LawAgent(seed=args.seed)
+            la.run(frage, max_interations=args.max_iterations)
+            status = "ok"
+        except KeyboardInterrupt:
+            raise       # stops the whole benchmark, the interrupted run is saved by the agent
+        except Exception as e:
+            status = f"{type(e).__name__}: {e}"
+
+        results.append({
+            "rechtsfrage": frage,
+            "status": status,
+            "wall_time": time.perf_counter() - s,
+            **stats.as_dict()
+        })
+
+    print_report(results)
+    llm_cache_stats = law_agent.get_registry().llm_cache.stats()
+    print(f"llm cache: {llm_cache_stats['hits']} hits, {llm_cache_stats['misses']} misses, {llm_cache_stats['entries']} entries")
+    for model, limiter in law_agent.get_registry().rate_limiters.items():
+        m = limiter.metrics()
+        print(f"rate limiter {model}: {m['requests']} requests, {m['waits']} waits ({m['wait_time']:.2f}s), {m['rate_limit_errors']} rate limit errors")
+    m = law_agent.get_registry().response_metrics.metrics()
+    print(
+        f"responses: {m['responses']}, {m['json_repaired']} json repaired, {m['sections_rescued']} section choices matched locally,"
+        f" {m['retries']} retries ({m['retries_exhausted']} exhausted), {m['avoided_round_trips']} round trips avoided"
+    )
+
+    m = law_agent.get_registry().answer_index.metrics()
+    print(f"answer index: {m['answers']} answers, {m['matches']} of {m['lookups']} questions matched an earlier answer")
+
+    os.makedirs(results_dir, exist_ok=True)
+    results_path = os.path.join(results_dir, f"benchmark_{args.mode}_{run_name}.json")
+    with open(results_path, "w") as f:
+        json.dump(results, f, indent=4, ensure_ascii=False)
+    print(f"Results saved to {results_path}")
+
+
+
+if __name__ == "__main__":
+    main()
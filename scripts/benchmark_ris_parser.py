@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import datetime as dt
+from collections import Counter
+
+from bs4 import BeautifulSoup
+
+# run from the repository root: python -m scripts.benchmark_ris_parser [gesetzesnummer ...]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import GESETZ_STRUCTURE_DIR
+from utils import formatting, ris_client, ris_parser
+from utils.structure_store import GesetzStructureStore
+
+
+
+def legacy_parse_gesetz_structure(html):
+    # reference: the former LawAgent.parse_gesetz_structure (html.parser, one find_all scan per element type),
+    # only guarded against missing headings so that it runs on every law
+    soup = BeautifulSoup(html, "html.parser")
+
+    pagebase = soup.find("div", {"id": "pagebase"})
+    content = pagebase.find("div", {"id": "content"})
+    document_contents = content.find_all("div", {"class": "documentContent"})
+
+    gesetz_structure = {}
+    curr_ueberschr_g1 = None
+    curr_ueberschr_para = None
+    curr_gld_symbol = None
+    for doc_content in document_contents:
+        ueberschr_g1 = doc_content.find_all("h4", {"class": "UeberschrG1"})
+        if len(ueberschr_g1) > 0:
+            curr_ueberschr_g1 = ueberschr_g1[0].text.strip()
+            if curr_ueberschr_g1 not in gesetz_structure.keys():
+                gesetz_structure[curr_ueberschr_g1] = {}
+            curr_ueberschr_para = None
+            curr_gld_symbol = None
+
+        ueberschr_para = doc_content.find_all("h4", {"class": "UeberschrPara"})
+        if len(ueberschr_para) > 0 and curr_ueberschr_g1 is not None:
+            curr_ueberschr_para = formatting.key_formatting_for_dict(ueberschr_para[0].text.strip())
+            if curr_ueberschr_para not in gesetz_structure[str(curr_ueberschr_g1)].keys():
+                gesetz_structure[curr_ueberschr_g1][curr_ueberschr_para] = {}
+            curr_gld_symbol = None
+
+        gld_symbol = doc_content.find_all("div", {"class": "MarginTop4"})
+        if len(gld_symbol) > 0:
+            text = gld_symbol[0].find_all("span", {"class": "sr-only"})
+            if len(text) > 0: curr_gld_symbol = formatting.key_formatting_for_dict(text[0].text)
+        else:
+            gld_symbol = doc_content.find_all("h5", {"class": "GldSymbol"})
+            if len(gld_symbol) > 0:
+                text = gld_symbol[0].find_all("span", {"class": "sr-only"})
+                if len(text) > 0: curr_gld_symbol = formatting.key_formatting_for_dict(text[0].text)
+
+        wai_absatz_list = doc_content.find_all("ol", {"class": "wai-absatz-list"})
+        wai_list = doc_content.find_all("ol", {"class": "wai-list"})
+        top = doc_content.find_all("div", {"class": "MarginTop4"})
+        if len(wai_absatz_list) > 0:
+            law_text = []
+            for wal in wai_absatz_list:
+                lis = wai_absatz_list[0].find_all("li")
+                for li in lis:
+                    law_text.append(li.text)
+        elif len(wai_list) > 0:
+            law_text = []
+            for wl in wai_list:
+                lis = wl.find_all("li")
+                if len(top) > 0:
+                    law_text.append([top[0].text] + [li.text for li in lis])
+                else:
+                    law_text.append([li.text for li in lis])
+        else:
+            law_text = [doc_content.text.strip()]
+
+        if curr_ueberschr_g1 is None: continue
+        section = gesetz_structure[curr_ueberschr_g1]
+        if curr_ueberschr_para is not None: section = section[curr_ueberschr_para]
+        section.setdefault(curr_gld_symbol, []).append(law_text)
+
+    return gesetz_structure
+
+
+def paragraphs(value):
+    if isinstance(value, dict):
+        for v in value.values(): yield from paragraphs(v)
+    elif isinstance(value, list):
+        for v in value: yield from paragraphs(v)
+    elif isinstance(value, str):
+        yield value.strip()
+
+
+def duplicated_paragraphs(gesetz_structure):
+    # paragraphs that occur more than once within the same section
+    duplicates = 0
+    for value in gesetz_structure.values():
+        if isinstance(value, dict):
+            duplicates += duplicated_paragraphs(value)
+            continue
+        counts = Counter(p for p in paragraphs(value) if len(p) > 0)
+        duplicates += sum(n - 1 for n in counts.values() if n > 1)
+    return duplicates
+
+
+def load_html(gesetz_id, html_dir):
+    # GeltendeFassung pages are cached as raw html, missing ones are downloaded once
+    path = os.path.join(html_dir, f"{gesetz_id}.html")
+    if not os.path.exists(path):
+        html = asyncio.run(ris_client.fetch_geltende_fassung(gesetz_id))
+        os.makedirs(html_dir, exist_ok=True)
+        with open(path, "w") as f: f.write(html)
+    with open(path, "r") as f:
+        return f.read()
+
+
+def best_of(f, html, repeat):
+    times = []
+    for _ in range(repeat):
+        s = time.perf_counter()
+        result = f(html)
+        times.append(time.perf_counter() - s)
+    return min(times), result
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse time of GeltendeFassung pages: legacy extraction vs ris_parser")
+    parser.add_argument("gesetz_ids", nargs="*", help="default: all laws of the structure cache")
+    parser.add_argument("--html-dir", default=os.path.join("ris", "html"))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    gesetz_ids = args.gesetz_ids or [g for g in GesetzStructureStore(GESETZ_STRUCTURE_DIR).gesetz_ids() if g.isdigit()]
+
+    results = []
+    for gesetz_id in gesetz_ids:
+        try:
+            html = load_html(gesetz_id, args.html_dir)
+        except Exception as e:
+            print(f"{gesetz_id:>10}  no html ({type(e).__name__}: {e})")
+            continue
+
+        t_legacy, legacy = best_of(legacy_parse_gesetz_structure, html, args.repeat)
+        t_engine, engine = best_of(ris_parser.parse_gesetz_structure, html, args.repeat)
+        result = {
+            "gesetz_id": gesetz_id,
+            "html_bytes": len(html.encode("utf-8")),
+            "legacy_time": t_legacy,
+            "engine_time": t_engine,
+            "speedup": t_legacy / t_engine if t_engine > 0 else None,
+            "legacy_duplicates": duplicated_paragraphs(legacy),
+            "engine_duplicates": duplicated_paragraphs(engine),
+            "sections": sum(1 for _ in paragraphs(engine)),
+        }
+        results.append(result)
+        print(
+            f"{gesetz_id:>10}  {result['html_bytes']/1024:8.1f}kB  legacy {t_legacy*1000:8.1f}ms  engine {t_engine*1000:7.1f}ms"
+            f"  x{result['speedup']:.1f}  duplicated paragraphs {result['legacy_duplicates']} -> {result['engine_duplicates']}"
+        )
+
+    if len(results) == 0: return
+    t_legacy = sum(r["legacy_time"] for r in results)
+    t_engine = sum(r["engine_time"] for r in results)
+    print(f"Total legacy {t_legacy:.3f}s  engine {t_engine:.3f}s  x{t_legacy/t_engine:.1f}")
+
+    results_dir = os.path.join("benchmarks", "results")
+    os.makedirs(results_dir, exist_ok=True)
+    results_path = os.path.join(results_dir, f"ris_parser_{dt.datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(results_path, "w") as f:
+        json.dump(results, f, indent=4, ensure_ascii=False)
+    print(f"Results saved to {results_path}")
+
+
+
+if __name__ == "__main__":
+    main()
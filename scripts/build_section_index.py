@@ -0,0 +1,27 @@
+import os
+import sys
+import time
+
+# run from the repository root: python -m scripts.build_section_index ["frage" gesetzesnummer]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import GESETZ_STRUCTURE_DIR, SECTION_INDEX_DIR
+from utils.section_index import SectionIndex, section_label
+from utils.structure_store import GesetzStructureStore
+
+
+
+section_index = SectionIndex(SECTION_INDEX_DIR, GesetzStructureStore(GESETZ_STRUCTURE_DIR))
+
+s = time.time()
+n = section_index.build_all()
+print(f"Indexed sections of {n} Gesetze in {time.time()-s:.2f}s")
+
+# optional: rank the sections of one law for a question
+if len(sys.argv) == 3:
+    frage, gesetz_id = sys.argv[1], sys.argv[2]
+    s = time.time()
+    ranked = section_index.rank(gesetz_id, frage, k=10)
+    print(f"Ranked in {(time.time()-s)*1000:.1f}ms")
+    for path, score in ranked:
+        print(f"{score:8.3f}  {section_label(path)}")
@@ -0,0 +1,40 @@
+import os
+import sys
+import json
+import time
+
+# run from the repository root: python -m scripts.convert_gesetz_structures
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import GESETZ_STRUCTURE_DIR
+from utils.structure_store import GesetzStructureStore
+
+
+
+store = GesetzStructureStore(GESETZ_STRUCTURE_DIR)
+
+json_bytes, store_bytes = 0, 0
+for gesetz_id in store.gesetz_ids():
+    json_path = store.json_path(gesetz_id)
+    if not os.path.exists(json_path): continue
+
+    store.convert(gesetz_id)
+    size_json = os.path.getsize(json_path)
+    size_store = os.path.getsize(store.toc_path(gesetz_id)) + os.path.getsize(store.blob_path(gesetz_id))
+    json_bytes += size_json
+    store_bytes += size_store
+
+    # compare full json load against opening the table of contents
+    s = time.time()
+    with open(json_path, "r") as f: json.load(f, strict=False)
+    t_json = time.time() - s
+
+    store.opened.pop(gesetz_id, None)
+    s = time.time()
+    store.open(gesetz_id)
+    t_store = time.time() - s
+
+    print(f"{gesetz_id:>20}  {size_json/1024:8.1f}kB -> {size_store/1024:8.1f}kB   load {t_json*1000:7.1f}ms -> {t_store*1000:6.1f}ms")
+
+if json_bytes > 0:
+    print(f"Total {json_bytes/1024:.1f}kB -> {store_bytes/1024:.1f}kB ({store_bytes/json_bytes:.0%})")
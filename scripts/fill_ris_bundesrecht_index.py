@@ -1,151 +1,116 @@
 import os
-import re
+import sys
 import json
 import time
+from concurrent.futures import ProcessPoolExecutor
 
-import requests
-from bs4 import BeautifulSoup
+# run from the repository root: python -m scripts.fill_ris_bundesrecht_index [--force-update | --compact-only]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from config import RIS_FETCH_WORKERS, RIS_REQUESTS_PER_SECOND, RIS_MAX_PER_HOST, RIS_PARSE_WORKERS, RIS_INDEX_CHECKPOINT_PATH
+from utils.index_checkpoint import IndexCheckpoint
+from utils.ris_client import RIS_BASE_URL, bundesnormen_search_url
+from utils.ris_fetcher import RISFetcher, fetch_and_parse
+from utils.ris_parser import parse_result_page, parse_gesetz_info
 
 
-# load bundesrecht index
-with open(os.path.join("ris", "bundesrecht_index.json"), "r") as f:
-    bundesrecht_index = json.load(f)
 
-print("Bundesrecht index loaded successfully!")
+PAGE_SIZE = 100
 
 
-
-def fill_recursive(index, counter=0, depth=0, force_update=False):
-
+def collect_categories(index, categories=None):
+    # all leaf categories (lists of laws) of the index, in index order
+    categories = categories if categories is not None else []
     for key, value in index.items():
-        print("  "*depth, key)
-        
         if isinstance(value, list):
-            time.sleep(1)
-            
-            # start_scraping
-            index_num = key.split(" ")[0]
-            position = 1
-            
-            while True:
-                results_url = f"https://www.ris.bka.gv.at/Ergebnis.wxe?Abfrage=Bundesnormen&Kundmachungsorgan=&Index={index_num}&Titel=&Gesetzesnummer=&VonArtikel=&BisArtikel=&VonParagraf=0&BisParagraf=&VonAnlage=&BisAnlage=&Typ=&Kundmachungsnummer=&Unterzeichnungsdatum=&FassungVom=29.05.2023&VonInkrafttretedatum=&BisInkrafttretedatum=&VonAusserkrafttretedatum=&BisAusserkrafttretedatum=&NormabschnittnummerKombination=Und&ImRisSeitVonDatum=&ImRisSeitBisDatum=&ImRisSeit=Undefined&ResultPageSize=100&Suchworte=&Position={position}"
-
-
-                req = requests.get(results_url).text
-                soup = BeautifulSoup(req, "html.parser")
-
-                if "Die eingegebene Suchabfrage liefert keine Treffer" in req:
-                    break 
-
-                table = soup.find("tbody", {"class": "bocListTableBody"})
-                rows = table.find_all('tr')
-
-                # check if there are more than 100 documents
-                from_to_amount_string = soup.find_all("span", {"class": "NumberOfDocuments"})[0].text.strip()
-                numbers = re.findall(r'\d+', from_to_amount_string)
-                assert len(numbers) == 3, "Extracting from, to and amount of documents failed"
-                from_number = int(numbers[0])
-                to_number = int(numbers[1])
-                amount = int(numbers[2])
-                position = to_number + 1
-
-                print(f"  "*(depth+1), f"Scraping {from_number} to {to_number} of {amount} documents.")
-
-                for row in rows:
-                    time.sleep(0.1)
-                    s = time.time()
-                    # get the link to the html from the nativeDocumentLinkCell
-                    html_link = row.find_all("a", {"class": "iconOnlyLink"})[0]["href"]
-
-                    doc_nr = html_link.strip().split("/")[-1].split(".")[0]
-                    doc_nrs_in_value = [doc["gesetzesnummer"] for doc in value]
-                    if (doc_nr in doc_nrs_in_value) and not force_update:
-                        print("  "*(depth+1), f" * Gesetz already scraped: {doc_nr}")
-                        continue
-
-                    # fetch the html
-                    gesetz_url = f"https://www.ris.bka.gv.at{html_link}"
-                    gesetz = requests.get(gesetz_url).text
-                    gesetz_soup = BeautifulSoup(gesetz, "html.parser")
-
-                    content_blocks = gesetz_soup.find_all("div", {"class": "contentBlock"})
-
-                    gesetz_info = {
-                        "gesetzesnummer": "",
-                        "kurztitel": "",
-                        "langtitel": "",
-                        "kundmachungsorgan": "",
-                        "inkrafttretensdatum": "",
-                        "zuletzt_aktualisiert_am": "",
-                        "typ": "",
-                        "schlagworte": "",
-                        "dokumentnummer": "",
-                        "zusammenfassung": ""
-                    }
-                    
-                    # fill the gesetz_info dict
-                    for block in content_blocks:
-                        # get the title of the block
-                        title = block.find("h1", {"class": "Titel"}).text.strip()
-                        # get the content of the block
-                        try:
-                            content = block.find("p").text.strip()
-                        except KeyboardInterrupt:
-                            raise KeyboardInterrupt
-                        except:
-                            content = "* extraction failed *"
-
-                        # fill the gesetz_info dict
-                        if title == "Gesetzesnummer":
-                            gesetz_info["gesetzesnummer"] = content
-                        elif title == "Kurztitel":
-                            gesetz_info["kurztitel"] = content
-                        elif title == "Langtitel":
-                            gesetz_info["langtitel"] = content
-                        elif title == "Kundmachungsorgan":
-                            gesetz_info["kundmachungsorgan"] = content
-                        elif title == "Inkrafttretensdatum":
-                            gesetz_info["inkrafttretensdatum"] = content
-                        elif title == "Zuletzt aktualisiert am":
-                            gesetz_info["zuletzt_aktualisiert_am"] = content
-                        elif title == "Typ":
-                            gesetz_info["typ"] = content
-                        elif title == "Schlagworte":
-                            gesetz_info["schlagworte"] = content
-                        elif title == "Dokumentnummer":
-                            gesetz_info["dokumentnummer"] = content
-                        elif title == "Zusammenfassung":
-                            gesetz_info["zusammenfassung"] = content
-                        else:
-                            gesetz_info[title] = content
-                            
-                    counter += 1
-
-                    kurztitel = gesetz_info["kurztitel"]
-                    print("  "*(depth+1), f" [{counter}] - {time.time()-s:.4f}s - Filled Gesetz: {kurztitel}")
-
-                    value.append(gesetz_info)
-                
-                # break if all documents are scraped
-                if position > amount: break
-            
+            categories.append((key, value))
         else:
             assert isinstance(value, dict)
-            value, counter = fill_recursive(value, depth=depth+1, counter=counter)
-    
-    return index, counter
-
-
-
-
-print("Starting recursive filling.")
-bundesrecht_index, counter = fill_recursive(bundesrecht_index)
-print("Recursive filling completed successfully!")
-print(f"Filled {counter} Gesetze.")
-
-
-# save bundesrecht index
-with open(os.path.join("ris", "bundesrecht_index_filled.json"), "w") as f:
-    json.dump(bundesrecht_index, f, indent=4, ensure_ascii=False)
-
+            collect_categories(value, categories)
+    return categories
+
+
+def fill(index, fetcher, parse_pool, checkpoint, force_update=False):
+    # every page and law is written through to the checkpoint -> a restart only fetches what is missing
+    categories = [key for key, _ in collect_categories(index)]
+    pages = checkpoint.pages() if not force_update else dict()
+    print(f"{len(categories)} categories, {len(pages)} result pages and {len(checkpoint.scraped)} Gesetze checkpointed.")
+
+    def report_failed(failed):
+        for tag, error in failed.items():
+            print(f" ! {tag}: {error}")
+
+    def fetch_pages(jobs):
+        failed = dict()
+        for (key, position), page in fetch_and_parse(fetcher, parse_pool, jobs, parse_result_page, errors=failed):
+            checkpoint.put_page(key, position, page)
+            pages[(key, position)] = page
+        report_failed(failed)
+
+    # first result page of every category tells how many pages follow
+    fetch_pages({
+        bundesnormen_search_url(key.split(" ")[0], 1): (key, 1)
+        for key in categories if (key, 1) not in pages
+    })
+    more_pages = dict()
+    for key in categories:
+        page = pages.get((key, 1))
+        if page is None: continue
+        _, _, to_number, amount = page
+        for position in range(to_number + 1, amount + 1, PAGE_SIZE):
+            if (key, position) in pages: continue
+            more_pages[bundesnormen_search_url(key.split(" ")[0], position)] = (key, position)
+    fetch_pages(more_pages)
+    print(f"{len(pages)} result pages.")
+
+    # all law documents that are not scraped yet, ranked by their place in the results
+    targets = dict()    # document url -> [(category, doc_nr, rank)]
+    for (key, position), page in pages.items():
+        if page is None: continue
+        links, _, _, _ = page
+        for row, html_link in enumerate(links):
+            doc_nr = html_link.strip().split("/")[-1].split(".")[0]
+            if checkpoint.has_law(key, doc_nr) and not force_update: continue
+            targets.setdefault(f"{RIS_BASE_URL}{html_link}", []).append((key, doc_nr, position + row))
+    print(f"Fetching {len(targets)} Gesetze.")
+
+    counter, failed = 0, dict()
+    documents = {url: url for url in targets}
+    for url, gesetz_info in fetch_and_parse(fetcher, parse_pool, documents, parse_gesetz_info, errors=failed):
+        for key, doc_nr, rank in targets[url]:
+            checkpoint.put_law(key, doc_nr, rank, gesetz_info)
+        counter += 1
+        print(f" [{counter}] {key.split(' ')[0]} - Filled Gesetz: {gesetz_info['kurztitel']}")
+    report_failed(failed)
+
+    return counter
+
+
+
+if __name__ == "__main__":
+    # load bundesrecht index
+    with open(os.path.join("ris", "bundesrecht_index.json"), "r") as f:
+        bundesrecht_index = json.load(f)
+
+    print("Bundesrecht index loaded successfully!")
+
+    checkpoint = IndexCheckpoint(RIS_INDEX_CHECKPOINT_PATH)
+    if "--compact-only" not in sys.argv:
+        s = time.time()
+        with RISFetcher(max_workers=RIS_FETCH_WORKERS, requests_per_second=RIS_REQUESTS_PER_SECOND, max_per_host=RIS_MAX_PER_HOST) as fetcher, \
+                ProcessPoolExecutor(max_workers=RIS_PARSE_WORKERS) as parse_pool:
+            print("Starting concurrent filling.")
+            counter = fill(bundesrecht_index, fetcher, parse_pool, checkpoint, force_update="--force-update" in sys.argv)
+            metrics = fetcher.metrics()
+
+        print("Filling completed successfully!")
+        print(f"Filled {counter} Gesetze in {time.time()-s:.1f}s.")
+        print(f"{metrics['requests']} requests, {metrics['bytes']/1024/1024:.1f}MB, {metrics['retries']} retries, {metrics['errors']} errors, {metrics['wait_time']:.1f}s politeness wait")
+
+
+    # compact the checkpoint into the filled bundesrecht index
+    bundesrecht_index, counter = checkpoint.compact(bundesrecht_index)
+    checkpoint.close()
+    with open(os.path.join("ris", "bundesrecht_index_filled.json"), "w") as f:
+        json.dump(bundesrecht_index, f, indent=4, ensure_ascii=False)
+    print(f"Saved {counter} Gesetze to the filled index.")
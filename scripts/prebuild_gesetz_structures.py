@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+# run from the repository root: python -m scripts.prebuild_gesetz_structures [gesetzesnummer ...] [--force]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import (
+    GESETZ_STRUCTURE_DIR, SECTION_INDEX_DIR,
+    RIS_FETCH_WORKERS, RIS_REQUESTS_PER_SECOND, RIS_MAX_PER_HOST, RIS_PARSE_WORKERS
+)
+from utils import ris_parser
+from utils.ris_client import geltende_fassung_url
+from utils.ris_fetcher import RISFetcher, fetch_and_parse
+from utils.section_index import SectionIndex
+from utils.structure_store import GesetzStructureStore
+
+
+
+store = GesetzStructureStore(GESETZ_STRUCTURE_DIR)
+section_index = SectionIndex(SECTION_INDEX_DIR, store)
+
+
+def build_structure(gesetz_id, html):
+    # runs in the process pool: parse, store and index one law, only a summary goes back
+    s = time.time()
+    gesetz_structure = ris_parser.parse_gesetz_structure(html)
+    store.write(gesetz_id, gesetz_structure)
+    section_index.update(gesetz_id, gesetz_structure)
+    return {
+        "sections": sum(1 for _ in store.open(gesetz_id).sections),
+        "html_bytes": len(html),
+        "parse_time": time.time() - s
+    }
+
+
+def collect_gesetzesnummern(index):
+    gesetzesnummern = dict()
+    def walk(node):
+        if isinstance(node, dict):
+            for value in node.values(): walk(value)
+            return
+        for g in node:
+            gesetzesnummer = str(g["gesetzesnummer"]).strip()
+            if gesetzesnummer.isdigit(): gesetzesnummern[gesetzesnummer] = None
+    walk(index)
+    return list(gesetzesnummern)
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch, parse and index the structure of every law of the filled Bundesrecht index")
+    parser.add_argument("gesetz_ids", nargs="*", help="default: every gesetzesnummer of ris/bundesrecht_index_filled.json")
+    parser.add_argument("--force", action="store_true", help="rebuild laws that are already cached")
+    parser.add_argument("--limit", type=int, default=None, help="only build the first n missing laws")
+    parser.add_argument("--report", default=os.path.join("ris", "bundesrecht_prebuild_report.json"))
+    args = parser.parse_args()
+
+    gesetz_ids = args.gesetz_ids
+    if len(gesetz_ids) == 0:
+        with open(os.path.join("ris", "bundesrecht_index_filled.json"), "r") as f:
+            gesetz_ids = collect_gesetzesnummern(json.load(f))
+    todo = [g for g in gesetz_ids if args.force or not store.exists(g)]
+    if args.limit is not None: todo = todo[:args.limit]
+    print(f"{len(gesetz_ids)} Gesetze, {len(gesetz_ids) - len(todo)} already cached, building {len(todo)}.")
+    if len(todo) == 0: return
+
+    built, failed = dict(), dict()
+    s = time.time()
+    with RISFetcher(max_workers=RIS_FETCH_WORKERS, requests_per_second=RIS_REQUESTS_PER_SECOND, max_per_host=RIS_MAX_PER_HOST) as fetcher, \
+            ProcessPoolExecutor(max_workers=RIS_PARSE_WORKERS) as parse_pool:
+        jobs = {geltende_fassung_url(g): g for g in todo}
+        for gesetz_id, summary in fetch_and_parse(fetcher, parse_pool, jobs, build_structure, errors=failed, with_tag=True):
+            built[gesetz_id] = summary
+            done = len(built) + len(failed)
+            elapsed = time.time() - s
+            print(
+                f" [{done}/{len(todo)}] {gesetz_id:>10}  {summary['sections']:5d} sections  {summary['html_bytes']/1024:8.1f}kB"
+                f"  parse {summary['parse_time']:.2f}s  eta {elapsed / done * (len(todo) - done):.0f}s  ({len(failed)} failed)"
+            )
+        metrics = fetcher.metrics()
+
+    print(f"Built {len(built)} of {len(todo)} Gesetze in {time.time()-s:.1f}s, {len(failed)} failed.")
+    print(f"{metrics['requests']} requests, {metrics['bytes']/1024/1024:.1f}MB, {metrics['retries']} retries, {metrics['wait_time']:.1f}s politeness wait")
+    for gesetz_id, error in failed.items():
+        print(f" ! {gesetz_id}: {error}")
+
+    with open(args.report, "w") as f:
+        json.dump({"built": built, "failed": failed}, f, indent=4, ensure_ascii=False)
+    print(f"Report saved to {args.report}")
+
+
+
+if __name__ == "__main__":
+    main()
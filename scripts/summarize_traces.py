@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import argparse
+import datetime as dt
+from collections import defaultdict
+
+# run from the repository root: python -m scripts.summarize_traces [traces/trace.jsonl] [--last 10] [--trace id]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import LLM_PRICES, TRACE_PATH
+from utils.tracing import COUNTERS
+
+
+
+def load_spans(path):
+    spans = []
+    with open(path, "r") as f:
+        for i, line in enumerate(f):
+            try:
+                spans.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"skipping line {i+1}: not valid json")     # e.g. cut off by a crash
+    return spans
+
+
+def cost(spans):
+    # USD of the api calls, cache hits and replays are free
+    total = 0.0
+    for span in spans:
+        for model, usage in span["models"].items():
+            prompt_price, completion_price = LLM_PRICES.get(model, (0.0, 0.0))
+            total += usage["prompt_tokens"] / 1000 * prompt_price + usage["completion_tokens"] / 1000 * completion_price
+    return total
+
+
+def totals(spans):
+    # spans only count their own llm usage -> sums over a trace are exact
+    return {c: sum(span[c] for span in spans) for c in COUNTERS}
+
+
+def group_traces(spans):
+    traces = defaultdict(list)
+    for span in spans: traces[span["trace_id"]].append(span)
+    return sorted(traces.values(), key=lambda t: min(s["start"] for s in t))
+
+
+def root_of(trace):
+    roots = [s for s in trace if s["parent_id"] is None]
+    return roots[0] if len(roots) > 0 else min(trace, key=lambda s: s["start"])
+
+
+
+def print_runs(traces):
+    print(f"{'start':<19} {'trace':<8} {'wall':>8} {'calls':>5} {'prompt':>8} {'compl':>7} {'cache':>5} {'retry':>5} {'cost $':>8}  rechtsfrage")
+    for trace in traces:
+        root, t = root_of(trace), totals(trace)
+        start = dt.datetime.fromtimestamp(root["start"]).strftime("%Y-%m-%d %H:%M:%S")
+        rechtsfrage = str(root["attributes"].get("rechtsfrage", root["name"]))
+        if "beantwortet_als" in root["attributes"]: rechtsfrage += " (gespeicherte Antwort)"
+        if root["error"] is not None: rechtsfrage += f" [{root['error']}]"
+        print(
+            f"{start:<19} {root['trace_id'][:8]:<8} {root['wall_time']:>7.2f}s {t['llm_calls']:>5} {t['prompt_tokens']:>8} {t['completion_tokens']:>7}"
+            f" {t['cache_hits']:>5} {t['retries']:>5} {cost(trace):>8.4f}  {rechtsfrage[:70]}"
+        )
+
+
+def print_stages(traces):
+    # wall time includes nested stages, llm usage is the stage's own
+    stages = defaultdict(list)
+    for trace in traces:
+        for span in trace: stages[span["name"]].append(span)
+
+    print(f"\n{'stage':<38} {'count':>5} {'wall':>9} {'mean':>8} {'max':>8} {'calls':>5} {'tokens':>8} {'cache':>5} {'retry':>5} {'wait':>7}")
+    for name, spans in sorted(stages.items(), key=lambda kv: -sum(s["wall_time"] for s in kv[1])):
+        wall = [s["wall_time"] for s in spans]
+        t = totals(spans)
+        print(
+            f"{name:<38} {len(spans):>5} {sum(wall):>8.2f}s {sum(wall)/len(wall):>7.2f}s {max(wall):>7.2f}s {t['llm_calls']:>5}"
+            f" {t['prompt_tokens']+t['completion_tokens']:>8} {t['cache_hits']:>5} {t['retries']+t['rate_limit_retries']:>5} {t['rate_limit_wait']:>6.2f}s"
+        )
+
+
+def print_tree(trace):
+    children = defaultdict(list)
+    for span in trace: children[span["parent_id"]].append(span)
+    ids = set(s["span_id"] for s in trace)
+
+    def show(span, depth):
+        root_start = root_of(trace)["start"]
+        usage = f"{span['llm_calls']} calls, {span['prompt_tokens']}+{span['completion_tokens']} tokens" if span["llm_calls"] > 0 else ""
+        if span["cache_hits"] > 0: usage += f", {span['cache_hits']} cached"
+        if span["retries"] > 0: usage += f", {span['retries']} retries"
+        details = " ".join(f"{k}={str(v)[:60]!r}" for k, v in span["attributes"].items() if v is not None)
+        error = f" [{span['error']}]" if span["error"] is not None else ""
+        print(f"{span['start']-root_start:>8.2f}s {span['wall_time']:>8.2f}s  {'  '*depth}{span['name']:<{max(1, 40-2*depth)}} {usage} {details}{error}")
+        for child in sorted(children[span["span_id"]], key=lambda s: s["start"]):
+            show(child, depth + 1)
+
+    # spans whose parent was never written (e.g. the run crashed) are shown as roots
+    for span in sorted(trace, key=lambda s: s["start"]):
+        if span["parent_id"] is None or span["parent_id"] not in ids:
+            show(span, 0)
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the agent traces: cost per question and where the time went")
+    parser.add_argument("path", nargs="?", default=TRACE_PATH)
+    parser.add_argument("--last", type=int, default=10, help="only the last n runs")
+    parser.add_argument("--trace", default=None, help="show the spans of one run (trace id or its prefix)")
+    args = parser.parse_args()
+
+    traces = group_traces(load_spans(args.path))
+    if args.trace is not None:
+        matching = [t for t in traces if t[0]["trace_id"].startswith(args.trace)]
+        if len(matching) == 0: sys.exit(f"no trace {args.trace} in {args.path}")
+        print_tree(matching[-1])
+        return
+
+    traces = traces[-args.last:] if args.last > 0 else traces
+    print_runs(traces)
+    print_stages(traces)
+    all_spans = [s for t in traces for s in t]
+    t = totals(all_spans)
+    print(
+        f"\n{len(traces)} runs, {t['llm_calls']} llm calls, {t['prompt_tokens']} prompt + {t['completion_tokens']} completion tokens billed,"
+        f" {t['cache_hits']} cache hits, {t['retries']} retries, {t['rate_limit_retries']} rate limit retries, {cost(all_spans):.4f} USD"
+    )
+
+
+
+if __name__ == "__main__":
+    main()
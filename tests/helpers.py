@@ -0,0 +1,23 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from law_agent import LawAgent
+from utils.answer_index import AnswerIndex
+from utils.response_repair import ResponseMetrics
+from utils.tracing import Tracer
+
+
+
+def make_agent():
+    # no index, llm or RIS access: the stages a test runs are replaced on the instance
+    registry = SimpleNamespace(
+        bundesrecht_index={}, retriever=None, structure_store=None, section_index=None,
+        answer_index=AnswerIndex(), prompts={"system": "{rechtsfrage} {gesetze_durchsucht} {summary}"},
+        chat=None, chat_16k=None, llm_curie=None, token_budgets={},
+        response_metrics=ResponseMetrics(), tracer=Tracer(None, enabled=False)
+    )
+    agent = LawAgent(registry=registry)
+    agent.answer_reuse = False
+    agent.summarize_progress = mock.AsyncMock()
+    agent.reset_messages = mock.Mock()
+    return agent
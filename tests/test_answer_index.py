@@ -0,0 +1,63 @@
+import os
+import json
+import tempfile
+import unittest
+
+from tests.helpers import make_agent
+from utils.answer_index import AnswerIndex
+
+
+
+FRAGE = "Wie lange darf sich ein 15 jähriger in der Nacht draußen aufhalten?"
+ANSWER = {
+    "rechtsfrage": FRAGE,
+    "gesetze_durchsucht": ["10000001 - Jugendschutzgesetz - §2 Aufenthalt an öffentlichen Orten"],
+    "final_report": {"einfache_antwort": "bis 1 Uhr"},
+}
+
+
+
+class AnswerIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "answer.json")
+        with open(self.path, "w") as f:
+            json.dump(ANSWER, f)
+
+        self.agent = make_agent()
+        self.agent.answer_index = AnswerIndex()
+        self.agent.answer_index.add(ANSWER, self.path)
+
+
+    def test_reworded_question_is_answered_from_disk(self):
+        reused = self.agent.lookup_answer("Wie lange darf sich ein 15-Jähriger nachts draußen aufhalten")
+        self.assertEqual(reused["final_report"], ANSWER["final_report"])
+        self.assertEqual(reused["beantwortet_als"], FRAGE)
+
+
+    def test_negated_question_is_not_answered_from_disk(self):
+        frage = "Wie lange darf sich ein 15 jähriger in der Nacht nicht draußen aufhalten?"
+        similarity, entry = self.agent.answer_index.match(frage, 0.5)
+        self.assertFalse(entry["same_qualifiers"])
+
+        # at most the law that answered the question is looked at first
+        reused = self.agent.lookup_answer(frage)
+        self.assertNotIn("final_report", reused)
+        self.assertEqual(reused["checkpoint"]["gesetz"], "10000001 - Jugendschutzgesetz")
+
+
+    def test_other_age_or_modal_verb_is_not_answered_from_disk(self):
+        for frage in [
+            "Wie lange darf sich ein 5 jähriger in der Nacht draußen aufhalten?",
+            "Wie lange darf sich ein 16 jähriger in der Nacht draußen aufhalten?",
+            "Wie lange muss sich ein 15 jähriger in der Nacht draußen aufhalten?",
+        ]:
+            reused = self.agent.lookup_answer(frage)
+            self.assertTrue(reused is None or "final_report" not in reused, frage)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+import os
+import json
+import sys
+import signal
+import asyncio
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import law_agent
+from law_agent import claim_checkpoint, load_checkpoint, release_checkpoint
+from tests.helpers import make_agent
+
+
+
+FRAGE = "Wie schnell darf ich auf der Autobahn fahren?"
+
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        for name in ("CHECKPOINT_DIR", "ANSWERED_DIR"):
+            patcher = mock.patch.object(law_agent, name, os.path.join(self.directory.name, name.lower()))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+    def test_crashed_run_resumes_with_the_chosen_gesetz(self):
+        agent = make_agent()
+        agent.choose_gesetz_from_retrieval = mock.AsyncMock(return_value="10011336 - Straßenverkehrsordnung 1960")
+        agent.get_gesetz_structure = mock.AsyncMock(side_effect=RuntimeError("RIS not reachable"))
+        with self.assertRaises(RuntimeError):
+            agent.run(FRAGE)
+
+        state = load_checkpoint(FRAGE)
+        self.assertEqual(state["checkpoint"]["stage"], "gesetz")
+        self.assertEqual(state["checkpoint"]["gesetz"], "10011336 - Straßenverkehrsordnung 1960")
+
+        agent = make_agent()
+        agent.choose_gesetz_from_retrieval = mock.AsyncMock(return_value="nichts gefunden")
+        agent.explore_gesetz = mock.AsyncMock(return_value={"naechster_schritt": "neues_gesetz"})
+        agent.run(state, max_interations=2)
+
+        agent.explore_gesetz.assert_awaited_once_with("10011336 - Straßenverkehrsordnung 1960")
+        # the law was chosen before the crash, only the second iteration chooses again
+        self.assertEqual(agent.choose_gesetz_from_retrieval.await_count, 1)
+        self.assertIsNone(load_checkpoint(FRAGE))
+
+
+    def test_ctrl_c_saves_the_partial_run_keeps_the_checkpoint_and_stops(self):
+        async def interrupt(gesetz_id):
+            # asyncio.run turns SIGINT into a cancellation of the running task
+            signal.raise_signal(signal.SIGINT)
+            await asyncio.sleep(10)
+
+        agent = make_agent()
+        agent.choose_gesetz_from_retrieval = mock.AsyncMock(return_value="10011336 - Straßenverkehrsordnung 1960")
+        agent.get_gesetz_structure = interrupt
+        with self.assertRaises(KeyboardInterrupt):
+            agent.run(FRAGE)
+
+        result = agent.last_run
+
+        self.assertEqual(result["rechtsfrage"], FRAGE)
+        self.assertIsNone(result["final_report"])
+        with open(os.path.join(law_agent.ANSWERED_DIR, f"conversation_history_{law_agent.frage_file_name(FRAGE)}.json")) as f:
+            self.assertEqual(json.load(f)["rechtsfrage"], FRAGE)
+        self.assertEqual(load_checkpoint(FRAGE)["checkpoint"]["stage"], "gesetz")
+
+
+    def test_exhausted_run_leaves_no_checkpoint(self):
+        agent = make_agent()
+        agent.choose_gesetz_from_retrieval = mock.AsyncMock(return_value="nichts gefunden")
+        result = agent.run(FRAGE, max_interations=2)
+
+        self.assertIsNone(result["final_report"])
+        self.assertEqual(agent.choose_gesetz_from_retrieval.await_count, 2)
+        self.assertFalse(os.path.exists(law_agent.checkpoint_path(FRAGE)))
+
+        # the question can be asked again
+        agent.choose_gesetz_from_retrieval.reset_mock()
+        agent.run(load_checkpoint(FRAGE) or FRAGE, max_interations=2)
+        self.assertEqual(agent.choose_gesetz_from_retrieval.await_count, 2)
+
+
+    def test_checkpoint_past_the_iteration_budget_is_ignored(self):
+        os.makedirs(law_agent.CHECKPOINT_DIR)
+        with open(law_agent.checkpoint_path(FRAGE), "w") as f:
+            json.dump({"rechtsfrage": FRAGE, "checkpoint": {"stage": "weiter", "iteration": 5, "gesetz": None}}, f)
+
+        self.assertIsNone(load_checkpoint(FRAGE, max_interations=5))
+        self.assertIsNotNone(load_checkpoint(FRAGE, max_interations=6))
+
+
+    def test_only_the_active_run_of_a_question_writes_its_checkpoint(self):
+        lock = claim_checkpoint(FRAGE)
+        self.assertIsNotNone(lock)
+        self.addCleanup(release_checkpoint, FRAGE, lock)
+        self.assertIsNone(claim_checkpoint(FRAGE))
+
+        # a second job with the same question neither resumes nor writes the checkpoint
+        agent = make_agent()
+        agent.rechtsfrage = FRAGE
+        agent.save_checkpoint("weiter", 1)
+        self.assertFalse(os.path.exists(law_agent.checkpoint_path(FRAGE)))
+        self.assertIsNone(load_checkpoint(FRAGE))
+
+        agent.owns_checkpoint = True
+        agent.save_checkpoint("weiter", 1)
+        self.assertTrue(os.path.exists(law_agent.checkpoint_path(FRAGE)))
+
+
+    def test_a_run_in_another_process_holds_the_question(self):
+        # e.g. a second bot replica sharing CHECKPOINT_DIR
+        os.makedirs(law_agent.CHECKPOINT_DIR)
+        holder = subprocess.Popen(
+            [sys.executable, "-c", "import sys, time; from utils import file_lock; file_lock.try_lock(sys.argv[1]); print('locked', flush=True); time.sleep(60)",
+             law_agent.checkpoint_lock_path(FRAGE)],
+            stdout=subprocess.PIPE, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        )
+        self.addCleanup(holder.stdout.close)
+        self.addCleanup(holder.wait)
+        self.addCleanup(holder.kill)
+        self.assertEqual(holder.stdout.readline().strip(), "locked")
+        with open(law_agent.checkpoint_path(FRAGE), "w") as f:
+            json.dump({"rechtsfrage": FRAGE, "checkpoint": {"stage": "weiter", "iteration": 1, "gesetz": None}}, f)
+
+        self.assertIsNone(claim_checkpoint(FRAGE))
+        self.assertIsNone(load_checkpoint(FRAGE))
+
+        # a crashed holder leaves no stale lock
+        holder.kill()
+        holder.wait()
+        lock = claim_checkpoint(FRAGE)
+        self.assertIsNotNone(lock)
+        release_checkpoint(FRAGE, lock)
+        self.assertIsNotNone(load_checkpoint(FRAGE))
+
+
+
+if __name__ == "__main__":
+    unittest.main()
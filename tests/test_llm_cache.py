@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+
+from utils.llm_cache import LLMResponseCache
+
+
+
+class LLMResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "llm_cache.sqlite")
+
+
+    def make_cache(self, **kwargs):
+        cache = LLMResponseCache(self.path, access_batch=2, **kwargs)
+        self.addCleanup(cache.connection.close)
+        return cache
+
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = self.make_cache(max_entries=3)
+        for key in "abc": cache.put(key, "model", key * 10)
+        self.assertEqual(cache.get("a"), "a" * 10)       # a is used again, b is now the oldest
+
+        cache.put("d", "model", "d" * 10)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual([cache.get(key) for key in "acd"], ["a" * 10, "c" * 10, "d" * 10])
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(cache.stats()["entries"], 3)
+
+
+    def test_byte_limit_evicts_until_it_holds(self):
+        cache = self.make_cache(max_bytes=25)
+        for key in "abc": cache.put(key, "model", key * 10)
+        self.assertEqual(cache.stats()["entries"], 2)
+        self.assertEqual(cache.stats()["bytes"], 20)
+        self.assertIsNone(cache.get("a"))
+
+
+    def test_counters_match_the_table(self):
+        cache = self.make_cache(max_entries=3)
+        for key in "abcde": cache.put(key, "model", key * 10)
+        cache.put("e", "model", "replaced")
+        cache.flush()
+
+        reopened = self.make_cache(max_entries=3)
+        self.assertEqual((reopened.entries, reopened.bytes), (cache.entries, cache.bytes))
+        self.assertEqual((cache.entries, cache.bytes), (3, 28))
+
+
+
+if __name__ == "__main__":
+    unittest.main()
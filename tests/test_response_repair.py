@@ -0,0 +1,54 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from langchain.schema import AIMessage
+
+from config import LLM_MAX_RETRIES
+from tests.helpers import make_agent
+
+
+
+GESETZ = "10011336 - Straßenverkehrsordnung 1960"
+STRUCTURE = {"1. Abschnitt": {"Paragraph 1": [["Text"]]}, "2. Abschnitt": {"Paragraph 2": [["Text"]]}}
+
+
+class GarbageChat:
+    # fake chat model whose answers can never be parsed
+
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def acall(self, messages):
+        self.calls += 1
+        return AIMessage(content="Entschuldigung, das kann ich nicht beantworten.")
+
+
+
+class MatchSectionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.agent = make_agent()
+        self.agent.chat_16k = GarbageChat()
+        self.agent.compact_memory = mock.Mock()
+
+
+    def test_unparseable_retries_count_as_failed_attempts(self):
+        matched = asyncio.run(self.agent.match_sections(["Gibt es nicht"], list(STRUCTURE)))
+        self.assertEqual(matched, [])
+        self.assertEqual(self.agent.chat_16k.calls, LLM_MAX_RETRIES)
+
+
+    def test_law_without_usable_section_counts_as_searched(self):
+        self.agent.full_gesetz_fits = mock.Mock(return_value=False)
+        self.agent.choose_section_from_index = mock.AsyncMock(return_value=[])
+        self.agent.choose_section_from_gesetz = mock.AsyncMock(return_value=["Gibt es nicht"])
+
+        analysis = asyncio.run(self.agent.explore_gesetz(GESETZ, STRUCTURE))
+        self.assertEqual(analysis["naechster_schritt"], "neues gesetz waehlen")
+        self.assertEqual([g.split(" - ")[0] for g in self.agent.gesetze_durchsucht], ["10011336"])
+
+
+
+if __name__ == "__main__":
+    unittest.main()
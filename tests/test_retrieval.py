@@ -0,0 +1,35 @@
+import unittest
+
+from utils.retrieval import BM25Index, tokenize
+
+
+
+class RetrievalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = BM25Index()
+        for doc_id, text in {
+            "stvo": "Straßenverkehrsordnung 1960",
+            "jugendschutz": "Jugendschutzgesetz Aufenthalt an öffentlichen Orten",
+            "kfg": "Kraftfahrgesetz 1967 Zulassung von Kraftfahrzeugen",
+        }.items():
+            self.index.add(doc_id, tokenize(text))
+
+
+    def search(self, query):
+        return [doc_id for doc_id, _ in self.index.search(tokenize(query))]
+
+
+    def test_short_words_match_compounds(self):
+        self.assertEqual(self.search("Straße")[0], "stvo")
+        self.assertEqual(self.search("Verkehr")[0], "stvo")
+        self.assertEqual(self.search("Jugend")[0], "jugendschutz")
+
+
+    def test_unrelated_word_matches_nothing(self):
+        self.assertEqual(self.search("Erbrecht"), [])
+
+
+
+if __name__ == "__main__":
+    unittest.main()
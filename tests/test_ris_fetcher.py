@@ -0,0 +1,46 @@
+import io
+import unittest
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.ris_fetcher import fetch_and_parse
+
+
+
+class FakeFetcher:
+
+    def __init__(self, pages) -> None:
+        self.pages = pages
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
+    def get(self, url):
+        if url not in self.pages: raise ConnectionError(f"{url} not reachable")
+        return self.pages[url]
+
+    def submit(self, url):
+        return self.executor.submit(self.get, url)
+
+
+def parse(html):
+    if html == "kaputt": raise ValueError("no #content")
+    return html.upper()
+
+
+
+class FetchAndParseTest(unittest.TestCase):
+
+    def test_failures_go_to_the_collector_not_the_console(self):
+        fetcher = FakeFetcher({"a": "gesetz a", "b": "kaputt"})
+        self.addCleanup(fetcher.executor.shutdown)
+        errors, output = dict(), io.StringIO()
+        with ThreadPoolExecutor(max_workers=2) as parse_pool, contextlib.redirect_stdout(output):
+            results = dict(fetch_and_parse(fetcher, parse_pool, {"a": "A", "b": "B", "c": "C"}, parse, errors=errors))
+
+        self.assertEqual(results, {"A": "GESETZ A"})
+        self.assertEqual(errors, {"B": "parse: ValueError: no #content", "C": "fetch: ConnectionError: c not reachable"})
+        self.assertEqual(output.getvalue(), "")
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import tempfile
+import unittest
+
+from utils import ris_parser
+from utils.structure_store import GesetzStructureStore
+
+
+
+def page(content):
+    return f'<html><head><meta charset="utf-8"></head><body><div id="pagebase"><div id="content">{content}</div></div></body></html>'
+
+
+def block(inner):
+    return f'<div class="documentContent">{inner}</div>'
+
+
+GESETZ = page(
+    block('<h4 class="UeberschrG1">Erster Abschnitt</h4>')
+    + block('<h4 class="UeberschrPara">Begriffe</h4>')
+    + block(
+        '<h5 class="GldSymbol"><span class="sr-only">Paragraph 1,</span>§ 1.</h5>'
+        '<ol class="wai-absatz-list"><li>Erster Absatz</li><li>Zweiter Absatz</li></ol>'
+        # nested blocks belong to the outer one and must not be parsed a second time
+        + block('<p>Anmerkung im Paragraph</p>')
+    )
+    + block('<div class="MarginTop4"><span class="sr-only">Paragraph 2,</span>§ 2.</div><p>Kein Absatz</p>')
+    + block('<h4 class="UeberschrG1">Zweiter Abschnitt</h4>')
+    + block('<h5 class="GldSymbol"><span class="sr-only">Paragraph 3,</span>§ 3.</h5><p>Text</p>')
+    # a paragraph heading named like the law text before it stays next to it
+    + block('<h4 class="UeberschrPara">Paragraph 3</h4><p>Weiterer Text</p>')
+)
+
+
+
+def stream(html, on_section, on_heading=None, chunk_size=37):
+    parser = ris_parser.StreamingGesetzParser(on_section, on_heading)
+    data = html.encode("utf-8")
+    for i in range(0, len(data), chunk_size):
+        parser.feed(data[i:i+chunk_size])
+    parser.close()
+
+
+def stream_structure(html):
+    structure = dict()
+
+    def section(path):
+        node = structure
+        for key in path[:-1]: node = node[key]
+        return node
+
+    stream(
+        html,
+        lambda path, content: section(path).setdefault(path[-1], []).extend(content),
+        lambda path: section(path).setdefault(path[-1], dict())
+    )
+    return structure
+
+
+
+class RisParserTest(unittest.TestCase):
+
+    def test_streaming_matches_batch(self):
+        structure = ris_parser.parse_gesetz_structure(GESETZ)
+        self.assertEqual(stream_structure(GESETZ), structure)
+        self.assertEqual(structure["Erster Abschnitt"]["Begriffe"]["Paragraph 1"], [["Erster Absatz", "Zweiter Absatz"]])
+        self.assertEqual(structure["Zweiter Abschnitt"][None][-1], ["Paragraph 3Weiterer Text"])
+
+
+    def test_stored_structures_match(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = GesetzStructureStore(directory.name)
+
+        store.write("batch", ris_parser.parse_gesetz_structure(GESETZ))
+        writer = store.writer("streamed")
+        stream(GESETZ, writer.add_section, writer.add_heading)
+        writer.close()
+
+        batch, streamed = store.open("batch"), store.open("streamed")
+        self.assertEqual(streamed.to_dict(), batch.to_dict())
+        self.assertEqual(list(streamed["Erster Abschnitt"]), list(batch["Erster Abschnitt"]))
+
+
+    def test_page_without_law_text_is_rejected(self):
+        for html in [page(""), "<html><body><p>Fehler</p></body></html>"]:
+            with self.assertRaises((ValueError, AssertionError)):
+                ris_parser.parse_gesetz_structure(html)
+            with self.assertRaises(ValueError):
+                stream(html, lambda path, content: None)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
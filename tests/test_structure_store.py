@@ -0,0 +1,62 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from utils.structure_store import GesetzStructureStore
+
+
+
+class GesetzStructureStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = GesetzStructureStore(directory.name)
+
+
+    def test_empty_headings_are_kept(self):
+        structure = {"Erster Abschnitt": {"Aufgehoben": {}, "Paragraph 1": [["Text"]]}, "Zweiter Abschnitt": {}}
+        self.store.write("gesetz", structure)
+        self.assertEqual(self.store.open("gesetz").to_dict(), structure)
+        self.assertEqual(len(self.store.open("gesetz")["Zweiter Abschnitt"]), 0)
+
+
+    def test_concurrent_writers_publish_whole_structures(self):
+        # two writers of the same law (e.g. two agents fetching it), readers see one of them, never a mix
+        structures = [
+            {"Abschnitt": {f"Paragraph {i}": [[f"Text {i} " * (i + 1)]] for i in range(40)}},
+            {"Abschnitt": {f"Paragraph {i}": [[f"Anderer Text {i}"]] for i in range(25)}},
+        ]
+        start, writing, errors = threading.Barrier(3), [True, True], []
+
+        def write(i):
+            start.wait()
+            for _ in range(50):
+                GesetzStructureStore(self.store.directory).write("gesetz", structures[i])
+            writing[i] = False
+
+        def read():
+            start.wait()
+            while any(writing):
+                try:
+                    toc, structure = GesetzStructureStore(self.store.directory).load("gesetz")
+                    if structure.to_dict() not in structures: errors.append(structure.to_dict())
+                except FileNotFoundError:
+                    pass        # nothing published yet
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(2)] + [threading.Thread(target=read)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertIn(self.store.open("gesetz").to_dict(), structures)
+        blobs = [f for f in os.listdir(self.store.directory) if f.endswith(".bin")]
+        self.assertEqual([os.path.join(self.store.directory, f) for f in blobs], [self.store.blob_path("gesetz")])
+
+
+
+if __name__ == "__main__":
+    unittest.main()
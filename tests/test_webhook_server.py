@@ -0,0 +1,102 @@
+import time
+import asyncio
+import threading
+import unittest
+from unittest import mock
+
+import telebot
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import app
+import webhook_server
+from utils.job_queue import JobQueue
+
+
+
+SECRET = "s3cret"
+
+
+def update(update_id, chat_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": 100 + update_id, "date": 0, "text": text,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Test"}
+        }
+    }
+
+
+
+class WebhookServerTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        # fake telegram bot api: records the methods the bot calls
+        self.sent = []
+
+        async def fake_method(request):
+            data = {**dict(request.query), **dict(await request.post())}
+            self.sent.append((request.match_info["method"], data))
+            chat = {"id": int(data.get("chat_id", 0)), "type": "private"}
+            return web.json_response({"ok": True, "result": {"message_id": len(self.sent), "date": 0, "chat": chat, "text": data.get("text", "")}})
+
+        telegram = web.Application()
+        telegram.router.add_route("*", "/bot{token}/{method}", fake_method)
+        self.telegram = TestServer(telegram)
+        await self.telegram.start_server()
+        self.addCleanup(mock.patch.stopall)
+        mock.patch.object(telebot.apihelper, "API_URL", str(self.telegram.make_url("/")) + "bot{0}/{1}").start()
+
+        # the agent is not run: the job is held until the test has seen the acknowledgement
+        self.jobs_seen, self.release = [], threading.Event()
+        def handler(job):
+            self.jobs_seen.append(job)
+            self.release.wait(5)
+        self.jobs = JobQueue(handler, max_workers=1, name="test")
+        mock.patch.object(app, "jobs", self.jobs).start()
+
+        self.client = TestClient(TestServer(webhook_server.create_server(app.bot, self.jobs, secret=SECRET)))
+        await self.client.start_server()
+
+
+    async def asyncTearDown(self):
+        self.release.set()
+        await self.client.close()
+        await self.telegram.close()
+
+
+    async def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, "timed out")
+            await asyncio.sleep(0.02)
+
+
+    async def test_update_is_acknowledged_and_queued(self):
+        response = await self.client.post(
+            webhook_server.BOT_WEBHOOK_PATH, json=update(1, 42, "Wie schnell darf ich auf der Autobahn fahren?"),
+            headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}
+        )
+        self.assertEqual(response.status, 200)
+        self.assertEqual(await response.text(), "ok")
+
+        await self.wait_for(lambda: len(self.jobs_seen) > 0)
+        self.assertEqual(self.jobs_seen, [{"chat_id": 42, "message_id": 101, "question": "Wie schnell darf ich auf der Autobahn fahren?"}])
+        self.assertEqual(self.jobs.metrics()["running"], 1)      # acknowledged while the job is still running
+
+        await self.wait_for(lambda: any(method == "sendMessage" for method, _ in self.sent))
+        method, data = self.sent[0]
+        self.assertEqual(data["chat_id"], "42")
+        self.assertTrue(data["text"].startswith("Danke"))
+
+
+    async def test_update_without_secret_is_rejected(self):
+        response = await self.client.post(webhook_server.BOT_WEBHOOK_PATH, json=update(2, 42, "Frage"))
+        self.assertEqual(response.status, 403)
+        self.assertEqual(self.jobs.metrics()["submitted"], 0)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
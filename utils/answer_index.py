@@ -0,0 +1,155 @@
+import os
+import re
+import json
+import zlib
+import random
+import threading
+
+from utils.retrieval import STOPWORDS as RETRIEVAL_STOPWORDS, stem
+
+
+
+# MinHash over the word stems of a question finds the candidates (questions with a similar token set), the
+# jaccard similarity of their token sets decides. No character n-grams, they would outweigh the one word
+# that makes a different question ("mit einem Moped" in a question about the Autobahn speed limit).
+MERSENNE_PRIME = (1 << 61) - 1
+
+# stems that turn a question around ("nicht draußen", "unter 16", "muss" instead of "darf"): they count in
+# the signature, and an answer is only reused if both questions have the same ones (numbers as well)
+QUALIFIERS = {
+    "nicht", "kein", "nie", "niemal", "ohne", "nur", "mit", "unter", "uber", "vor", "nach", "bis", "ab", "seit",
+    "darf", "durf", "muss", "soll", "kann", "konn",
+}
+STOPWORDS = {w for w in RETRIEVAL_STOPWORDS if stem(w) not in QUALIFIERS}
+WORD = re.compile(r"§+\s*\d+[a-z]?|\w+", re.UNICODE)
+
+
+
+def question_tokens(text):
+    tokens = set()
+    for match in WORD.findall(text.lower()):
+        if match.startswith("§"):
+            tokens.add(match.replace(" ", ""))
+        elif match.isdigit():
+            tokens.add(match)
+        elif match not in STOPWORDS and len(match) > 1:
+            tokens.add(stem(match))
+    return frozenset(tokens)
+
+
+def qualifiers(tokens):
+    return frozenset(t for t in tokens if t in QUALIFIERS or t.isdigit() or t.startswith("§"))
+
+
+def jaccard(tokens, other):
+    return len(tokens & other) / len(tokens | other) if len(tokens | other) > 0 else 1.0
+
+
+def minhash(tokens, permutations):
+    hashes = [zlib.crc32(t.encode("utf-8")) for t in set(tokens)] or [0]
+    return tuple(min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in permutations)
+
+
+def answering_gesetz(state):
+    # "10011336 - Straßenverkehrsordnung 1960 - §20 Fahrgeschwindigkeit" -> the law that gave the final report
+    if len(state.get("gesetze_durchsucht") or []) == 0: return None
+    return " - ".join(state["gesetze_durchsucht"][-1].split(" - ")[:2])
+
+
+
+class AnswerIndex:
+    # Near-duplicate lookup over the answered questions (the save_dicts in ANSWERED_DIR). Only runs with a
+    # final report are indexed. Signatures are split into bands (locality sensitive hashing), questions
+    # that share a band are candidates and compared on their tokens. The answers themselves stay on disk.
+
+    def __init__(self, num_perm=128, bands=32, seed=0) -> None:
+        rng = random.Random(seed)
+        self.permutations = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME)) for _ in range(num_perm)]
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.entries = dict()       # path -> {"rechtsfrage", "gesetz", "tokens", "signature"}
+        self.buckets = dict()       # (band, band values) -> set of paths
+        self.lock = threading.Lock()
+
+        self.lookups = 0
+        self.matches = 0
+
+
+    @classmethod
+    def load(cls, directory, **kwargs):
+        index = cls(**kwargs)
+        if not os.path.isdir(directory): return index
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".json"): continue
+            path = os.path.join(directory, name)
+            try:
+                with open(path, "r") as f:
+                    index.add(json.load(f), path)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"answer index: skipping {path}: {type(e).__name__}: {e}")
+        return index
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def signature(self, tokens):
+        return minhash(tokens, self.permutations)
+
+
+    def band_keys(self, signature):
+        return [(i, signature[i*self.rows:(i+1)*self.rows]) for i in range(self.bands)]
+
+
+    def add(self, state, path):
+        if not isinstance(state.get("final_report"), dict) or not state.get("rechtsfrage"): return
+        tokens = question_tokens(state["rechtsfrage"])
+        signature = self.signature(tokens)
+        with self.lock:
+            if path in self.entries: self.remove(path)
+            self.entries[path] = {"rechtsfrage": state["rechtsfrage"], "gesetz": answering_gesetz(state), "tokens": tokens, "signature": signature}
+            for key in self.band_keys(signature):
+                self.buckets.setdefault(key, set()).add(path)
+
+
+    def remove(self, path):
+        # caller holds the lock
+        entry = self.entries.pop(path)
+        for key in self.band_keys(entry["signature"]):
+            self.buckets[key].discard(path)
+            if len(self.buckets[key]) == 0: del self.buckets[key]
+
+
+    def match(self, rechtsfrage, threshold):
+        # -> (similarity, entry) of the most similar answered question, None if none reaches the threshold.
+        # entry["same_qualifiers"]: both questions have the same negations, numbers, ... (see QUALIFIERS)
+        tokens = question_tokens(rechtsfrage)
+        signature = self.signature(tokens)
+        with self.lock:
+            self.lookups += 1
+            candidates = set()
+            for key in self.band_keys(signature):
+                candidates.update(self.buckets.get(key, ()))
+            scored = [(jaccard(tokens, self.entries[p]["tokens"]), p) for p in candidates]
+            if len(scored) == 0: return None
+            best, path = max(scored)
+            if best < threshold: return None
+            self.matches += 1
+            entry = self.entries[path]
+            return best, {"path": path, **entry, "same_qualifiers": qualifiers(tokens) == qualifiers(entry["tokens"])}
+
+
+    def load_answer(self, entry):
+        # the stored save_dict, None if it is gone or no longer answered
+        try:
+            with open(entry["path"], "r") as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        return state if isinstance(state.get("final_report"), dict) else None
+
+
+    def metrics(self):
+        with self.lock:
+            return {"answers": len(self.entries), "lookups": self.lookups, "matches": self.matches}
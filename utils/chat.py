@@ -0,0 +1,6 @@
+async def achat(chat, messages):
+    # one chat completion, for plain langchain chat models and the wrappers in utils (they are async only)
+    if hasattr(chat, "acall"):
+        return await chat.acall(messages)
+    result = await chat.agenerate([messages])
+    return result.generations[0][0].message
@@ -0,0 +1,137 @@
+from dataclasses import dataclass, replace
+
+from langchain.schema import SystemMessage, HumanMessage, AIMessage
+
+from utils.token_budget import TOKENS_PER_MESSAGE, count_tokens, truncate_to_tokens
+
+
+
+# kinds of turns, law excerpts and retries are the first to go once they are stale
+TURN = "turn"
+LAW_EXCERPT = "law_excerpt"
+RETRY = "retry"
+
+STUB_MARKER = "\n[...] (gekürzt)"
+
+
+@dataclass
+class Turn:
+    kind: str
+    human: HumanMessage
+    ai: AIMessage = None
+    stub: bool = False
+
+
+
+class ConversationMemory:
+    # Working memory of one agent: the system message, the latest progress summary and the turns of
+    # the current iteration. Before every call compact() rolls the history into a fixed token budget:
+    # answered retries replace the malformed answer they were asked for, then the oldest turns are cut
+    # down to a stub (whole law excerpts become their first lines) and finally dropped.
+    # The pending question is never touched, so the prompt size stays flat within an iteration.
+
+    def __init__(self, stub_tokens=128) -> None:
+        self.stub_tokens = stub_tokens
+        self.system = None
+        self.summary = None
+        self.turns = list()
+        self.forked_at = 0
+
+
+    @property
+    def messages(self):
+        messages = [m for m in (self.system, self.summary) if m is not None]
+        for turn in self.turns:
+            messages.append(turn.human)
+            if turn.ai is not None: messages.append(turn.ai)
+        return messages
+
+
+    def add(self, message, kind=TURN):
+        if isinstance(message, SystemMessage):
+            self.system = message
+        elif isinstance(message, HumanMessage):
+            self.turns.append(Turn(kind, message))
+        else:
+            # the answer to the open turn
+            assert len(self.turns) > 0 and self.turns[-1].ai is None
+            self.turns[-1].ai = message
+
+
+    def set_summary(self, content):
+        self.summary = SystemMessage(content=content) if content else None
+
+
+    def reset(self):
+        # start of a new iteration: only the system message and the summary are kept
+        self.turns = list()
+        self.forked_at = 0
+
+
+    def clear(self):
+        self.system = None
+        self.summary = None
+        self.turns = list()
+
+
+    def fork(self):
+        # independent copy for a concurrent line of calls, its new turns are merged back by join
+        fork = ConversationMemory(stub_tokens=self.stub_tokens)
+        fork.system = self.system
+        fork.summary = self.summary
+        fork.turns = [replace(t) for t in self.turns]
+        fork.forked_at = len(fork.turns)
+        return fork
+
+
+    def join(self, forks):
+        # append the turns every fork added since it was forked, in the order of forks
+        for fork in forks:
+            self.turns.extend(fork.turns[fork.forked_at:])
+
+
+    def fold_retries(self):
+        # an answered retry replaces the answer it was asked for, the retry request itself is dropped
+        turns = list()
+        for turn in self.turns:
+            if turn.kind == RETRY and turn.ai is not None and len(turns) > 0:
+                turns[-1].ai = turn.ai
+                continue
+            turns.append(turn)
+        self.turns = turns
+
+
+    def compact(self, budget, history_tokens):
+        # history_tokens: budget for the answered turns; never more than is left of the context window
+        # of budget.model next to the system message, the summary and the pending question
+        self.fold_retries()
+        model = budget.model
+
+        pending = self.turns[-1:] if len(self.turns) > 0 and self.turns[-1].ai is None else []
+        if len(pending) > 0 and pending[0].kind == RETRY:
+            pending = self.turns[-2:]       # a retry is sent together with the answer it complains about
+        history = self.turns[:len(self.turns) - len(pending)]
+        fixed = [m for m in (self.system, self.summary) if m is not None]
+        fixed += [m for t in pending for m in (t.human, t.ai) if m is not None]
+        allowed = min(history_tokens, budget.remaining(fixed))
+
+        def size(turn):
+            return sum(TOKENS_PER_MESSAGE + count_tokens(m.content, model) for m in (turn.human, turn.ai))
+        sizes = [size(t) for t in history]
+
+        # stale law excerpts first, then every other turn, oldest first
+        for kinds in ({LAW_EXCERPT}, {TURN, LAW_EXCERPT}):
+            for i, turn in enumerate(history):
+                if sum(sizes) <= allowed: break
+                if turn.stub or turn.kind not in kinds: continue
+                turn.stub = True
+                if count_tokens(turn.human.content, model) <= self.stub_tokens: continue
+                content = truncate_to_tokens(turn.human.content, self.stub_tokens, model)
+                turn.human = HumanMessage(content=content + STUB_MARKER)
+                sizes[i] = size(turn)
+
+        while len(history) > 0 and sum(sizes) > allowed:
+            history.pop(0)
+            sizes.pop(0)
+
+        self.turns = history + pending
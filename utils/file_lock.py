@@ -0,0 +1,51 @@
+import os
+import fcntl
+import contextlib
+
+
+
+# Advisory locks on lock files (flock), shared by all processes and replicas that use the same directory.
+# The os releases a lock when its holder dies, so a crash never leaves a stale lock behind.
+# The holder removes the lock file on release; a lock taken on a file that was removed (or replaced)
+# in the meantime is given up and taken again on the current file.
+
+
+def try_lock(path, blocking=False):
+    # -> file descriptor holding the lock, None if it is held by someone else (only without blocking)
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        try:
+            if os.stat(path).st_ino == os.fstat(fd).st_ino: return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+
+def release(fd, path):
+    # remove the file while still holding the lock, waiting holders then retry on a new file
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    os.close(fd)
+
+
+def is_locked(path):
+    fd = try_lock(path)
+    if fd is None: return True
+    release(fd, path)
+    return False
+
+
+@contextlib.contextmanager
+def locked(path):
+    fd = try_lock(path, blocking=True)
+    try:
+        yield
+    finally:
+        release(fd, path)
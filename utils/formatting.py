@@ -1,14 +1,61 @@
-
+import re
 import string
+import unicodedata
+
+
+# Text normalization, applied once when law texts are stored (see structure_store) and to every prompt.
+# Bump NORMALIZATION_VERSION whenever the rules change, stored structures are then normalized again.
+NORMALIZATION_VERSION = 1
+
+PROMPT_CHARACTERS = string.printable + "§ßäöüÄÖÜ"
+# typographic characters of RIS texts that have a plain equivalent instead of being dropped
+REPLACEMENTS = {
+    "\xa0": " ", "\u2002": " ", "\u2003": " ", "\u2009": " ", "\u202f": " ",
+    "\u2010": "-", "\u2011": "-", "\u2012": "-", "\u2013": "-", "\u2014": "-", "\u2212": "-",
+    "\u201e": '"', "\u201c": '"', "\u201d": '"', "\xab": '"', "\xbb": '"',
+    "\u201a": "'", "\u2018": "'", "\u2019": "'",
+    "\u2026": "...",
+}
+REPLACEABLE = re.compile("[" + "".join(REPLACEMENTS) + "]")
+NOT_PROMPT_CHARACTERS = re.compile(f"[^{re.escape(PROMPT_CHARACTERS)}]+")
+# the same rules for latin-1 text (all allowed characters are latin-1) as one bytes.translate
+LATIN1_REPLACEMENTS = {k: v for k, v in REPLACEMENTS.items() if ord(k) < 256}
+LATIN1_TABLE = bytes.maketrans("".join(LATIN1_REPLACEMENTS).encode("latin-1"), "".join(LATIN1_REPLACEMENTS.values()).encode("latin-1"))
+LATIN1_DROP = bytes(b for b in range(256) if chr(b) not in PROMPT_CHARACTERS and chr(b) not in LATIN1_REPLACEMENTS)
 
 
 def dict_to_string(d):
     return str(d).replace("'", '"')
 
 
+def normalize_text(text):
+    # compose decomposed umlauts, replace typographic characters, drop everything else that is not printable
+    try:
+        # the common case, e.g. text that is already normalized: a single pass in C
+        return text.encode("latin-1").translate(LATIN1_TABLE, LATIN1_DROP).decode("latin-1")
+    except UnicodeEncodeError:
+        pass
+    text = unicodedata.normalize("NFC", text)
+    text = REPLACEABLE.sub(lambda m: REPLACEMENTS[m.group()], text)
+    return NOT_PROMPT_CHARACTERS.sub("", text)
+
+
+def normalize_value(value):
+    # normalize_text for every string (and key) of a nested section content
+    if isinstance(value, str): return normalize_text(value)
+    if isinstance(value, list): return [normalize_value(v) for v in value]
+    if isinstance(value, dict): return {normalize_text(str(k)): normalize_value(v) for k, v in value.items()}
+    return value
+
+
 def clean_text_for_prompt(text):
-    printable = set(string.printable + "§ßäöüÄÖÜ")
-    cleaned_text = ''.join(filter(lambda x: x in printable, text))
-    return cleaned_text
+    # translation tables and regexes instead of a per character filter in python;
+    # stored law texts are already normalized, so for them this is a single pass
+    return normalize_text(text)
+
+
 
 
+def key_formatting_for_dict(text):
+    # "Paragraph 8, " -> "Paragraph 8"
+    return " ".join(text.split()).strip(" ,.:;")
@@ -0,0 +1,85 @@
+import os
+import json
+import sqlite3
+
+
+
+class IndexCheckpoint:
+    # Write-through store for the RIS index filler (sqlite).
+    # Every parsed result page and every scraped law is committed as soon as it arrives, so an
+    # interrupted fill resumes where it stopped. The nested bundesrecht_index_filled.json is
+    # produced from the stored rows by compact().
+
+    def __init__(self, path) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS pages (category TEXT, position INTEGER, page TEXT, PRIMARY KEY (category, position))"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS laws (category TEXT, doc_nr TEXT, rank INTEGER, info TEXT, PRIMARY KEY (category, doc_nr))"
+        )
+        self.connection.commit()
+
+        # (category, doc_nr) of every stored law for O(1) "already scraped" checks
+        self.scraped = set(self.connection.execute("SELECT category, doc_nr FROM laws").fetchall())
+
+
+    def close(self):
+        self.connection.close()
+
+
+    def pages(self):
+        # (category, position) -> parsed result page (None if the category has no documents)
+        rows = self.connection.execute("SELECT category, position, page FROM pages").fetchall()
+        return {(category, position): json.loads(page) for category, position, page in rows}
+
+
+    def put_page(self, category, position, page):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO pages (category, position, page) VALUES (?, ?, ?)",
+            (category, position, json.dumps(page, ensure_ascii=False))
+        )
+        self.connection.commit()
+
+
+    def has_law(self, category, doc_nr):
+        return (category, doc_nr) in self.scraped
+
+
+    def put_law(self, category, doc_nr, rank, gesetz_info):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO laws (category, doc_nr, rank, info) VALUES (?, ?, ?, ?)",
+            (category, doc_nr, rank, json.dumps(gesetz_info, ensure_ascii=False))
+        )
+        self.connection.commit()
+        self.scraped.add((category, doc_nr))
+
+
+    def compact(self, index):
+        # append the stored laws of every category to the (unfilled) index, in result order
+        laws = dict()
+        rows = self.connection.execute("SELECT category, info FROM laws ORDER BY category, rank").fetchall()
+        for category, info in rows:
+            laws.setdefault(category, []).append(json.loads(info))
+
+        counter = 0
+        def walk(node):
+            nonlocal counter
+            for key, value in node.items():
+                if isinstance(value, list):
+                    value.extend(laws.get(key, []))
+                    counter += len(laws.get(key, []))
+                else:
+                    walk(value)
+
+        walk(index)
+        return index, counter
+
+
+    def stats(self):
+        pages, = self.connection.execute("SELECT COUNT(*) FROM pages").fetchone()
+        return {"pages": pages, "laws": len(self.scraped)}
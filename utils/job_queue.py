@@ -0,0 +1,79 @@
+import queue
+import threading
+import traceback
+
+
+
+class JobQueue:
+    # Bounded queue of jobs drained by a fixed pool of worker threads.
+    # submit() never blocks: a full queue raises queue.Full so the caller can tell the user right away.
+    # Every job runs on its own worker thread, so one slow job never stalls the others or the caller.
+
+    def __init__(self, handler, max_workers=2, max_queued=20, name="job") -> None:
+        self.handler = handler
+        self.max_workers = max_workers
+        self.jobs = queue.Queue(maxsize=max_queued)
+        self.threads = [
+            threading.Thread(target=self.work, name=f"{name}-worker-{i}", daemon=True)
+            for i in range(max_workers)
+        ]
+        self.lock = threading.Lock()
+
+        self.submitted = 0
+        self.running = 0
+        self.done = 0
+        self.failed = 0
+
+
+    def start(self):
+        for thread in self.threads: thread.start()
+        return self
+
+
+    def submit(self, job):
+        # -> number of jobs ahead of this one (0: a worker picks it up right away)
+        with self.lock:
+            ahead = self.jobs.qsize() if self.running >= self.max_workers else 0
+            self.jobs.put_nowait(job)
+            self.submitted += 1
+        return ahead
+
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None: break
+            with self.lock: self.running += 1
+            try:
+                self.handler(job)
+                with self.lock: self.done += 1
+            except Exception:
+                with self.lock: self.failed += 1
+                traceback.print_exc()
+            finally:
+                with self.lock: self.running -= 1
+                self.jobs.task_done()
+
+
+    def close(self, wait=True):
+        # running jobs are finished, queued ones are dropped
+        while True:
+            try:
+                self.jobs.get_nowait()
+                self.jobs.task_done()
+            except queue.Empty:
+                break
+        for _ in self.threads: self.jobs.put(None)
+        if wait:
+            for thread in self.threads: thread.join()
+
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "queued": self.jobs.qsize(),
+                "running": self.running,
+                "submitted": self.submitted,
+                "done": self.done,
+                "failed": self.failed
+            }
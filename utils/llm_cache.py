@@ -0,0 +1,181 @@
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+
+from langchain.schema import AIMessage
+
+from utils import tracing
+from utils.chat import achat
+from utils.llm_recorder import messages_key
+
+
+
+class LLMResponseCache:
+    # Persistent content-addressed store for chat completions (sqlite, one row per request).
+    # All agent calls use temperature=0, so an identical model + message list gives the same answer.
+    # Rows expire after ttl seconds; least recently used rows are evicted beyond max_entries / max_bytes.
+    # Entry and byte counts are kept in memory, hits only note their access time, which is written in batches
+    # (before every write and eviction, so the lru order is current when it matters).
+
+    def __init__(self, path, max_entries=50000, max_bytes=512*1024*1024, ttl=30*24*3600, enabled=True, access_batch=64) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        self.access_batch = access_batch
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.writes = 0
+
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, created_at REAL, last_access REAL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.connection.commit()
+
+        self.entries, self.bytes = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        self.accessed = dict()      # key -> last access not yet written
+
+
+    def get(self, key):
+        if not self.enabled: return None
+
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT response, size, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            response, size, created_at = row
+            if self.ttl is not None and now - created_at > self.ttl:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.connection.commit()
+                self.accessed.pop(key, None)
+                self.entries -= 1
+                self.bytes -= size
+                self.expired += 1
+                self.misses += 1
+                return None
+
+            self.accessed[key] = now
+            if len(self.accessed) >= self.access_batch:
+                self.write_accesses()
+                self.connection.commit()
+            self.hits += 1
+            return response
+
+
+    def put(self, key, model, response):
+        if not self.enabled: return
+
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self.lock:
+            self.write_accesses()
+            replaced = self.connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now)
+            )
+            if replaced is not None:
+                self.entries -= 1
+                self.bytes -= replaced[0]
+            self.entries += 1
+            self.bytes += size
+            self.writes += 1
+            self.evict()
+            self.connection.commit()
+
+
+    def write_accesses(self):
+        # caller holds the lock and commits
+        if len(self.accessed) == 0: return
+        self.connection.executemany("UPDATE responses SET last_access = ? WHERE key = ?", [(t, k) for k, t in self.accessed.items()])
+        self.accessed = dict()
+
+
+    def evict(self):
+        # drop least recently used rows until both limits hold again (caller holds the lock)
+        if self.entries <= self.max_entries and self.bytes <= self.max_bytes: return
+
+        # only as many rows as needed are read, oldest first
+        n, freed = 0, 0
+        rows = self.connection.execute("SELECT size FROM responses ORDER BY last_access ASC")
+        for (row_size,) in rows:
+            if self.entries - n <= self.max_entries and self.bytes - freed <= self.max_bytes: break
+            n += 1
+            freed += row_size
+        rows.close()
+
+        deleted = self.connection.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access ASC LIMIT ?) RETURNING size", (n,)
+        ).fetchall()
+        self.entries -= len(deleted)
+        self.bytes -= sum(size for (size,) in deleted)
+        self.evictions += len(deleted)
+
+
+    def flush(self):
+        with self.lock:
+            self.write_accesses()
+            self.connection.commit()
+
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM responses")
+            self.connection.commit()
+            self.accessed = dict()
+            self.entries, self.bytes = 0, 0
+
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "writes": self.writes,
+            "entries": self.entries,
+            "bytes": self.bytes
+        }
+
+
+
+class CachedChat:
+    # Async wrapper around a chat model (see utils.chat.achat) that answers repeated requests from an LLMResponseCache.
+
+    def __init__(self, chat, model, cache) -> None:
+        self.chat = chat
+        self.model = model
+        self.cache = cache
+
+
+    async def acall(self, messages):
+        # sqlite blocks -> off the event loop
+        key = messages_key(self.model, messages)
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            tracing.record(cache_hits=1)
+            return AIMessage(content=cached)
+
+        response = await achat(self.chat, messages)
+        await asyncio.to_thread(self.cache.put, key, self.model, response.content)
+        return response
@@ -0,0 +1,96 @@
+import os
+import json
+import hashlib
+import threading
+
+from langchain.schema import AIMessage
+
+from utils.chat import achat
+
+
+
+# all recorders append to the same jsonl file -> one lock per process
+_write_lock = threading.Lock()
+
+
+class ReplayMissError(KeyError):
+    pass
+
+
+
+def messages_key(model, messages):
+    # content-address a request by model name and the full message list
+    payload = json.dumps(
+        [model] + [[m.type, m.content] for m in messages],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+
+class RecordReplayChat:
+    # Async wrapper around a chat model (see utils.chat.achat): acall(messages) returns an AIMessage.
+    # "record" forwards to the wrapped model and appends every request/response pair to a jsonl file,
+    # "replay" answers from that file without touching the API.
+
+    def __init__(self, chat, model, path, mode="record") -> None:
+        assert mode in ["record", "replay"]
+        self.chat = chat
+        self.model = model
+        self.path = path
+        self.mode = mode
+
+        self.recordings = dict()
+        self.replay_positions = dict()
+        self.lock = threading.Lock()
+
+        if self.mode == "replay":
+            self.load()
+
+
+    def load(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"No LLM recording found at {self.path}. Record a run first.")
+
+        with open(self.path, "r") as f:
+            for line in f:
+                if len(line.strip()) == 0: continue
+                entry = json.loads(line)
+                if entry["model"] != self.model: continue
+                self.recordings.setdefault(entry["key"], []).append(entry["response"])
+
+
+    async def acall(self, messages):
+        key = messages_key(self.model, messages)
+
+        if self.mode == "replay":
+            return AIMessage(content=self.replay(key))
+
+        response = await achat(self.chat, messages)
+        self.record(key, messages, response.content)
+        return response
+
+
+    def replay(self, key):
+        with self.lock:
+            if key not in self.recordings:
+                raise ReplayMissError(f"No recorded response for {self.model} request {key[:12]}.")
+
+            # identical requests are answered in recorded order, the last answer is repeated
+            responses = self.recordings[key]
+            position = self.replay_positions.get(key, 0)
+            self.replay_positions[key] = position + 1
+            return responses[min(position, len(responses) - 1)]
+
+
+    def record(self, key, messages, response):
+        entry = {
+            "key": key,
+            "model": self.model,
+            "messages": [[m.type, m.content] for m in messages],
+            "response": response
+        }
+        with _write_lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
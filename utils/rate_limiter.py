@@ -0,0 +1,145 @@
+import time
+import random
+import asyncio
+import threading
+
+from openai.error import RateLimitError, ServiceUnavailableError, APIConnectionError, Timeout
+
+from utils import tracing
+from utils.chat import achat
+from utils.token_budget import count_message_tokens, count_tokens
+
+
+
+RETRYABLE_ERRORS = (RateLimitError, ServiceUnavailableError, APIConnectionError, Timeout)
+
+
+def estimate_tokens(messages):
+    # rough estimate (~4 characters per token), only used to pace requests
+    return sum(len(m.content) for m in messages) // 4 + 4 * len(messages)
+
+
+
+class RateLimiter:
+    # Token bucket over requests and tokens per minute for one model, shared by all agents of the process.
+    # Buckets start full and refill continuously; a request reserves capacity up front and waits only
+    # if the bucket would go negative. Rate limit errors empty the buckets so every caller backs off.
+
+    def __init__(self, requests_per_minute, tokens_per_minute, max_retries=6, base_delay=1.0, max_delay=60.0) -> None:
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.available_requests = float(requests_per_minute)
+        self.available_tokens = float(tokens_per_minute)
+        self.last_refill = time.monotonic()
+
+        self.requests = 0
+        self.tokens = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.rate_limit_errors = 0
+        self.retries = 0
+
+        self.lock = threading.Lock()
+
+
+    def refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_refill
+        self.last_refill = now
+        self.available_requests = min(self.requests_per_minute, self.available_requests + elapsed * self.requests_per_minute / 60)
+        self.available_tokens = min(self.tokens_per_minute, self.available_tokens + elapsed * self.tokens_per_minute / 60)
+
+
+    def reserve(self, tokens):
+        # take capacity for one request and return how long the caller has to wait before sending it
+        tokens = min(tokens, self.tokens_per_minute)
+        with self.lock:
+            self.refill()
+            self.available_requests -= 1
+            self.available_tokens -= tokens
+
+            wait = max(
+                -self.available_requests * 60 / self.requests_per_minute,
+                -self.available_tokens * 60 / self.tokens_per_minute,
+                0.0
+            )
+            self.requests += 1
+            self.tokens += tokens
+            if wait > 0:
+                self.waits += 1
+                self.wait_time += wait
+            return wait
+
+
+    async def aacquire(self, tokens):
+        wait = self.reserve(tokens)
+        if wait > 0: await asyncio.sleep(wait)
+        return wait
+
+
+    def backoff(self, attempt, error):
+        # exponential backoff with full jitter
+        with self.lock:
+            self.retries += 1
+            if isinstance(error, RateLimitError):
+                self.rate_limit_errors += 1
+                self.refill()
+                self.available_requests = min(self.available_requests, 0.0)
+                self.available_tokens = min(self.available_tokens, 0.0)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+    def metrics(self):
+        with self.lock:
+            self.refill()
+            return {
+                "requests_per_minute": self.requests_per_minute,
+                "tokens_per_minute": self.tokens_per_minute,
+                "available_requests": self.available_requests,
+                "available_tokens": self.available_tokens,
+                "requests": self.requests,
+                "tokens": self.tokens,
+                "waits": self.waits,
+                "wait_time": self.wait_time,
+                "rate_limit_errors": self.rate_limit_errors,
+                "retries": self.retries
+            }
+
+
+
+class RateLimitedChat:
+    # Async wrapper around a chat model (see utils.chat.achat) that paces requests through a RateLimiter
+    # and retries rate limit and transient API errors.
+    # Only requests that reach the api pass here -> their tokens are the ones traced as billed.
+
+    def __init__(self, chat, limiter, max_completion_tokens=0) -> None:
+        self.chat = chat
+        self.limiter = limiter
+        self.max_completion_tokens = max_completion_tokens
+        self.model = getattr(chat, "model_name", "gpt-3.5-turbo")
+
+
+    def record(self, messages, response):
+        tracing.record(
+            self.model,
+            prompt_tokens=count_message_tokens(messages, self.model),
+            completion_tokens=count_tokens(response.content, self.model)
+        )
+
+
+    async def acall(self, messages):
+        tokens = estimate_tokens(messages) + self.max_completion_tokens
+        for attempt in range(self.limiter.max_retries + 1):
+            tracing.record(rate_limit_wait=await self.limiter.aacquire(tokens))
+            try:
+                response = await achat(self.chat, messages)
+                self.record(messages, response)
+                return response
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.limiter.max_retries: raise
+                tracing.record(rate_limit_retries=1)
+                await asyncio.sleep(self.limiter.backoff(attempt, e))
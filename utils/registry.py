@@ -0,0 +1,181 @@
+import os
+import json
+import atexit
+import threading
+from types import MappingProxyType
+from dataclasses import dataclass
+
+from langchain.llms import OpenAI
+from langchain.chat_models import ChatOpenAI
+
+from config import *
+from utils.answer_index import AnswerIndex
+from utils.llm_cache import CachedChat, LLMResponseCache
+from utils.llm_recorder import RecordReplayChat
+from utils.rate_limiter import RateLimitedChat, RateLimiter
+from utils.response_repair import ResponseMetrics
+from utils.retrieval import BundesrechtRetriever
+from utils.section_index import SectionIndex
+from utils.structure_store import GesetzStructureStore
+from utils.token_budget import TokenBudget
+from utils.tracing import Tracer
+
+
+
+PROMPT_FILES = {
+    "system":                       ("01_get_gesetze", "01_system.txt"),
+    "kategorie_waehlen":            ("01_get_gesetze", "02_kategorie_waehlen.txt"),
+    "gesetz_waehlen":               ("01_get_gesetze", "03_gesetz_waehlen.txt"),
+    "zusammenfassung_erstellen":    ("01_get_gesetze", "04_zusammenfassung_erstellen.txt"),
+    "gesetzestext_teil_waehlen":    ("01_get_gesetze", "05_gesetzestext_teil_waehlen.txt"),
+    "gesetzestext_teil_zeigen":     ("01_get_gesetze", "06_gesetzestext_teil_zeigen.txt"),
+    "gesetzestext_gesamt":          ("01_get_gesetze", "07_gesetzestext_gesamt.txt"),
+    "finaler_report":               ("01_get_gesetze", "08_finalen_report_erstellen.txt"),
+
+    "extrahiere_fachbegriffe":      ("02_erklaere_final_report", "01_analysiere_finalen_report.txt"),
+    "fragen_generieren":            ("02_erklaere_final_report", "02_generiere_frage_fuer_fachbegriff.txt"),
+}
+
+
+
+@dataclass(frozen=True)
+class AgentRegistry:
+    # Everything a LawAgent needs that does not change between questions.
+    # Shared read-only by all agents of the process -> never mutate bundesrecht_index or prompts.
+
+    bundesrecht_index: dict
+    retriever: BundesrechtRetriever
+    structure_store: GesetzStructureStore
+    section_index: SectionIndex
+    answer_index: AnswerIndex
+    prompts: MappingProxyType
+
+    chat: ChatOpenAI
+    chat_16k: ChatOpenAI
+    llm_curie: OpenAI
+    token_budgets: MappingProxyType
+
+    llm_cache: LLMResponseCache
+    rate_limiters: MappingProxyType
+    response_metrics: ResponseMetrics
+    tracer: Tracer
+
+
+
+def load_prompt(dir, prompt_name):
+    with open(os.path.join(CHAIN_DIR, dir, prompt_name), "r") as f: prompt = f.read()
+    return prompt
+
+
+def build_registry():
+    # Load Bundesrecht Index Filled
+    bundesrecht_index_path = os.path.join("ris", "bundesrecht_index_filled.json")
+    with open(bundesrecht_index_path, "r") as f:
+        bundesrecht_index = json.load(f)
+
+    # Load (or build) the local retrieval index over all laws
+    retriever = BundesrechtRetriever.load_or_build(bundesrecht_index, RETRIEVAL_INDEX_PATH, bundesrecht_index_path)
+
+    # Gesetz structures and their section index shards are opened lazily per law
+    structure_store = GesetzStructureStore(GESETZ_STRUCTURE_DIR)
+    section_index = SectionIndex(SECTION_INDEX_DIR, structure_store)
+
+    # near-duplicate lookup over the answered questions, runs add their answers as they finish
+    answer_index = AnswerIndex.load(ANSWERED_DIR, num_perm=ANSWER_INDEX_PERMUTATIONS)
+
+    # Load Prompts
+    prompts = MappingProxyType({
+        name: load_prompt(dir, prompt_name)
+        for name, (dir, prompt_name) in PROMPT_FILES.items()
+    })
+
+    # retries are handled by the shared rate limiters
+    chat = ChatOpenAI(
+        model="gpt-3.5-turbo",
+        temperature=0,
+        max_tokens=2048,
+        max_retries=1
+    )
+    chat_16k = ChatOpenAI(
+        model="gpt-3.5-turbo-16k",
+        temperature=0,
+        max_tokens=4096,
+        max_retries=1
+    )
+    llm_curie = OpenAI(
+        model="text-curie-001",
+        temperature=0,
+        max_tokens=1024
+    )
+
+    # prompt budgets per model, completions reserve max_tokens
+    token_budgets = MappingProxyType({
+        "4k": TokenBudget("gpt-3.5-turbo", max_completion_tokens=2048),
+        "16k": TokenBudget("gpt-3.5-turbo-16k", max_completion_tokens=4096),
+    })
+
+    # pace requests per model and back off on rate limit errors
+    rate_limiters = MappingProxyType({
+        model: RateLimiter(**limits, max_retries=RATE_LIMIT_MAX_RETRIES)
+        for model, limits in RATE_LIMITS.items()
+    })
+    chat = RateLimitedChat(chat, rate_limiters["gpt-3.5-turbo"], max_completion_tokens=2048)
+    chat_16k = RateLimitedChat(chat_16k, rate_limiters["gpt-3.5-turbo-16k"], max_completion_tokens=4096)
+
+    # answer repeated requests from disk
+    llm_cache = LLMResponseCache(
+        LLM_CACHE_PATH,
+        max_entries=LLM_CACHE_MAX_ENTRIES,
+        max_bytes=LLM_CACHE_MAX_BYTES,
+        ttl=LLM_CACHE_TTL,
+        enabled=LLM_CACHE_ENABLED
+    )
+    atexit.register(llm_cache.flush)       # access times of the last hits
+    chat = CachedChat(chat, "gpt-3.5-turbo", llm_cache)
+    chat_16k = CachedChat(chat_16k, "gpt-3.5-turbo-16k", llm_cache)
+
+    # record or replay all chat completions (see benchmarks)
+    if LLM_MODE != "live":
+        chat = RecordReplayChat(chat, "gpt-3.5-turbo", LLM_RECORDING_PATH, mode=LLM_MODE)
+        chat_16k = RecordReplayChat(chat_16k, "gpt-3.5-turbo-16k", LLM_RECORDING_PATH, mode=LLM_MODE)
+
+    return AgentRegistry(
+        bundesrecht_index=bundesrecht_index,
+        retriever=retriever,
+        structure_store=structure_store,
+        section_index=section_index,
+        answer_index=answer_index,
+        prompts=prompts,
+        chat=chat,
+        chat_16k=chat_16k,
+        llm_curie=llm_curie,
+        token_budgets=token_budgets,
+        llm_cache=llm_cache,
+        rate_limiters=rate_limiters,
+        response_metrics=ResponseMetrics(),
+        tracer=Tracer(TRACE_PATH, enabled=TRACE_ENABLED)
+    )
+
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    # load once per process, agents created afterwards only take references
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = build_registry()
+    return _registry
+
+
+def reload_registry():
+    # e.g. after the index was refilled or prompts were edited; running agents keep their old registry
+    global _registry
+    registry = build_registry()
+    with _registry_lock:
+        _registry = registry
+    return registry
@@ -0,0 +1,112 @@
+import re
+import ast
+import json
+import difflib
+import threading
+
+
+
+# Local fixes for llm answers that are almost right, so that they don't cost another round trip.
+
+SMART_QUOTES = str.maketrans({"\u201e": '"', "\u201c": '"', "\u201d": '"', "\u201a": "'", "\u2018": "'", "\u2019": "'"})
+CODE_FENCE = re.compile(r"^\s*```[a-zA-Z]*\s*|\s*```\s*$")
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+SECTION_MATCH_CUTOFF = 0.8
+
+
+def balance_brackets(text):
+    # close brackets and a string that were left open by a cut off answer
+    stack, in_string, escaped = [], False, False
+    for c in text:
+        if in_string:
+            if escaped: escaped = False
+            elif c == "\\": escaped = True
+            elif c == '"': in_string = False
+        elif c == '"': in_string = True
+        elif c in "{[": stack.append("}" if c == "{" else "]")
+        elif c in "}]" and len(stack) > 0 and stack[-1] == c: stack.pop()
+    return text + ('"' if in_string else "") + "".join(reversed(stack))
+
+
+def repair_json(text):
+    # -> the parsed object, raises ValueError if the answer can't be repaired
+    text = CODE_FENCE.sub("", text.strip())
+    start = min([i for i in (text.find("{"), text.find("[")) if i >= 0], default=-1)
+    if start < 0: raise ValueError("no json object in the answer")
+    text = text[start:]
+
+    end = max(text.rfind("}"), text.rfind("]"))
+    cut = text[:end+1] if end >= 0 else text            # text after the object
+    candidates = [text, cut, TRAILING_COMMA.sub(r"\1", cut)]
+    candidates.append(candidates[-1].translate(SMART_QUOTES))     # quotes only if nothing else helps
+    candidates.append(balance_brackets(TRAILING_COMMA.sub(r"\1", text)))
+
+    for candidate in candidates:
+        try:
+            return json.loads(candidate, strict=False)
+        except json.JSONDecodeError:
+            pass
+        try:
+            # python literal with single quotes, True, None, ...
+            value = ast.literal_eval(candidate)
+            if isinstance(value, (dict, list)): return value
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            pass
+    raise ValueError("answer is not valid json and could not be repaired")
+
+
+def simplify(text):
+    return " ".join(str(text).split()).strip(" ,.:;\"'").lower()
+
+
+def match_section(name, sections, cutoff=SECTION_MATCH_CUTOFF):
+    # chosen section name -> (key of sections, exact), None if nothing is close enough
+    if not isinstance(name, str): return None
+    if name in sections: return name, True
+
+    simplified = {simplify(s): s for s in sections}
+    name = simplify(name)
+    if len(name) == 0: return None
+    if name in simplified: return simplified[name], False
+
+    # "§ 20" for "§ 20 Fahrgeschwindigkeit": the number only, if it is unambiguous
+    prefixed = [s for k, s in simplified.items() if k.startswith(name + " ")]
+    if len(prefixed) == 1: return prefixed[0], False
+
+    close = difflib.get_close_matches(name, list(simplified.keys()), n=1, cutoff=cutoff)
+    if len(close) > 0: return simplified[close[0]], False
+    return None
+
+
+
+class ResponseMetrics:
+    # Process wide counters of the response handling. avoided_round_trips are the answers that were
+    # fixed locally instead of asking the llm again: repaired json and choices where only close
+    # matches (sections_rescued) but no exact section names were given.
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.counts = {
+            "responses": 0,
+            "json_repaired": 0,
+            "json_failed": 0,
+            "sections_exact": 0,
+            "sections_fuzzy": 0,
+            "sections_rescued": 0,
+            "sections_failed": 0,
+            "retries": 0,
+            "retries_exhausted": 0,
+        }
+
+
+    def add(self, key, n=1):
+        with self.lock:
+            self.counts[key] += n
+
+
+    def metrics(self):
+        with self.lock:
+            return {
+                **self.counts,
+                "avoided_round_trips": self.counts["json_repaired"] + self.counts["sections_rescued"]
+            }
@@ -0,0 +1,198 @@
+import os
+import re
+import json
+import math
+from collections import Counter
+
+
+
+STOPWORDS = set("""
+aber als am an auch auf aus bei bin bis bist da damit dann das dass dein deine dem den der des dich die dir
+du durch ein eine einem einen einer eines er es für hat hatte habe haben ich ihr im in ist ja kann kein
+keine mich mir mit muss müssen nach nicht noch nur ob oder sich sie sind so um und uns unter vom von vor
+war was welche welcher welches wenn wer werden wie wir wird zu zum zur über darf dürfen soll sollen gilt gelten
+""".split())
+
+# stored indexes built with another tokenizer are rebuilt
+TOKENIZER_VERSION = 2
+
+_WORD = re.compile(r"§+\s*\d+[a-z]?|\w+", re.UNICODE)
+_UMLAUTS = str.maketrans({"ä": "a", "ö": "o", "ü": "u", "ß": "ss"})
+
+
+
+def stem(word):
+    # very light german stemming, enough to match singular/plural and inflected forms
+    word = word.translate(_UMLAUTS)
+    for suffix in ["ungen", "en", "er", "es", "e", "n", "s"]:
+        if len(word) > len(suffix) + 3 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def tokenize(text, ngram=4):
+    # word stems plus character n-grams of all words of at least ngram characters, so that compounds like
+    # "Straßenverkehrsordnung" still match a question about "Verkehr" or "Straße" (stem "strass")
+    tokens = []
+    for match in _WORD.findall(text.lower()):
+        if match.startswith("§"):
+            tokens.append(match.replace(" ", ""))
+            continue
+        if match in STOPWORDS or len(match) < 2: continue
+
+        word = stem(match)
+        tokens.append(word)
+        if ngram and len(word) >= ngram:
+            tokens.extend(f"#{word[i:i+ngram]}" for i in range(len(word) - ngram + 1))
+    return tokens
+
+
+
+class BM25Index:
+    # Small in-memory BM25 index with incremental add/remove, persisted as its forward index (json).
+
+    def __init__(self, k1=1.5, b=0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.documents = dict()     # doc_id -> {term: tf}
+        self.lengths = dict()       # doc_id -> number of tokens
+        self.postings = dict()      # term -> {doc_id: tf}
+        self.total_length = 0
+
+
+    def __len__(self):
+        return len(self.documents)
+
+
+    def __contains__(self, doc_id):
+        return doc_id in self.documents
+
+
+    def add(self, doc_id, tokens):
+        if doc_id in self.documents: self.remove(doc_id)
+
+        counts = dict(Counter(tokens))
+        self.documents[doc_id] = counts
+        self.lengths[doc_id] = len(tokens)
+        self.total_length += len(tokens)
+        for term, tf in counts.items():
+            self.postings.setdefault(term, dict())[doc_id] = tf
+
+
+    def remove(self, doc_id):
+        counts = self.documents.pop(doc_id)
+        self.total_length -= self.lengths.pop(doc_id)
+        for term in counts:
+            del self.postings[term][doc_id]
+            if len(self.postings[term]) == 0: del self.postings[term]
+
+
+    def search(self, tokens, k=10, exclude=None):
+        if len(self.documents) == 0: return []
+
+        n = len(self.documents)
+        avg_length = self.total_length / n
+        scores = dict()
+        for term in set(tokens):
+            postings = self.postings.get(term)
+            if postings is None: continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = tf + self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+
+        if exclude:
+            scores = {doc_id: score for doc_id, score in scores.items() if doc_id not in exclude}
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
+
+
+    def to_dict(self):
+        return {"k1": self.k1, "b": self.b, "tokenizer": TOKENIZER_VERSION, "documents": self.documents}
+
+
+    @classmethod
+    def from_dict(cls, d):
+        index = cls(k1=d["k1"], b=d["b"])
+        for doc_id, counts in d["documents"].items():
+            index.documents[doc_id] = counts
+            length = sum(counts.values())
+            index.lengths[doc_id] = length
+            index.total_length += length
+            for term, tf in counts.items():
+                index.postings.setdefault(term, dict())[doc_id] = tf
+        return index
+
+
+
+class BundesrechtRetriever:
+    # Lexical retrieval over all laws of the filled Bundesrecht index.
+    # Every law is a document made of its titles, schlagworte and category path;
+    # search returns the best laws together with the category path they are filed under.
+
+    def __init__(self, laws, index) -> None:
+        self.laws = laws        # gesetzesnummer -> {"kurztitel", "layers"}
+        self.index = index
+
+
+    @classmethod
+    def build(cls, bundesrecht_index):
+        laws = dict()
+        index = BM25Index()
+
+        def walk(node, layers):
+            if isinstance(node, dict):
+                for key, value in node.items():
+                    walk(value, layers + [key])
+                return
+
+            for g in node:
+                gesetzesnummer = str(g["gesetzesnummer"]).strip()
+                if len(gesetzesnummer) == 0 or gesetzesnummer in laws: continue
+
+                laws[gesetzesnummer] = {
+                    "kurztitel": g["kurztitel"],
+                    "layers": (layers + [None])[:3]
+                }
+                text = " ".join([
+                    g["kurztitel"], g["kurztitel"],     # titles count twice
+                    g.get("langtitel", ""),
+                    g.get("schlagworte", ""),
+                    " ".join(layers)
+                ])
+                index.add(gesetzesnummer, tokenize(text))
+
+        walk(bundesrecht_index, [])
+        return cls(laws, index)
+
+
+    @classmethod
+    def load_or_build(cls, bundesrecht_index, path, source_path):
+        # rebuild whenever the filled index is newer than the persisted retrieval index or the tokenizer changed
+        if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(source_path):
+            with open(path, "r") as f:
+                d = json.load(f)
+            if d["index"].get("tokenizer") == TOKENIZER_VERSION:
+                return cls(d["laws"], BM25Index.from_dict(d["index"]))
+
+        retriever = cls.build(bundesrecht_index)
+        retriever.save(path)
+        return retriever
+
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"laws": self.laws, "index": self.index.to_dict()}, f, ensure_ascii=False)
+
+
+    def search(self, query, k=10, exclude=None):
+        results = self.index.search(tokenize(query), k=k, exclude=exclude)
+        return [
+            {
+                "gesetzesnummer": gesetzesnummer,
+                "kurztitel": self.laws[gesetzesnummer]["kurztitel"],
+                "layers": self.laws[gesetzesnummer]["layers"],
+                "score": score
+            }
+            for gesetzesnummer, score in results
+        ]
@@ -0,0 +1,45 @@
+import codecs
+
+import aiohttp
+
+
+
+RIS_BASE_URL = "https://www.ris.bka.gv.at"
+
+
+def geltende_fassung_url(gesetz_id):
+    return f"{RIS_BASE_URL}/GeltendeFassung.wxe?Abfrage=Bundesnormen&Gesetzesnummer={gesetz_id}"
+
+
+def bundesnormen_search_url(index_num, position=1):
+    # one result page (100 documents) of all Bundesnormen filed under an index category
+    return f"{RIS_BASE_URL}/Ergebnis.wxe?Abfrage=Bundesnormen&Kundmachungsorgan=&Index={index_num}&Titel=&Gesetzesnummer=&VonArtikel=&BisArtikel=&VonParagraf=0&BisParagraf=&VonAnlage=&BisAnlage=&Typ=&Kundmachungsnummer=&Unterzeichnungsdatum=&FassungVom=29.05.2023&VonInkrafttretedatum=&BisInkrafttretedatum=&VonAusserkrafttretedatum=&BisAusserkrafttretedatum=&NormabschnittnummerKombination=Und&ImRisSeitVonDatum=&ImRisSeitBisDatum=&ImRisSeit=Undefined&ResultPageSize=100&Suchworte=&Position={position}"
+
+
+async def fetch_geltende_fassung(gesetz_id, session=None):
+    # non-blocking download of the current version of a law; pass a session to reuse connections
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await fetch_geltende_fassung(gesetz_id, session=session)
+
+    async with session.get(geltende_fassung_url(gesetz_id)) as response:
+        response.raise_for_status()
+        return await response.text()
+
+
+async def stream_geltende_fassung(gesetz_id, session=None, chunk_size=64*1024):
+    # same page as fetch_geltende_fassung, yielded as decoded text chunks while it is downloaded
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            async for chunk in stream_geltende_fassung(gesetz_id, session=session, chunk_size=chunk_size):
+                yield chunk
+        return
+
+    async with session.get(geltende_fassung_url(gesetz_id)) as response:
+        response.raise_for_status()
+        decoder = codecs.getincrementaldecoder(response.get_encoding())(errors="replace")
+        async for chunk in response.content.iter_chunked(chunk_size):
+            text = decoder.decode(chunk)
+            if len(text) > 0: yield text
+        text = decoder.decode(b"", final=True)
+        if len(text) > 0: yield text
@@ -0,0 +1,170 @@
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class HostLimiter:
+    # Politeness limit for one host: at most max_concurrent requests in flight
+    # and request starts spaced at least 1 / requests_per_second apart.
+
+    def __init__(self, requests_per_second, max_concurrent) -> None:
+        self.interval = 1 / requests_per_second
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.next_start = time.monotonic()
+        self.lock = threading.Lock()
+
+        self.requests = 0
+        self.wait_time = 0.0
+
+
+    def __enter__(self):
+        self.slots.acquire()
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+            self.requests += 1
+            self.wait_time += start - now
+        if start > now: time.sleep(start - now)
+        return self
+
+
+    def __exit__(self, *exc):
+        self.slots.release()
+
+
+    def penalize(self, delay):
+        # server asked us to slow down -> nobody starts a request on this host before delay has passed
+        with self.lock:
+            self.next_start = max(self.next_start, time.monotonic() + delay)
+
+
+
+class RISFetcher:
+    # Bounded-concurrency HTTP fetcher for the RIS scrapers.
+    # One keep-alive connection pool shared by all worker threads, a politeness limit per host
+    # and retries with full-jitter backoff on connection errors, 429 and 5xx responses.
+
+    def __init__(self, max_workers=8, requests_per_second=4.0, max_per_host=4, max_retries=4, timeout=30, base_delay=1.0, max_delay=60.0) -> None:
+        self.max_workers = max_workers
+        self.requests_per_second = requests_per_second
+        self.max_per_host = max_per_host
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.hosts = dict()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ris-fetch")
+
+        self.bytes = 0
+        self.retries = 0
+        self.errors = 0
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.session.close()
+
+
+    def host_limiter(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = HostLimiter(self.requests_per_second, self.max_per_host)
+            return self.hosts[host]
+
+
+    def get(self, url):
+        # blocking fetch of one page, paced by the limiter of its host
+        limiter = self.host_limiter(url)
+        for attempt in range(self.max_retries + 1):
+            try:
+                with limiter:
+                    response = self.session.get(url, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    with self.lock: self.bytes += len(response.content)
+                    return response.text
+                error = requests.HTTPError(f"{response.status_code} for {url}", response=response)
+                retry_after = response.headers.get("Retry-After", "")
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error, retry_after = e, ""
+
+            if attempt == self.max_retries:
+                with self.lock: self.errors += 1
+                raise error
+
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+            if retry_after.isdigit(): delay = max(delay, float(retry_after))
+            limiter.penalize(delay)
+            with self.lock: self.retries += 1
+
+
+    def submit(self, url):
+        return self.executor.submit(self.get, url)
+
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "requests": sum(h.requests for h in self.hosts.values()),
+                "wait_time": sum(h.wait_time for h in self.hosts.values()),
+                "bytes": self.bytes,
+                "retries": self.retries,
+                "errors": self.errors
+            }
+
+
+
+def fetch_and_parse(fetcher, parse_pool, jobs, parser, errors=None, with_tag=False):
+    # fetch all urls concurrently and hand every page to the parse pool as soon as it arrives
+    # jobs: url -> tag, yields (tag, parsed page) as pages are parsed; parser(tag, html) if with_tag
+    # failed urls are left out and collected in errors (tag -> message) if given, reporting them is up to the caller
+    fetches = {fetcher.submit(url): url for url in jobs}
+    parses = dict()
+    pending = set(fetches)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future in fetches:
+                url = fetches[future]
+                try:
+                    html = future.result()
+                    parse = parse_pool.submit(parser, jobs[url], html) if with_tag else parse_pool.submit(parser, html)
+                except Exception as e:
+                    if errors is not None: errors[jobs[url]] = f"fetch: {type(e).__name__}: {e}"
+                    continue
+                parses[parse] = url
+                pending.add(parse)
+            else:
+                url = parses[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if errors is not None: errors[jobs[url]] = f"parse: {type(e).__name__}: {e}"
+                    continue
+                yield jobs[url], result
@@ -0,0 +1,291 @@
+import re
+
+import lxml.html
+from lxml import etree
+from bs4 import BeautifulSoup
+
+from utils import formatting
+
+
+
+# Parsers for RIS pages. Module level functions so they can run in a process pool.
+
+
+GESETZ_INFO_KEYS = {
+    "Gesetzesnummer": "gesetzesnummer",
+    "Kurztitel": "kurztitel",
+    "Langtitel": "langtitel",
+    "Kundmachungsorgan": "kundmachungsorgan",
+    "Inkrafttretensdatum": "inkrafttretensdatum",
+    "Zuletzt aktualisiert am": "zuletzt_aktualisiert_am",
+    "Typ": "typ",
+    "Schlagworte": "schlagworte",
+    "Dokumentnummer": "dokumentnummer",
+    "Zusammenfassung": "zusammenfassung",
+}
+
+
+def parse_result_page(html):
+    # one page of a Bundesnormen search -> (document links, from, to, amount), None if nothing was found
+    if "Die eingegebene Suchabfrage liefert keine Treffer" in html:
+        return None
+
+    soup = BeautifulSoup(html, "html.parser")
+    table = soup.find("tbody", {"class": "bocListTableBody"})
+    rows = table.find_all('tr')
+
+    from_to_amount_string = soup.find_all("span", {"class": "NumberOfDocuments"})[0].text.strip()
+    numbers = re.findall(r'\d+', from_to_amount_string)
+    assert len(numbers) == 3, "Extracting from, to and amount of documents failed"
+    from_number, to_number, amount = [int(n) for n in numbers]
+
+    # the link to the html is in the nativeDocumentLinkCell
+    links = [row.find_all("a", {"class": "iconOnlyLink"})[0]["href"] for row in rows]
+    return links, from_number, to_number, amount
+
+
+def parse_gesetz_info(html):
+    # metadata blocks of a single law document
+    soup = BeautifulSoup(html, "html.parser")
+    content_blocks = soup.find_all("div", {"class": "contentBlock"})
+
+    gesetz_info = {key: "" for key in GESETZ_INFO_KEYS.values()}
+    for block in content_blocks:
+        title = block.find("h1", {"class": "Titel"}).text.strip()
+        p = block.find("p")
+        content = p.text.strip() if p is not None else "* extraction failed *"
+        gesetz_info[GESETZ_INFO_KEYS.get(title, title)] = content
+    return gesetz_info
+
+
+
+def classes(element):
+    return (element.get("class") or "").split()
+
+
+def list_items(ol):
+    # direct <li> children only, nested lists are part of their parent item's text
+    return [li.text_content() for li in ol if li.tag == "li"]
+
+
+
+class GesetzStructureBuilder:
+    # Builds the nested gesetz_structure of a GeltendeFassung page one documentContent block at a time:
+    # { ueberschr_g1: { ueberschr_para: { gld_symbol: [law_text, ...] }, gld_symbol: [law_text, ...] } }
+    # Every block is walked once; lists are not descended into, so no paragraph is emitted twice.
+
+    def __init__(self) -> None:
+        self.gesetz_structure = dict()
+        self.curr_ueberschr_g1 = None
+        self.curr_ueberschr_para = None
+        self.curr_gld_symbol = None
+
+
+    def add_block(self, doc_content):
+        ueberschr_g1, ueberschr_para, top, gld_symbol = None, None, None, None
+        wai_absatz_lists, wai_lists = [], []
+
+        stack = list(reversed(doc_content))
+        while stack:
+            element = stack.pop()
+            if not isinstance(element.tag, str): continue     # comments, processing instructions
+            element_classes = classes(element)
+
+            if element.tag == "ol" and "wai-absatz-list" in element_classes:
+                wai_absatz_lists.append(element)
+                continue
+            if element.tag == "ol" and "wai-list" in element_classes:
+                wai_lists.append(element)
+                continue
+
+            if element.tag == "h4" and "UeberschrG1" in element_classes:
+                assert ueberschr_g1 is None
+                ueberschr_g1 = element
+            elif element.tag == "h4" and "UeberschrPara" in element_classes:
+                assert ueberschr_para is None
+                ueberschr_para = element
+            elif element.tag == "div" and "MarginTop4" in element_classes:
+                if top is None: top = element
+            elif element.tag == "h5" and "GldSymbol" in element_classes:
+                if gld_symbol is None: gld_symbol = element
+
+            stack.extend(reversed(element))
+
+        # <h4 class="UeberschrG1 AlignCenter">
+        if ueberschr_g1 is not None:
+            self.curr_ueberschr_g1 = ueberschr_g1.text_content().strip()
+            self.add_heading((self.curr_ueberschr_g1,))
+            self.curr_ueberschr_para = None
+            self.curr_gld_symbol = None
+
+        # <h4 class="UeberschrPara AlignCenter">Abstammung</h4>
+        if ueberschr_para is not None and self.curr_ueberschr_g1 is not None:
+            self.curr_ueberschr_para = formatting.key_formatting_for_dict(ueberschr_para.text_content().strip())
+            self.add_heading((self.curr_ueberschr_g1, self.curr_ueberschr_para))
+            self.curr_gld_symbol = None
+
+        # <div class="MarginTop4 AlignJustify"> or <h5 class="GldSymbol AlignJustify">, both with <span class="sr-only">Paragraph 8,</span>
+        symbol = top if top is not None else gld_symbol
+        if symbol is not None:
+            sr_only = next((span for span in symbol.iter("span") if "sr-only" in classes(span)), None)
+            if sr_only is not None:
+                self.curr_gld_symbol = formatting.key_formatting_for_dict(sr_only.text_content())
+
+        if len(wai_absatz_lists) > 0:
+            law_text = [text for ol in wai_absatz_lists for text in list_items(ol)]
+        elif len(wai_lists) > 0:
+            title = [top.text_content()] if top is not None else []
+            law_text = [title + list_items(ol) for ol in wai_lists]
+        else:
+            law_text = [doc_content.text_content().strip()]
+
+        if self.curr_ueberschr_g1 is None: return
+        path = (self.curr_ueberschr_g1,)
+        # a paragraph heading named like law text stored before it is not descended into, the text stays next to it
+        if self.curr_ueberschr_para is not None and isinstance(self.gesetz_structure[self.curr_ueberschr_g1][self.curr_ueberschr_para], dict):
+            path += (self.curr_ueberschr_para,)
+        self.add_law_text(path + (self.curr_gld_symbol,), law_text)
+
+
+    def add_heading(self, path):
+        # -> True if the heading is new (a key that already holds law text or a heading is kept as it is)
+        section = self.gesetz_structure
+        for key in path[:-1]: section = section[key]
+        if path[-1] in section: return False
+        section[path[-1]] = dict()
+        return True
+
+
+    def law_texts(self, path):
+        section = self.gesetz_structure
+        for key in path[:-1]: section = section[key]
+        return section.setdefault(path[-1], [])
+
+
+    def add_law_text(self, path, law_text):
+        self.law_texts(path).append(law_text)
+
+
+    def build(self):
+        return self.gesetz_structure
+
+
+
+class StreamingGesetzStructureBuilder(GesetzStructureBuilder):
+    # Keeps only the section that is currently being filled and hands it to on_section(path, content)
+    # as soon as the next block belongs to another section. New headings go to on_heading(path) in
+    # order with the sections, so headings without law text are kept as well.
+
+    def __init__(self, on_section, on_heading=None) -> None:
+        super().__init__()
+        self.on_section = on_section
+        self.on_heading = on_heading
+        self.section_path = None
+        self.section = []
+
+
+    def add_heading(self, path):
+        if not super().add_heading(path): return False
+        self.flush()
+        if self.on_heading is not None: self.on_heading(path)
+        return True
+
+
+    def add_law_text(self, path, law_text):
+        self.law_texts(path)        # only the key, so later headings see it like in the full structure
+        if path != self.section_path: self.flush()
+        self.section_path = path
+        self.section.append(law_text)
+
+
+    def flush(self):
+        if self.section_path is not None and len(self.section) > 0:
+            self.on_section(self.section_path, self.section)
+        self.section_path = None
+        self.section = []
+
+
+    def build(self):
+        self.flush()
+
+
+
+def content_element(root):
+    # <div id="pagebase"> ... <div id="content">, everything else of the page is ignored
+    content = root.xpath('//div[@id="pagebase"]//div[@id="content"]')
+    assert len(content) > 0, "GeltendeFassung page has no #content"
+    return content[0]
+
+
+def document_blocks(content):
+    # outermost documentContent divs, nested ones belong to the block around them
+    stack = list(reversed(content))
+    while stack:
+        element = stack.pop()
+        if not isinstance(element.tag, str): continue
+        if element.tag == "div" and "documentContent" in classes(element):
+            yield element
+            continue
+        stack.extend(reversed(element))
+
+
+def parse_gesetz_structure(html):
+    # GeltendeFassung page -> nested gesetz_structure (lxml, single pass per documentContent block)
+    # see StreamingGesetzParser for pages that should not be held in memory
+    root = lxml.html.fromstring(html)
+    builder = GesetzStructureBuilder()
+    blocks = 0
+    for doc_content in document_blocks(content_element(root)):
+        builder.add_block(doc_content)
+        blocks += 1
+    if blocks == 0: raise ValueError("GeltendeFassung page has no documentContent blocks")
+    return builder.build()
+
+
+
+class StreamingGesetzParser:
+    # Incremental version of parse_gesetz_structure for very large laws: feed the response chunk by chunk.
+    # Every documentContent block is passed to the builder as soon as it closes and then dropped from the
+    # tree, so memory stays bounded by one block (plus the page chrome) whatever the size of the law.
+
+    def __init__(self, on_section, on_heading=None) -> None:
+        self.parser = etree.HTMLPullParser(events=("start", "end"))
+        self.parser.set_element_class_lookup(lxml.html.HtmlElementClassLookup())     # text_content() like lxml.html
+        self.builder = StreamingGesetzStructureBuilder(on_section, on_heading)
+        self.in_content = False
+        self.seen_content = False
+        self.block_depth = 0
+        self.blocks = 0
+
+
+    def feed(self, chunk):
+        self.parser.feed(chunk)
+        for event, element in self.parser.read_events():
+            if element.tag != "div": continue
+
+            if element.get("id") == "content":
+                self.in_content = event == "start"
+                self.seen_content = True
+                continue
+            if not self.in_content or "documentContent" not in classes(element): continue
+
+            # nested documentContent divs belong to their outermost block
+            if event == "start":
+                self.block_depth += 1
+                continue
+            self.block_depth -= 1
+            if self.block_depth > 0: continue
+
+            self.builder.add_block(element)
+            self.blocks += 1
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+
+    def close(self):
+        # an error page or a page without law text must not end up in the structure store
+        self.parser.close()
+        if not self.seen_content: raise ValueError("GeltendeFassung page has no #content")
+        if self.blocks == 0: raise ValueError("GeltendeFassung page has no documentContent blocks")
+        self.builder.build()
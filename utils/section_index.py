@@ -0,0 +1,105 @@
+import os
+import json
+import threading
+from collections.abc import Mapping
+
+from utils.retrieval import TOKENIZER_VERSION, BM25Index, tokenize
+
+
+
+def flatten_section_text(value):
+    # section content is a (possibly nested) list of text nodes, sub-structures keep their headings
+    if isinstance(value, str): return value.strip()
+    if isinstance(value, Mapping):
+        return "\n\n".join(f"{k}\n{flatten_section_text(v)}".strip() for k, v in value.items())
+    return "\n".join(t for t in (flatten_section_text(v) for v in value) if len(t) > 0)
+
+
+def iter_sections(gesetz_structure, path=()):
+    # yield (path, content) for every leaf section of a (nested) gesetz_structure
+    for key, value in gesetz_structure.items():
+        if isinstance(value, Mapping):
+            yield from iter_sections(value, path + (key,))
+        else:
+            yield path + (key,), value
+
+
+def section_label(path):
+    return " > ".join(str(p) for p in path)
+
+
+
+class SectionIndex:
+    # Paragraph level BM25 index per law, built from the cached gesetz structures.
+    # Sections are ranked within one law, so every law has its own small index ("shard")
+    # that is persisted next to the structure cache, loaded lazily and rebuilt whenever
+    # a newer structure of that law is cached (or the tokenizer changed).
+
+    def __init__(self, directory, structure_store) -> None:
+        self.directory = directory
+        self.structure_store = structure_store
+        self.shards = dict()
+        self.lock = threading.Lock()
+
+
+    def shard_path(self, gesetz_id):
+        return os.path.join(self.directory, f"sections_{gesetz_id}.json")
+
+
+    def build_shard(self, gesetz_structure):
+        index = BM25Index()
+        for path, content in iter_sections(gesetz_structure):
+            # headings (incl. § symbols) weigh twice as much as the text
+            heading_tokens = tokenize(section_label(path))
+            index.add(json.dumps(path, ensure_ascii=False), heading_tokens + heading_tokens + tokenize(flatten_section_text(content)))
+        return index
+
+
+    def update(self, gesetz_id, gesetz_structure):
+        # (re)index one law, called whenever a new structure is cached
+        index = self.build_shard(gesetz_structure)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.shard_path(gesetz_id), "w") as f:
+            json.dump(index.to_dict(), f, ensure_ascii=False)
+        with self.lock:
+            self.shards[gesetz_id] = index
+        return index
+
+
+    def get(self, gesetz_id, gesetz_structure=None):
+        with self.lock:
+            if gesetz_id in self.shards: return self.shards[gesetz_id]
+
+        shard_path = self.shard_path(gesetz_id)
+        structure_mtime = self.structure_store.mtime(gesetz_id)
+        is_fresh = os.path.exists(shard_path) and (
+            structure_mtime is None or os.path.getmtime(shard_path) >= structure_mtime
+        )
+        if is_fresh:
+            with open(shard_path, "r") as f:
+                d = json.load(f)
+            if d.get("tokenizer") == TOKENIZER_VERSION:
+                index = BM25Index.from_dict(d)
+                with self.lock:
+                    self.shards[gesetz_id] = index
+                return index
+
+        if gesetz_structure is None:
+            if not self.structure_store.exists(gesetz_id): return None
+            gesetz_structure = self.structure_store.open(gesetz_id)
+        return self.update(gesetz_id, gesetz_structure)
+
+
+    def rank(self, gesetz_id, query, k=10, gesetz_structure=None):
+        # best matching sections of one law as [(path, score)]
+        index = self.get(gesetz_id, gesetz_structure=gesetz_structure)
+        if index is None: return []
+        return [(tuple(json.loads(doc_id)), score) for doc_id, score in index.search(tokenize(query), k=k)]
+
+
+    def build_all(self):
+        # index every cached structure, returns the number of indexed laws
+        gesetz_ids = self.structure_store.gesetz_ids()
+        for gesetz_id in gesetz_ids:
+            self.get(gesetz_id)
+        return len(gesetz_ids)
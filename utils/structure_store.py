@@ -0,0 +1,264 @@
+import os
+import json
+import mmap
+import zlib
+import uuid
+import threading
+from collections.abc import Mapping
+
+from utils import file_lock
+from utils.formatting import NORMALIZATION_VERSION, normalize_text, normalize_value
+
+
+
+STORE_FORMAT_VERSION = 1
+
+
+def json_key(key):
+    # same key conversion json.dump applies to the legacy json cache
+    if key is None: return "null"
+    if isinstance(key, bool): return "true" if key else "false"
+    return str(key)
+
+
+
+def toc_blob_path(toc_path, toc=None):
+    # blob of a table of contents (stores written before blobs were named in the toc use a fixed name),
+    # None if there is no toc
+    if toc is None:
+        try:
+            with open(toc_path, "r") as f:
+                toc = json.load(f)
+        except FileNotFoundError:
+            return None
+    blob = toc.get("blob", os.path.basename(toc_path)[:-len(".toc")] + ".bin")
+    return os.path.join(os.path.dirname(toc_path), blob)
+
+
+
+class LazyGesetzStructure(Mapping):
+    # Read-only view of a stored gesetz_structure that behaves like the nested dict.
+    # Sub-structures are views as well; a section's content is only decompressed when it is accessed.
+
+    def __init__(self, blob, children, sections, size, prefix=()) -> None:
+        self.blob = blob            # mmap (or bytes) of the compressed sections
+        self.children = children    # path prefix -> child keys (dict as ordered set)
+        self.sections = sections    # section path -> [(offset, length), ...] chunks of the section
+        self.size = size            # len(str(...)) of the full structure, see LawAgent.full_gesetz_fits
+        self.prefix = prefix
+
+
+    def __getitem__(self, key):
+        path = self.prefix + (key,)
+        if path in self.sections:
+            chunks = [
+                json.loads(zlib.decompress(self.blob[offset:offset+length]).decode("utf-8"))
+                for offset, length in self.sections[path]
+            ]
+            # a streamed section can be written in several chunks, they are always lists
+            return chunks[0] if len(chunks) == 1 else [item for chunk in chunks for item in chunk]
+        if path in self.children:
+            return LazyGesetzStructure(self.blob, self.children, self.sections, self.size, prefix=path)
+        raise KeyError(key)
+
+
+    def __iter__(self):
+        return iter(self.children.get(self.prefix, {}))
+
+
+    def __len__(self):
+        return len(self.children.get(self.prefix, {}))
+
+
+    def __repr__(self):
+        return f"LazyGesetzStructure({list(self.keys())!r})"
+
+
+    def to_dict(self):
+        return {k: v.to_dict() if isinstance(v, LazyGesetzStructure) else v for k, v in self.items()}
+
+
+
+class StructureWriter:
+    # Appends compressed sections to the blob as they arrive; the table of contents is written on close.
+    # Every writer has a blob of its own, named in its toc: replacing the toc publishes blob and toc in one
+    # step, readers and concurrent writers of the same law always see a matching pair. The blob of the
+    # replaced toc is removed afterwards.
+    # Headings are entries without content, so a heading without law text is kept as an empty sub-structure.
+    # size approximates len(str(gesetz_structure)) for structures that are never held in memory as a whole.
+    # Keys and texts are normalized on the way in (formatting.normalize_text), once per law instead of per prompt.
+
+    def __init__(self, toc_path, blob_path) -> None:
+        self.toc_path = toc_path
+        self.blob_path = blob_path
+        self.tmp_suffix = f".{os.getpid()}-{id(self)}.tmp"
+        self.blob = open(blob_path, "wb")
+        self.offset = 0
+        self.sections = []
+        self.size = 0
+
+
+    def add_section(self, path, content):
+        path = [normalize_text(json_key(p)) for p in path]
+        content = normalize_value(content)
+        data = zlib.compress(json.dumps(content, ensure_ascii=False).encode("utf-8"))
+        self.blob.write(data)
+        self.blob.flush()
+        self.sections.append([path, self.offset, len(data)])
+        self.offset += len(data)
+        self.size += len(str(content)) + len(repr(path[-1])) + 4
+
+
+    def add_heading(self, path):
+        path = [normalize_text(json_key(p)) for p in path]
+        self.sections.append([path, None, None])
+        self.size += len(repr(path[-1])) + 6
+
+
+    def close(self, size=None, **meta):
+        self.blob.close()
+
+        toc = {
+            "version": STORE_FORMAT_VERSION,
+            "normalization": NORMALIZATION_VERSION,
+            "size": size if size is not None else self.size,
+            **meta,
+            "blob": os.path.basename(self.blob_path),
+            "sections": self.sections
+        }
+        with open(self.toc_path + self.tmp_suffix, "w") as f:
+            json.dump(toc, f, ensure_ascii=False)
+
+        # the lock only orders the publishers, so that every replaced blob is removed exactly once
+        with file_lock.locked(self.toc_path + ".lock"):
+            replaced = toc_blob_path(self.toc_path)
+            os.replace(self.toc_path + self.tmp_suffix, self.toc_path)
+        if replaced is not None and replaced != self.blob_path:
+            try:
+                os.remove(replaced)
+            except FileNotFoundError:
+                pass
+
+
+    def abort(self):
+        self.blob.close()
+        os.remove(self.blob_path)
+
+
+
+class GesetzStructureStore:
+    # Compact on-disk cache of gesetz structures: per law a json table of contents
+    # (gesetz_structure_<id>.toc) and a memory-mapped blob of zlib-compressed sections
+    # (gesetz_structure_<id>.bin). Legacy pretty-printed json files are converted on first access,
+    # laws stored with an older text normalization are normalized again.
+
+    def __init__(self, directory) -> None:
+        self.directory = directory
+        self.opened = dict()
+        self.lock = threading.Lock()
+
+
+    def toc_path(self, gesetz_id):
+        return os.path.join(self.directory, f"gesetz_structure_{gesetz_id}.toc")
+
+    def blob_path(self, gesetz_id):
+        # blob of the stored structure, None if there is none
+        return toc_blob_path(self.toc_path(gesetz_id))
+
+
+    def new_blob_path(self, gesetz_id):
+        return os.path.join(self.directory, f"gesetz_structure_{gesetz_id}.{os.getpid()}-{uuid.uuid4().hex[:12]}.bin")
+
+    def json_path(self, gesetz_id):
+        return os.path.join(self.directory, f"gesetz_structure_{gesetz_id}.json")
+
+
+    def exists(self, gesetz_id):
+        return os.path.exists(self.toc_path(gesetz_id)) or os.path.exists(self.json_path(gesetz_id))
+
+
+    def mtime(self, gesetz_id):
+        for path in [self.toc_path(gesetz_id), self.json_path(gesetz_id)]:
+            if os.path.exists(path): return os.path.getmtime(path)
+        return None
+
+
+    def gesetz_ids(self):
+        gesetz_ids = set()
+        for f in os.listdir(self.directory):
+            for suffix in [".toc", ".json"]:
+                if f.startswith("gesetz_structure_") and f.endswith(suffix):
+                    gesetz_ids.add(f[len("gesetz_structure_"):-len(suffix)])
+        return sorted(gesetz_ids)
+
+
+    def writer(self, gesetz_id):
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock:
+            self.opened.pop(gesetz_id, None)
+        return StructureWriter(self.toc_path(gesetz_id), self.new_blob_path(gesetz_id))
+
+
+    def write(self, gesetz_id, gesetz_structure, **meta):
+        writer = self.writer(gesetz_id)
+
+        def walk(node, path):
+            for key, value in node.items():
+                if isinstance(value, Mapping):
+                    writer.add_heading(path + [key])
+                    walk(value, path + [key])
+                else:
+                    writer.add_section(path + [key], value)
+
+        walk(gesetz_structure, [])
+        writer.close(size=len(str(gesetz_structure)), **meta)
+
+
+    def convert(self, gesetz_id):
+        # legacy json cache -> compact format
+        with open(self.json_path(gesetz_id), "r") as f:
+            gesetz_structure = json.load(f, strict=False)
+        self.write(gesetz_id, gesetz_structure)
+
+
+    def open(self, gesetz_id):
+        with self.lock:
+            if gesetz_id in self.opened: return self.opened[gesetz_id]
+
+        if not os.path.exists(self.toc_path(gesetz_id)):
+            if not os.path.exists(self.json_path(gesetz_id)): raise KeyError(gesetz_id)
+            self.convert(gesetz_id)
+
+        toc, structure = self.load(gesetz_id)
+        if toc.get("normalization") != NORMALIZATION_VERSION:
+            self.write(gesetz_id, structure.to_dict())
+            toc, structure = self.load(gesetz_id)
+
+        with self.lock:
+            self.opened[gesetz_id] = structure
+        return structure
+
+
+    def load(self, gesetz_id):
+        toc = None
+        while True:
+            with open(self.toc_path(gesetz_id), "r") as f:
+                previous, toc = toc, json.load(f)
+            try:
+                with open(toc_blob_path(self.toc_path(gesetz_id), toc), "rb") as f:
+                    blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size > 0 else b""
+                break
+            except FileNotFoundError:
+                # the toc was replaced (and its blob removed) in between -> read the new one
+                if toc == previous: raise
+
+        children = dict()
+        sections = dict()
+        for path, offset, length in toc["sections"]:
+            path = tuple(path)
+            if offset is None: children.setdefault(path, dict())       # heading
+            else: sections.setdefault(path, []).append((offset, length))
+            for i in range(len(path)):
+                children.setdefault(path[:i], dict())[path[i]] = None
+
+        return toc, LazyGesetzStructure(blob, children, sections, toc["size"])
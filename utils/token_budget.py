@@ -0,0 +1,122 @@
+import functools
+from collections.abc import Mapping
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+from utils.section_index import flatten_section_text
+
+
+
+CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-16k": 16384,
+}
+TOKENS_PER_MESSAGE = 4      # role and separators of every chat message
+TOKENS_PER_REPLY = 3        # every reply is primed with the assistant role
+CHARS_PER_TOKEN = 3         # conservative fallback for german text if no tokenizer is available
+MAX_CHARS_PER_TOKEN = 8     # a text with more than 8 characters per token allowed never fits
+
+
+@functools.lru_cache(maxsize=None)
+def encoding_for(model):
+    # None if tiktoken is not installed or its encoding can't be loaded (e.g. offline)
+    if tiktoken is None: return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        return None
+
+
+def count_tokens(text, model):
+    encoding = encoding_for(model)
+    if encoding is None: return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages, model):
+    return sum(TOKENS_PER_MESSAGE + count_tokens(m.content, model) for m in messages) + TOKENS_PER_REPLY
+
+
+def truncate_to_tokens(text, max_tokens, model):
+    if max_tokens <= 0: return ""
+    encoding = encoding_for(model)
+    if encoding is None: return text[:max_tokens * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+
+class TokenBudget:
+    # Prompt budget of one chat model: its context window minus the tokens reserved for the completion.
+
+    def __init__(self, model, max_completion_tokens) -> None:
+        self.model = model
+        self.context_window = CONTEXT_WINDOWS[model]
+        self.max_completion_tokens = max_completion_tokens
+
+
+    @property
+    def limit(self):
+        return self.context_window - self.max_completion_tokens
+
+
+    def remaining(self, messages):
+        return self.limit - count_message_tokens(messages, self.model)
+
+
+    def fits(self, messages):
+        return self.remaining(messages) >= 0
+
+
+    def pack(self, section_content, max_tokens):
+        # as many whole sub-sections (in order) as fit into max_tokens; a first sub-section that does
+        # not fit on its own is packed recursively, a single overlong paragraph is cut
+        if isinstance(section_content, str):
+            return truncate_to_tokens(section_content.strip(), max_tokens, self.model)
+
+        if isinstance(section_content, Mapping):
+            items = list(section_content.items())
+        else:
+            items = [(None, v) for v in section_content]
+
+        parts, used = [], 0
+        for key, value in items:
+            text = flatten_section_text(value)
+            if key is not None: text = f"{key}\n{text}"
+            tokens = count_tokens(text, self.model) + 1
+            if used + tokens <= max_tokens:
+                parts.append(text)
+                used += tokens
+                continue
+
+            if len(parts) == 0:
+                header = f"{key}\n" if key is not None else ""
+                text = self.pack(value, max_tokens - count_tokens(header, self.model) - 1)
+                if len(text) > 0: parts.append(header + text)
+            break
+
+        return "\n\n".join(p for p in parts if len(p.strip()) > 0)
+
+
+
+class TokenBudgetExceeded(Exception):
+    pass
+
+
+
+class TokenMeter:
+    # Prompt tokens spent by a group of calls, e.g. all candidates of one speculative round.
+    # A call that would go over the limit raises TokenBudgetExceeded instead of being sent.
+
+    def __init__(self, limit) -> None:
+        self.limit = limit
+        self.used = 0
+
+
+    def spend(self, tokens):
+        if self.used + tokens > self.limit:
+            raise TokenBudgetExceeded(f"{self.used} + {tokens} prompt tokens exceed the budget of {self.limit}")
+        self.used += tokens
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import uuid
+import inspect
+import functools
+import threading
+import contextlib
+import contextvars
+
+
+
+# Spans around the stages of a run, written as one json line per finished span.
+# The open span is kept in a context variable, so tasks started by asyncio.gather and the sub-agents
+# of a run nest below the span that started them and share its trace id.
+# record() adds llm usage to the innermost open span only, summing a trace over all spans never counts twice.
+
+current_span = contextvars.ContextVar("current_span", default=None)
+
+COUNTERS = ("llm_calls", "prompt_tokens", "completion_tokens", "cache_hits", "retries", "rate_limit_retries", "rate_limit_wait")
+
+
+
+class Span:
+
+    def __init__(self, name, parent=None, attributes=None) -> None:
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = dict(attributes or {})
+        self.start = time.time()
+        self.wall_time = None
+        self.counts = {c: 0 for c in COUNTERS}
+        self.models = dict()        # model -> {"calls", "prompt_tokens", "completion_tokens"} of the api calls
+        self.error = None
+        self.lock = threading.Lock()
+
+
+    def record(self, model=None, **counts):
+        with self.lock:
+            for key, n in counts.items():
+                self.counts[key] += n
+            if model is not None:
+                usage = self.models.setdefault(model, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+                usage["calls"] += 1
+                usage["prompt_tokens"] += counts.get("prompt_tokens", 0)
+                usage["completion_tokens"] += counts.get("completion_tokens", 0)
+
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
+                "name": self.name,
+                "start": self.start,
+                "wall_time": self.wall_time,
+                "attributes": self.attributes,
+                **self.counts,
+                "models": self.models,
+                "error": self.error
+            }
+
+
+
+class Tracer:
+    # Appends finished spans to a jsonl file, shared by all agents of the process (see scripts/summarize_traces.py)
+
+    def __init__(self, path, enabled=True) -> None:
+        self.path = path
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.spans = 0
+
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        if not self.enabled:
+            yield None
+            return
+
+        span = Span(name, current_span.get(), attributes)
+        token = current_span.set(span)
+        s = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.wall_time = time.perf_counter() - s
+            current_span.reset(token)
+            self.write(span)
+
+
+    def write(self, span):
+        line = json.dumps(span.as_dict(), ensure_ascii=False, default=str)
+        with self.lock:
+            directory = os.path.dirname(self.path)
+            if directory: os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+            self.spans += 1
+
+
+    def metrics(self):
+        with self.lock:
+            return {"enabled": self.enabled, "path": self.path, "spans": self.spans}
+
+
+
+def record(model=None, **counts):
+    # add llm usage to the open span, a no-op outside of spans or with tracing disabled
+    span = current_span.get()
+    if span is not None: span.record(model, **counts)
+
+
+def annotate(**attributes):
+    span = current_span.get()
+    if span is not None: span.attributes.update(attributes)
+
+
+def traced(method):
+    # span named after an agent method (sync or async), written by the agent's tracer
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(self, *args, **kwargs):
+            with self.tracer.span(method.__name__):
+                return await method(self, *args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.tracer.span(method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
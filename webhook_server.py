@@ -0,0 +1,80 @@
+import asyncio
+import argparse
+
+import telebot
+from aiohttp import web
+
+
+from config import *
+import app
+
+
+
+# Webhook mode of the telegram bot: telegram posts every update to BOT_WEBHOOK_PATH, the update is
+# acknowledged at once and handed to the bot's handlers on a worker thread (which only queue the question,
+# see app.py). No long polling -> any number of replicas can run behind a load balancer.
+# Set LAW_AGENT_TELEGRAM_API_URL to run against a local fake telegram endpoint.
+
+
+
+def dispatch(bot, update):
+    # off the event loop: the handlers reply to the user via blocking http requests
+    future = asyncio.get_running_loop().run_in_executor(None, bot.process_new_updates, [update])
+
+    def report_error(future):
+        if future.exception() is not None: print(f"update {update.update_id} failed: {future.exception()}")
+    future.add_done_callback(report_error)
+
+
+def create_server(bot, jobs, path=BOT_WEBHOOK_PATH, secret=BOT_WEBHOOK_SECRET):
+
+    async def handle_update(request):
+        if secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+            return web.Response(status=403)
+        try:
+            update = telebot.types.Update.de_json(await request.text())
+        except Exception:
+            return web.Response(status=400)
+
+        # acknowledge right away, telegram resends updates that are not answered in time
+        dispatch(bot, update)
+        return web.Response(text="ok")
+
+    async def health(request):
+        return web.json_response(jobs.metrics())
+
+    async def start_jobs(server):
+        jobs.start()
+
+    async def stop_jobs(server):
+        jobs.close(wait=False)
+
+    server = web.Application()
+    server.router.add_post(path, handle_update)
+    server.router.add_get("/health", health)
+    server.on_startup.append(start_jobs)
+    server.on_cleanup.append(stop_jobs)
+    return server
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the telegram bot in webhook mode")
+    parser.add_argument("--host", default=BOT_WEBHOOK_HOST)
+    parser.add_argument("--port", type=int, default=BOT_WEBHOOK_PORT)
+    parser.add_argument("--url", default=BOT_WEBHOOK_URL, help="public base url, the webhook is registered with telegram on start")
+    args = parser.parse_args()
+
+    # every replica may register the same url, without one the webhook is expected to be set already
+    if args.url:
+        app.bot.set_webhook(url=args.url.rstrip("/") + BOT_WEBHOOK_PATH, secret_token=BOT_WEBHOOK_SECRET or None)
+
+    try:
+        web.run_app(create_server(app.bot, app.jobs), host=args.host, port=args.port)
+    finally:
+        app.notifier.shutdown(wait=True)
+
+
+
+if __name__ == "__main__":
+    main()